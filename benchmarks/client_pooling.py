@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Per-reply latency and socket churn: a fresh client per call vs the pooled registry.
+
+Usage: python -m benchmarks.client_pooling [number_of_requests] [latency_seconds]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from openai import AsyncOpenAI
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+MESSAGES = [{"role": "user", "content": "hej"}]
+
+
+def report(name, latencies, sockets):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<20} mean={statistics.mean(latencies) * 1000:7.2f}ms  p95={p95 * 1000:7.2f}ms  sockets={sockets}")
+
+
+async def run_fresh_clients(count, server):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client = AsyncOpenAI(api_key='fake', base_url=server.base_url)
+        await client.chat.completions.create(model='gpt-3.5-turbo-0125', messages=MESSAGES)
+        await client.close()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run_pooled_client(count):
+    from services.open_ai_client import create_chat_completion, registry
+    registry.start()
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await create_chat_completion(model='gpt-3.5-turbo-0125', messages=MESSAGES)
+        latencies.append(time.perf_counter() - start)
+    await registry.close()
+    return latencies
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    server = FakeOpenAIServer(latency=latency)
+    server.start()
+    os.environ['open_ai_base_url'] = server.base_url
+    os.environ['open_ai_api_token'] = 'fake'
+    try:
+        latencies = asyncio.run(run_fresh_clients(count, server))
+        report("client per call", latencies, len(server.peers))
+        server.peers.clear()
+        latencies = asyncio.run(run_pooled_client(count))
+        report("pooled registry", latencies, len(server.peers))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Minimal stand-ins for the discord.py objects ReactionCog touches."""
+import asyncio
+import contextvars
+import itertools
+import time
+
+_snowflakes = itertools.count(1000000000000000000)
+
+# Id of the incoming message being handled, used to attribute the bot's sends to it
+current_message = contextvars.ContextVar('current_message', default=None)
+
+
+def next_id():
+    return next(_snowflakes)
+
+
+class FakeTyping:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def __aenter__(self):
+        self.channel.typing_count += 1
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeUser:
+    def __init__(self, display_name, bot=False, user_id=None):
+        self.id = user_id or next_id()
+        self.display_name = display_name
+        self.name = display_name
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+
+    def mentioned_in(self, message):
+        return self in message.mentions
+
+
+class FakeGuild:
+    def __init__(self, guild_id=None):
+        self.id = guild_id or next_id()
+
+
+class FakeChannel:
+    def __init__(self, guild, bot_user=None, channel_id=None, dispatch=None):
+        self.id = channel_id or next_id()
+        self.guild = guild
+        self.bot_user = bot_user
+        # Called with every message the bot sends, like the gateway echoing it back
+        self.dispatch = dispatch
+        self.messages = []
+        self.sent = []
+        self.typing_count = 0
+        self.history_calls = 0
+
+    def typing(self):
+        return FakeTyping(self)
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((time.monotonic(), content, current_message.get()))
+        message = FakeMessage(self, self.bot_user or FakeUser('bot', bot=True), content or '')
+        self.messages.append(message)
+        if self.dispatch is not None:
+            asyncio.get_running_loop().call_soon(self.dispatch, message)
+        return message
+
+    async def history(self, limit=100):
+        self.history_calls += 1
+        for message in reversed(self.messages[-limit:]):
+            yield message
+
+
+class FakeAttachment:
+    def __init__(self, url, content_type='image/png', size=1024, data=b'', width=None, height=None):
+        self.id = next_id()
+        self.url = url
+        self.filename = url.rsplit('/', 1)[-1]
+        self.content_type = content_type
+        self.size = size or len(data)
+        self.data = data
+        self.width = width
+        self.height = height
+
+    async def read(self):
+        return self.data
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, mentions=(), attachments=()):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.attachments = list(attachments)
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the OpenAI HTTP API used by the benchmarks.
+
+The server runs on its own event loop in a background thread, so a blocking
+client in the benchmarked loop cannot starve it.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+
+
+class FakeOpenAIServer:
+    def __init__(self, latency=0.5, prompt_tokens=50, completion_tokens=20,
+                 reply="Ale z ciebie zartowniś. Wracaj do pracy!", token_latency=0.0):
+        self.latency = latency
+        # Streaming: latency is the time to the first token, token_latency the gap between tokens
+        self.token_latency = token_latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.reply = reply
+        # Fault injection: per model latency, a slow tail and a share of 500 responses per model
+        self.model_latency = {}
+        self.slow_fraction = 0.0
+        self.slow_latency = 0.0
+        self.model_errors = {}
+        self.random = random.Random(1)
+        self.requests = 0
+        self.requests_by_model = {}
+        self.prompt_chars = 0
+        self.prompt_messages = 0
+        # Same estimate the bot uses without tiktoken, plus the per-message overhead
+        self.prompt_tokens_estimate = 0
+        self.request_bytes = 0
+        # (detail, url length) of every image part received
+        self.images = []
+        self.peers = set()
+        self.base_url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def _usage(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+        }
+
+    def _track(self, request):
+        self.requests += 1
+        self.peers.add(request.transport.get_extra_info('peername'))
+
+    async def _stream_chat_completion(self, request, body):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        base = {"id": f"chatcmpl-{self.requests}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body.get("model", "fake")}
+        await asyncio.sleep(self.latency)
+        tokens = self.reply.split(' ')
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self.token_latency)
+                token = ' ' + token
+            chunk = dict(base, choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        chunk = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if body.get("stream_options", {}).get("include_usage"):
+            chunk = dict(base, choices=[], usage=self._usage())
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _chat_completions(self, request):
+        self._track(request)
+        self.request_bytes += len(await request.read())
+        body = await request.json()
+        for message in body.get("messages", []):
+            content = message.get("content") or ''
+            self.prompt_messages += 1
+            chars = len(content) if isinstance(content, str) else sum(len(part.get("text", '')) for part in content)
+            self.prompt_chars += chars
+            self.prompt_tokens_estimate += chars // 3 + 1 + 4
+            if not isinstance(content, str):
+                self.images.extend((part["image_url"].get("detail", 'auto'), len(part["image_url"]["url"]))
+                                   for part in content if part.get("type") == "image_url")
+        model = body.get("model", "fake")
+        self.requests_by_model[model] = self.requests_by_model.get(model, 0) + 1
+        if self.random.random() < self.model_errors.get(model, 0.0):
+            await asyncio.sleep(self.model_latency.get(model, self.latency))
+            return web.json_response({"error": {"message": "injected failure", "type": "server_error"}}, status=500)
+        if body.get("stream"):
+            return await self._stream_chat_completion(request, body)
+        latency = self.model_latency.get(model, self.latency)
+        if self.random.random() < self.slow_fraction:
+            latency = self.slow_latency
+        await asyncio.sleep(latency + self.token_latency * (len(self.reply.split(' ')) - 1))
+        return web.json_response({
+            "id": f"chatcmpl-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(),
+        })
+
+    async def _completions(self, request):
+        self._track(request)
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            "id": f"cmpl-{self.requests}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "text": self.reply, "finish_reason": "stop", "logprobs": None}],
+            "usage": self._usage(),
+        })
+
+    async def _serve(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self._chat_completions)
+        app.router.add_post('/v1/completions', self._completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        self._ready.set()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve())
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""End-to-end benchmark of ReactionCog.on_message against stand-ins for Discord and OpenAI.
+
+Synthetic messages (talking channels, mentions, attachments, pre-filled history) are
+dispatched to the cog while a local fake OpenAI server answers with configurable
+latency and token usage. Every scenario runs in its own process so module-level
+caches do not leak between them.
+
+Usage:
+    python -m benchmarks.harness --scenario talking_flood --messages 500 --latency 0.3
+    python -m benchmarks.harness --scenario all --json after.json --compare before.json
+    python -m benchmarks.harness --scenario talking_flood --memory
+
+Settings can be overridden through the environment like for the bot itself.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_discord import (FakeAttachment, FakeChannel, FakeGuild, FakeMessage, FakeUser,
+                                     current_message)
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.loop_responsiveness import monitor_loop_lag
+
+BOT_USER_ID = 1318180349473325137
+TEXTS = [
+    "hej", "siema", "co tam?", "xD", "😂😂😂", "https://youtu.be/dQw4w9WgXcQ",
+    "Ktoś idzie dziś na próbę chóru?",
+    "Nie wiem czy zdążę, autobus znowu się spóźnia a jeszcze muszę odebrać nuty od Basi.",
+    "A pamiętacie jak na ostatnim koncercie tenory weszły o takt za wcześnie? Do dziś się z tego śmieję.",
+    "Warchlak, powiedz coś mądrego!", "Dobranoc wszystkim 🌙",
+    "Czy ktoś ma partyturę do Gaude Mater? Zgubiłem swoją i dyrygent będzie zły.",
+]
+SCENARIOS = {}
+METRICS = ('messages_per_sec', 'reply_p50', 'reply_p95', 'reply_p99', 'loop_lag_max', 'loop_lag_p99',
+           'rss_growth_mb', 'model_requests', 'avg_prompt_chars', 'prompt_tokens')
+
+
+def scenario(name):
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+
+class World:
+    def __init__(self, rng, guilds, channels_per_guild, users, history, dispatch):
+        self.rng = rng
+        self.bot_user = FakeUser('Warchlak', bot=True, user_id=BOT_USER_ID)
+        self.users = [FakeUser(f"chorzysta_{i}") for i in range(users)]
+        self.talking_channels = []
+        self.channels = []
+        for _ in range(guilds):
+            guild = FakeGuild()
+            self.talking_channels.append(FakeChannel(guild, self.bot_user, dispatch=dispatch))
+            self.channels.extend(FakeChannel(guild, self.bot_user, dispatch=dispatch) for _ in range(channels_per_guild))
+        for channel in self.talking_channels + self.channels:
+            for _ in range(history):
+                author = self.bot_user if rng.random() < 0.3 else rng.choice(self.users)
+                channel.messages.append(FakeMessage(channel, author, rng.choice(TEXTS)))
+
+    def message(self, channel, mention=False, attachments=()):
+        content = self.rng.choice(TEXTS)
+        mentions = [self.bot_user] if mention else []
+        if mention:
+            content = f"<@{BOT_USER_ID}> {content}"
+        return FakeMessage(channel, self.rng.choice(self.users), content, mentions, attachments)
+
+    def attachment(self):
+        data = self.rng.randbytes(self.rng.randint(2000, 20000))
+        return FakeAttachment(f"https://cdn.example/{self.rng.randint(0, 50)}.png", size=len(data), data=data)
+
+
+@scenario('talking_flood')
+def talking_flood(world, count):
+    for _ in range(count):
+        yield world.message(world.rng.choice(world.talking_channels))
+
+
+@scenario('mention_storm')
+def mention_storm(world, count):
+    for _ in range(count):
+        attachments = [world.attachment()] if world.rng.random() < 0.2 else []
+        yield world.message(world.rng.choice(world.channels), mention=True, attachments=attachments)
+
+
+@scenario('small_talk')
+def small_talk(world, count):
+    for _ in range(count):
+        yield world.message(world.rng.choice(world.channels))
+
+
+@scenario('mixed')
+def mixed(world, count):
+    generators = [talking_flood(world, count), mention_storm(world, count), small_talk(world, count)]
+    for _ in range(count):
+        yield next(world.rng.choices(generators, weights=(2, 1, 7))[0])
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def configure_environment(world, server, directory, pacing):
+    defaults = {
+        'open_ai_base_url': server.base_url,
+        'open_ai_api_token': 'fake',
+        'enabled_ai': 'true',
+        'enabled_image_ai_analyze': 'true',
+        'open_ai_model': 'gpt-3.5-turbo-0125',
+        'ai_behavior': 'Jesteś sarkastycznym, dowcipnym i złośliwym botem konwersacyjnym.',
+        'message_history_enabled': 'true',
+        'message_history_limit': '6',
+        'open_ai_max_number_of_messages_per_guild_per_day': '1000000',
+        'open_ai_number_of_msg_per_sec_user': '0',
+        'response_sentence_delay': str(pacing),
+        'response_first_sentence_delay': str(pacing),
+        'guild_quota_db_path': os.path.join(directory, 'guild_quota.db'),
+        'response_cache_path': '',
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    os.environ['channel_id_for_talking'] = ' '.join(str(channel.id) for channel in world.talking_channels)
+
+
+async def run_scenario(args, server, directory):
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    background = set()
+
+    def dispatch(message):
+        # The gateway echoes the bot's own messages back to on_message
+        task = asyncio.create_task(cog.on_message(message))
+        background.add(task)
+        task.add_done_callback(background.discard)
+
+    world = World(rng, args.guilds, args.channels, args.users, args.history, dispatch)
+    configure_environment(world, server, directory, args.pacing)
+    from modules.reactionCog import ReactionCog
+    from services.conversation_memory import conversation_memory
+    from services.open_ai_client import registry
+    from services.request_scheduler import request_scheduler
+
+    class FakeBot:
+        user = world.bot_user
+
+    cog = ReactionCog(FakeBot())
+    messages = list(SCENARIOS[args.scenario](world, args.messages))
+    dispatched = {}
+
+    async def handle(message):
+        current_message.set(message.id)
+        dispatched[message.id] = time.monotonic()
+        await cog.on_message(message)
+
+    lags, stop = [], asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lags, stop))
+    rss_before = rss_mb()
+    started = time.monotonic()
+    tasks = []
+    for message in messages:
+        tasks.append(asyncio.create_task(handle(message)))
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    await asyncio.gather(*background)
+    # Summary updates of memory mode run in the background too
+    await asyncio.gather(*conversation_memory.pending.values())
+    stop.set()
+    await monitor
+
+    first_reply = {}
+    for channel in world.talking_channels + world.channels:
+        for sent_at, _, message_id in channel.sent:
+            if message_id in dispatched and message_id not in first_reply:
+                first_reply[message_id] = sent_at - dispatched[message_id]
+    replies = list(first_reply.values())
+    result = {
+        'scenario': args.scenario,
+        'messages': len(messages),
+        'replies': len(replies),
+        'messages_per_sec': len(messages) / elapsed,
+        'reply_p50': percentile(replies, 0.50),
+        'reply_p95': percentile(replies, 0.95),
+        'reply_p99': percentile(replies, 0.99),
+        'loop_lag_max': max(lags, default=0.0),
+        'loop_lag_p99': percentile(lags, 0.99),
+        'rss_growth_mb': rss_mb() - rss_before,
+        'model_requests': server.requests,
+        'avg_prompt_chars': server.prompt_chars / server.requests if server.requests else 0.0,
+        # Includes the summary updates in memory mode
+        'prompt_tokens': server.prompt_tokens_estimate,
+    }
+    await request_scheduler.close()
+    await registry.close()
+    return result
+
+
+def run_child(args):
+    server = FakeOpenAIServer(latency=args.latency, token_latency=args.token_latency,
+                              prompt_tokens=args.prompt_tokens, completion_tokens=args.completion_tokens)
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            result = asyncio.run(run_scenario(args, server, directory))
+    finally:
+        server.stop()
+    print(json.dumps(result))
+
+
+def print_results(results, previous):
+    print(f"{'scenario':<20} {'msgs':>6} {'replies':>7} {'msg/s':>9} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'lag max':>8} {'rss MB':>7} {'requests':>8} {'prompt ch':>9} {'prompt tok':>10}")
+    for result in results:
+        print(f"{result['scenario']:<20} {result['messages']:>6} {result['replies']:>7} "
+              f"{result['messages_per_sec']:>9.1f} {result['reply_p50']:>7.3f} {result['reply_p95']:>7.3f} "
+              f"{result['reply_p99']:>7.3f} {result['loop_lag_max'] * 1000:>6.1f}ms {result['rss_growth_mb']:>7.1f} "
+              f"{result['model_requests']:>8} {result['avg_prompt_chars']:>9.0f} {result['prompt_tokens']:>10}")
+        before = previous.get(result['scenario'])
+        if before:
+            changes = []
+            for metric in METRICS:
+                if before.get(metric):
+                    changes.append(f"{metric} {(result[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+            print(f"{'':<20} vs previous: {', '.join(changes)}")
+
+
+def run_in_child(name, **environment):
+    command = [sys.executable, '-m', 'benchmarks.harness', *sys.argv[1:], '--scenario', name, '--child']
+    output = subprocess.run(command, check=True, capture_output=True, text=True,
+                            env=dict(os.environ, **environment)).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_memory_savings(results):
+    by_name = {result['scenario']: result for result in results}
+    for name, result in by_name.items():
+        baseline = by_name.get(name.removesuffix('+memory'))
+        if name.endswith('+memory') and baseline and baseline['prompt_tokens']:
+            change = (result['prompt_tokens'] - baseline['prompt_tokens']) / baseline['prompt_tokens'] * 100
+            print(f"{baseline['scenario']}: prompt tokens {baseline['prompt_tokens']} -> {result['prompt_tokens']} "
+                  f"({change:+.1f}%) with memory, {result['model_requests'] - baseline['model_requests']:+} requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', default='all', choices=['all', *SCENARIOS])
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=200, help="messages per second, 0 = all at once")
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--channels', type=int, default=4, help="regular channels per guild")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--history', type=int, default=20, help="messages already in every channel")
+    parser.add_argument('--latency', type=float, default=0.3, help="fake model latency in seconds")
+    parser.add_argument('--token-latency', type=float, default=0.0)
+    parser.add_argument('--prompt-tokens', type=int, default=300)
+    parser.add_argument('--completion-tokens', type=int, default=40)
+    parser.add_argument('--pacing', type=float, default=0.0, help="response_sentence_delay for the run")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="results file of a previous run")
+    parser.add_argument('--memory', action='store_true',
+                        help="run every scenario again with memory_enabled and report the prompt token change")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    scenarios = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    results = []
+    for name in scenarios:
+        results.append(run_in_child(name))
+        if args.memory:
+            memory_result = run_in_child(name, memory_enabled='true')
+            memory_result['scenario'] = f"{name}+memory"
+            results.append(memory_result)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            previous = {result['scenario']: result for result in json.load(file)}
+    print_results(results, previous)
+    print_memory_savings(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Upload payload and image tokens per analysis: original attachment URL vs the image pipeline.
+
+Needs Pillow to build the sample corpus.
+Usage: python -m benchmarks.image_pipeline [latency_seconds]
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from benchmarks.fake_discord import FakeAttachment, FakeChannel, FakeGuild, FakeMessage, FakeUser
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+# (name, size, format, mode)
+CORPUS = [
+    ('phone_photo.jpg', (4032, 3024), 'JPEG', 'RGB'),
+    ('screenshot.png', (1920, 1080), 'PNG', 'RGB'),
+    ('panorama.jpg', (6000, 1500), 'JPEG', 'RGB'),
+    ('meme.jpg', (800, 800), 'JPEG', 'RGB'),
+    ('sticker.png', (320, 320), 'PNG', 'RGBA'),
+    ('reaction.gif', (480, 270), 'GIF', 'P'),
+    ('emoji.webp', (128, 128), 'WEBP', 'RGBA'),
+]
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'WEBP': 'image/webp'}
+
+
+def sample_image(size, image_format, mode):
+    # Gradient, shapes and noise, compresses roughly like a real picture
+    width, height = size
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for index in range(40):
+        x, y = (index * 7919) % width, (index * 104729) % height
+        draw.ellipse((x, y, x + width // 8, y + height // 8), fill=(index * 37 % 256, index * 91 % 256, 120))
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    image = Image.blend(image, noise, 0.25).filter(ImageFilter.SMOOTH)
+    image = image.convert(mode) if mode != 'P' else image.quantize(64)
+    output = io.BytesIO()
+    image.save(output, image_format, **({'quality': 95} if image_format == 'JPEG' else {}))
+    return output.getvalue()
+
+
+def build_corpus():
+    attachments = []
+    for name, size, image_format, mode in CORPUS:
+        data = sample_image(size, image_format, mode)
+        attachments.append(FakeAttachment(f"https://cdn.example/{name}", CONTENT_TYPES[image_format], len(data), data,
+                                          width=size[0], height=size[1]))
+    return attachments
+
+
+def configure_environment(base_url):
+    os.environ.update({
+        'open_ai_base_url': base_url,
+        'open_ai_api_token': 'fake',
+        'response_cache_enabled': 'true',
+        'response_cache_path': '',
+    })
+
+
+async def run(server, attachments):
+    from services.image_pipeline import estimate_image_tokens
+    from services.open_ai_service import analyze_image
+
+    channel = FakeChannel(FakeGuild())
+    user = FakeUser('Zbyszek')
+    print(f"{'attachment':<18}{'original':>22}{'sent':>22}{'detail':>8}{'tokens before':>15}{'after':>7}")
+    before_bytes = before_tokens = after_tokens = 0
+    for attachment in attachments:
+        server.images.clear()
+        await analyze_image(FakeMessage(channel, user, 'co to?', attachments=[attachment]))
+        detail = server.images[0][0]
+        # The original URL goes out as detail=auto, which is high for anything over 512px
+        tokens = estimate_image_tokens(attachment.width, attachment.height, 'high')
+        sent = await prepared(attachment)
+        before_bytes += attachment.size
+        before_tokens += tokens
+        after_tokens += sent.tokens
+        print(f"{attachment.filename:<18}{f'{attachment.width}x{attachment.height} {attachment.size // 1024}KiB':>22}"
+              f"{f'{sent.width}x{sent.height} {sent.size // 1024}KiB':>22}{detail:>8}{tokens:>15}{sent.tokens:>7}")
+
+    requests, request_bytes = server.requests, server.request_bytes
+    started = time.perf_counter()
+    await analyze_image(FakeMessage(channel, user, 'a te?', attachments=attachments[:4]))
+    together = time.perf_counter() - started
+    started = time.perf_counter()
+    await analyze_image(FakeMessage(channel, user, 'a te?', attachments=attachments[:4]))
+    cached = time.perf_counter() - started
+    print()
+    print(f"image payload: {before_bytes / 1024:.0f}KiB -> {request_bytes / 1024:.0f}KiB (whole requests)")
+    print(f"image tokens: {before_tokens} -> {after_tokens}")
+    print(f"4 attachments in one request: {together * 1000:.0f}ms, {server.requests - requests} request(s), "
+          f"{(server.request_bytes - request_bytes) / 1024:.0f}KiB; repeated: {cached * 1000:.1f}ms "
+          f"(cache, {server.requests - requests - 1} extra requests)")
+
+
+async def prepared(attachment):
+    from services.image_pipeline import download_images, prepare_images
+    return (await prepare_images(await download_images([attachment])))[0]
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    attachments = build_corpus()
+    server = FakeOpenAIServer(latency=latency)
+    server.start()
+    configure_environment(server.base_url)
+    try:
+        asyncio.run(run(server, attachments))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
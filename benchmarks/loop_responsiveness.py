@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Shows that the event loop keeps ticking while many completions are in flight.
+
+Usage: python -m benchmarks.loop_responsiveness [number_of_requests] [latency_seconds]
+"""
+import asyncio
+import os
+import sys
+import time
+
+from openai import OpenAI
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+TICK = 0.01
+
+
+async def monitor_loop_lag(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+def report(name, elapsed, lags):
+    lags = sorted(lags) or [0.0]
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(f"{name:<24} wall={elapsed:6.2f}s  loop lag max={max(lags) * 1000:8.1f}ms  p99={p99 * 1000:8.1f}ms")
+    return p99
+
+
+async def run_async_backend(count):
+    from services.open_ai_client import create_chat_completion
+    # Client construction and the first request's lazy imports are one-off costs
+    await create_chat_completion(model='gpt-3.5-turbo-0125', messages=[{"role": "user", "content": "hej"}])
+    lags, stop = [], asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        create_chat_completion(model='gpt-3.5-turbo-0125', messages=[{"role": "user", "content": "hej"}])
+        for _ in range(count)
+    ))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    return report("async shared client", elapsed, lags)
+
+
+async def run_blocking_client(count, base_url):
+    # The previous implementation: a synchronous client called inside a coroutine
+    client = OpenAI(api_key='fake', base_url=base_url)
+
+    async def call():
+        client.chat.completions.create(model='gpt-3.5-turbo-0125', messages=[{"role": "user", "content": "hej"}])
+
+    lags, stop = [], asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lags, stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(count)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    return report("blocking client", elapsed, lags)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    server = FakeOpenAIServer(latency=latency)
+    base_url = server.start()
+    os.environ['open_ai_base_url'] = base_url
+    os.environ['open_ai_api_token'] = 'fake'
+    os.environ.setdefault('open_ai_max_concurrent_requests', '16')
+    try:
+        p99_lag = asyncio.run(run_async_backend(count))
+        asyncio.run(run_blocking_client(min(count, 5), base_url))
+    finally:
+        server.stop()
+    if p99_lag > latency / 2:
+        print("FAIL: event loop stalled behind model calls")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Guild quota checks per second: the old JSON file per guild vs GuildQuotaStore.
+
+Usage: python -m benchmarks.quota_store [number_of_checks] [days_of_history]
+"""
+import asyncio
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+GUILDS = 50
+
+
+def legacy_can_guild_send_message(guild_id, max_number_msg):
+    # Copy of the previous implementation: parse and rewrite the whole file per check
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    file_path = f"guild_data_{guild_id}.json"
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            try:
+                guild_data = json.load(file)
+            except json.JSONDecodeError:
+                guild_data = {}
+    else:
+        guild_data = {}
+    if today not in guild_data:
+        guild_data[today] = 0
+    if guild_data[today] < max_number_msg:
+        guild_data[today] += 1
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(guild_data, file)
+        return True
+    return False
+
+
+def seed_legacy_files(days):
+    start = datetime.date.today() - datetime.timedelta(days=days)
+    history = {(start + datetime.timedelta(days=i)).strftime("%Y-%m-%d"): 1000 for i in range(days)}
+    for guild_id in range(GUILDS):
+        with open(f"guild_data_{guild_id}.json", 'w', encoding='utf-8') as file:
+            json.dump(history, file)
+
+
+def run_legacy(count):
+    start = time.perf_counter()
+    for i in range(count):
+        legacy_can_guild_send_message(i % GUILDS, count)
+    return count / (time.perf_counter() - start)
+
+
+async def run_store(count):
+    from services.guild_quota import GuildQuotaStore
+    store = GuildQuotaStore()
+    await store.start()
+    start = time.perf_counter()
+    for i in range(count):
+        store.try_consume(i % GUILDS, count)
+        if i % 1000 == 0:
+            await store.flush()
+    rate = count / (time.perf_counter() - start)
+    await store.close()
+    return rate
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        seed_legacy_files(days)
+        legacy = run_legacy(count)
+        store = asyncio.run(run_store(count))
+    print(f"json file per guild ({days} days kept): {legacy:12.0f} checks/s")
+    print(f"GuildQuotaStore (sqlite WAL, batched): {store:12.0f} checks/s")
+
+
+if __name__ == "__main__":
+    main()
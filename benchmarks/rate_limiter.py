@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Memory and throughput of RateLimiter vs the old list-per-user dict over many simulated users.
+
+Usage: python -m benchmarks.rate_limiter [number_of_users] [messages_per_user]
+"""
+import random
+import sys
+import time
+import tracemalloc
+
+from services.rate_limiter import SLIDING_WINDOW, TOKEN_BUCKET, RateLimiter
+
+
+def legacy_can_user_send_message(last_user_message_times, user_id, delay, now):
+    # Previous implementation: one timestamp appended per accepted message, never trimmed
+    if user_id not in last_user_message_times:
+        last_user_message_times[user_id] = []
+    last = last_user_message_times[user_id][-1] if last_user_message_times[user_id] else 0
+    if now - last >= delay:
+        last_user_message_times[user_id].append(now)
+        return True
+    return False
+
+
+def simulated_events(users, per_user):
+    rng = random.Random(42)
+    now = 0.0
+    for _ in range(users * per_user):
+        now += rng.expovariate(20000)
+        yield rng.randrange(users), now
+
+
+def measure(name, events, make_check):
+    check = make_check()
+    start = time.perf_counter()
+    for user_id, now in events:
+        check(user_id, now)
+    elapsed = time.perf_counter() - start
+    del check
+    # Separate pass for memory, tracemalloc would distort the throughput numbers
+    tracemalloc.start()
+    check = make_check()
+    for user_id, now in events:
+        check(user_id, now)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:<30} {len(events) / elapsed:10.0f} checks/s  retained={memory / 1024 / 1024:7.1f} MiB")
+
+
+def legacy_check():
+    history = {}
+    return lambda user_id, now: legacy_can_user_send_message(history, user_id, 2, now)
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    events = list(simulated_events(users, per_user))
+    print(f"{len(events)} checks over {users} simulated users")
+
+    measure("legacy dict of lists", events, legacy_check)
+    for algorithm in (TOKEN_BUCKET, SLIDING_WINDOW):
+        measure(f"{algorithm} (100k keys max)", events,
+                lambda: RateLimiter(1, 2, algorithm, max_keys=100000, idle_ttl=60).allow)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Canned response lookups per second: reading the JSON file per call vs ResourceStore.
+
+Usage: python -m benchmarks.resource_store [number_of_lookups] [responses_per_set]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def legacy_return_response_for_attachment(directory):
+    # Copy of the previous implementation: open and parse the file per image mention
+    with open(os.path.join(directory, 'responses_to_image.json'), 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    return random.choice(data['reactions'])
+
+
+class Guild:
+    def __init__(self, guild_id, preferred_locale):
+        self.id = guild_id
+        self.preferred_locale = preferred_locale
+
+
+def measure(name, count, lookup):
+    started = time.perf_counter()
+    for index in range(count):
+        lookup(index)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} {count / elapsed:>12,.0f} lookups/s {elapsed / count * 1e6:>8.2f} us/lookup")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        data = {
+            'reactions': [f"Reakcja {index} na obrazek 🎨" for index in range(size)],
+            'languages': {'en': [f"Reaction {index}" for index in range(size)]},
+            'guilds': {str(guild_id): [f"Guild {guild_id} {index}" for index in range(size)]
+                       for guild_id in range(100)},
+        }
+        with open(os.path.join(directory, 'responses_to_image.json'), 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.environ['resources_path'] = directory
+        from services.resource_store import resource_store
+        started = time.perf_counter()
+        resource_store.load()
+        print(f"startup load: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        guilds = [Guild(guild_id, random.choice(('pl', 'en-US', None))) for guild_id in range(50, 250)]
+        measure('previous (file per call)', count, lambda index: legacy_return_response_for_attachment(directory))
+        measure('ResourceStore', count,
+                lambda index: resource_store.choice('responses_to_image', guilds[index % len(guilds)]))
+
+
+if __name__ == '__main__':
+    main()
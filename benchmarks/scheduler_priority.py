@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Wait time per priority class when direct replies arrive behind a burst of small talk.
+
+Usage: python -m benchmarks.scheduler_priority [small_talk_burst] [direct_requests] [call_seconds]
+"""
+import asyncio
+import os
+import sys
+
+from services.request_scheduler import DIRECT, MENTION, PRIORITY_NAMES, SMALL_TALK, Overloaded
+
+
+async def run(small_talk_burst, direct_requests, call_seconds):
+    from services.request_scheduler import request_scheduler
+
+    async def model_call():
+        await asyncio.sleep(call_seconds)
+        return "ok"
+
+    async def submit(priority, guild_id):
+        try:
+            return await request_scheduler.submit(priority, guild_id, model_call, 500)
+        except Overloaded:
+            return None
+
+    tasks = [asyncio.create_task(submit(SMALL_TALK, guild_id % 5)) for guild_id in range(small_talk_burst)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(submit(DIRECT if i % 2 else MENTION, i)) for i in range(direct_requests)]
+    await asyncio.gather(*tasks)
+    stats = request_scheduler.stats()
+    for priority, name in PRIORITY_NAMES.items():
+        wait = stats['wait'][name]
+        if wait['count']:
+            print(f"{name:<11} served={wait['count']:4d}  avg wait={wait['avg'] * 1000:8.1f}ms  max wait={wait['max'] * 1000:8.1f}ms")
+    print(f"shed={stats['shed']}")
+    await request_scheduler.close()
+
+
+def main():
+    small_talk_burst = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    direct_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    call_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    os.environ.setdefault('scheduler_max_concurrency', '4')
+    os.environ.setdefault('scheduler_shed_depth', '30')
+    asyncio.run(run(small_talk_burst, direct_requests, call_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Event throughput of the sharded mode against the number of shard processes.
+
+The same synthetic traffic (the harness' mixed scenario over many guilds) is
+split by shard, guild_id >> 22 % shard_count, across 1, 2 and 4 processes
+that share the guild quota database and the shared limit store like the real
+shard processes do. Each process dispatches its part to ReactionCog.on_message
+against its own fake OpenAI server. Throughput is all events over the slowest
+process. Scaling is bounded by the CPU count of the host, which is printed.
+
+Every run also checks that a user limit is enforced across processes: all of
+them hit the same key, the allows summed over processes must equal the limit.
+
+Usage: python -m benchmarks.shard_scaling [messages] [shard_count]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.harness import SCENARIOS, World, configure_environment
+
+USER_LIMIT = 50
+
+
+async def run_shard(args, server, directory):
+    import logging
+    import random
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(1)
+    random.seed(1)
+    world = World(rng, args.guilds, 2, 200, 10, None)
+    # Spread the guilds over the shards like Discord snowflakes do
+    for index, channel in enumerate(world.talking_channels):
+        channel.guild.id = index << 22
+    configure_environment(world, server, directory, 0.0)
+    from modules.reactionCog import ReactionCog
+    from services.open_ai_client import registry
+    from services.request_scheduler import request_scheduler
+    from services.shared_state import SharedRateLimiter, shared_counters
+    from services.sharding import shard_for_guild
+
+    class FakeBot:
+        user = world.bot_user
+
+    cog = ReactionCog(FakeBot())
+    shard_ids = {int(shard_id) for shard_id in args.shard_ids.split(',')}
+    messages = [message for message in SCENARIOS['mixed'](world, args.messages)
+                if shard_for_guild(message.guild.id, args.shard_count) in shard_ids]
+
+    started = time.monotonic()
+    await asyncio.gather(*(cog.on_message(message) for message in messages))
+    elapsed = time.monotonic() - started
+
+    limiter = SharedRateLimiter('user', USER_LIMIT, 3600)
+    allowed = sum(limiter.allow(f"limit-check-{args.run}") for _ in range(USER_LIMIT))
+    await request_scheduler.close()
+    await registry.close()
+    shared_counters.close()
+    return {'events': len(messages), 'elapsed': elapsed, 'allowed': allowed, 'requests': server.requests}
+
+
+def run_child(args):
+    server = FakeOpenAIServer(latency=args.latency)
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            result = asyncio.run(run_shard(args, server, directory))
+    finally:
+        server.stop()
+    print(json.dumps(result))
+
+
+def run_processes(args, processes, directory):
+    from services.sharding import shard_ranges
+    environment = dict(os.environ, shard_count=str(args.shard_count), shard_processes=str(processes),
+                       shared_state_path=os.path.join(directory, 'shared_state.db'),
+                       guild_quota_db_path=os.path.join(directory, 'guild_quota.db'))
+    children = []
+    for shard_ids in shard_ranges(args.shard_count, processes):
+        command = [sys.executable, '-m', 'benchmarks.shard_scaling', '--child', '--run', str(processes),
+                   '--shard-ids', ','.join(str(shard_id) for shard_id in shard_ids),
+                   '--messages', str(args.messages), '--shard-count', str(args.shard_count),
+                   '--guilds', str(args.guilds), '--latency', str(args.latency)]
+        children.append(subprocess.Popen(command, stdout=subprocess.PIPE, text=True, env=environment))
+    results = []
+    for child in children:
+        output, _ = child.communicate()
+        if child.returncode:
+            raise SystemExit(f"shard process failed with {child.returncode}")
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=4000)
+    parser.add_argument('--shard-count', type=int, default=4)
+    parser.add_argument('--guilds', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.05, help="fake model latency in seconds")
+    parser.add_argument('--processes', default='1,2,4')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--shard-ids', help=argparse.SUPPRESS)
+    parser.add_argument('--run', default='0', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    print(f"{args.messages} events, {args.guilds} guilds, {args.shard_count} shards, {os.cpu_count()} CPUs")
+    print(f"{'processes':>9} {'events':>7} {'events/s':>9} {'slowest s':>9} {'requests':>8} {'user limit':>10}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for processes in (int(count) for count in args.processes.split(',')):
+            results = run_processes(args, processes, directory)
+            events = sum(result['events'] for result in results)
+            slowest = max(result['elapsed'] for result in results)
+            throughput = events / slowest
+            baseline = baseline or throughput
+            allowed = sum(result['allowed'] for result in results)
+            print(f"{processes:>9} {events:>7} {throughput:>9.0f} {slowest:>9.2f} "
+                  f"{sum(result['requests'] for result in results):>8} {allowed:>4}/{USER_LIMIT:<5} "
+                  f"x{throughput / baseline:.2f}")
+
+
+if __name__ == '__main__':
+    main()
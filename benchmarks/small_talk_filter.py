@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Throughput of the small-talk pre-filter and the model calls it saves.
+
+Scores a synthetic corpus of chat messages, then replays it as a day of traffic
+over a few channels: the previous behaviour (8.5% of all messages) against
+chance + score + per-channel cooldown.
+
+Usage: python -m benchmarks.small_talk_filter [number_of_messages] [channels]
+"""
+import random
+import statistics
+import sys
+import time
+
+from benchmarks.fake_discord import FakeChannel, FakeGuild, FakeMessage, FakeUser
+
+LOW_VALUE = [
+    "hej", "xD", "ok", "😂😂😂", "🔥", "+1", "https://youtu.be/dQw4w9WgXcQ", "<:kekw:123456789012345678>",
+    "haha", "lol", "https://tenor.com/view/cat-12345", "?", "no", "👍👍", "<@123456789012345678>",
+]
+CONVERSATION = [
+    "Ktoś idzie dziś na próbę chóru?",
+    "Nie wiem czy zdążę, autobus znowu się spóźnia a jeszcze muszę odebrać nuty od Basi.",
+    "A pamiętacie jak na ostatnim koncercie tenory weszły o takt za wcześnie? Do dziś się z tego śmieję.",
+    "Czy ktoś ma partyturę do Gaude Mater? Zgubiłem swoją i dyrygent będzie zły.",
+    "Dobranoc wszystkim 🌙",
+    "zobaczcie to nagranie z próby https://youtu.be/abc123 basy dały radę",
+    "did anyone record the last rehearsal?",
+    "Jutro próba o 18, nie spóźniajcie się proszę 😅",
+]
+
+
+def build_corpus(count, rng):
+    # About two thirds of a busy server's messages are reactions, links and one-worders
+    return [rng.choice(LOW_VALUE) if rng.random() < 0.65 else rng.choice(CONVERSATION) for _ in range(count)]
+
+
+def measure_scoring(corpus):
+    from services.small_talk_filter import score_text
+    started = time.perf_counter()
+    scores = [score_text(text) for text in corpus]
+    elapsed = time.perf_counter() - started
+    print(f"score_text: {len(corpus) / elapsed:,.0f} messages/s, {elapsed / len(corpus) * 1e6:.2f} us/message, "
+          f"median score {statistics.median(scores):.2f}")
+    return scores
+
+
+def replay_day(corpus, scores, channels):
+    from services.small_talk_filter import small_talk_filter
+    small_talk_filter.load()
+    config = small_talk_filter.defaults
+    rng = random.Random(2)
+    random.seed(3)
+    guild = FakeGuild()
+    channel_list = [FakeChannel(guild) for _ in range(channels)]
+    user = FakeUser('chorzysta')
+    legacy_calls = legacy_low_value = calls = low_value = 0
+    last_call = {}
+    bunched = 0
+    for index, (text, score) in enumerate(zip(corpus, scores)):
+        now = index * 86400 / len(corpus)
+        channel = rng.choice(channel_list)
+        if rng.random() < 0.085:
+            legacy_calls += 1
+            legacy_low_value += score < config.min_score
+        reply, _ = small_talk_filter.should_reply(FakeMessage(channel, user, text), now=now)
+        if reply:
+            calls += 1
+            low_value += score < config.min_score
+            bunched += now - last_call.get(channel.id, -1e9) < 60
+            last_call[channel.id] = now
+    print(f"one day, {len(corpus)} messages in {channels} channels (chance {config.chance}, "
+          f"min score {config.min_score}, cooldown {config.cooldown:.0f}s):")
+    print(f"  previous: {legacy_calls} model calls, {legacy_low_value} of them for low-value messages")
+    print(f"  filtered: {calls} model calls, {low_value} for low-value messages, "
+          f"{bunched} within a minute of the previous one")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    corpus = build_corpus(count, random.Random(1))
+    scores = measure_scoring(corpus)
+    replay_day(corpus, scores, channels)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Start-up time and latency of the first reply, before and after the setup_hook start-up phase.
+
+before   stores, resources and cogs loaded one after the other (cogs in on_ready),
+         the first message in a talking channel fetches its history over REST
+after    main.bot.setup_hook: stores, resources and the tokenizer in threads while
+         the cogs load, then the cog's on_ready warms the talking channels
+
+Every variant runs in a fresh process so imports are cold. Channel history
+answers after --history-latency seconds, like a REST round trip.
+
+Usage: python -m benchmarks.startup [--history-latency 0.3] [--latency 0.5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_discord import FakeChannel, FakeGuild, FakeMessage, FakeUser
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+CHANNEL_ID = 1111
+
+
+class SlowHistoryChannel(FakeChannel):
+    history_latency = 0.0
+
+    async def history(self, limit=100):
+        await asyncio.sleep(self.history_latency)
+        async for message in super().history(limit):
+            yield message
+
+
+async def legacy_setup(bot):
+    from services.conversation_memory import conversation_memory
+    from services.guild_quota import guild_quota
+    from services.open_ai_client import registry
+    from services.request_scheduler import request_scheduler
+    from services.resource_store import resource_store
+    from services.response_cache import response_cache
+    from services.startup import discover_cogs
+    registry.start()
+    request_scheduler.start()
+    await guild_quota.start()
+    response_cache.load_from_disk()
+    conversation_memory.load_from_disk()
+    resource_store.load()
+    # Previously done in on_ready
+    for name in discover_cogs():
+        await bot.load_extension(name)
+
+
+async def run_variant(args):
+    import main
+    from modules.reactionCog import get_response_from_openai
+
+    user = FakeUser('Zbyszek')
+    channel = SlowHistoryChannel(FakeGuild(), channel_id=CHANNEL_ID)
+    channel.messages = [FakeMessage(channel, user, f"wiadomość {index}") for index in range(20)]
+    main.bot.get_channel = {CHANNEL_ID: channel}.get
+    SlowHistoryChannel.history_latency = args.history_latency
+
+    started = time.monotonic()
+    if args.variant == 'before':
+        await legacy_setup(main.bot)
+    else:
+        await main.bot.setup_hook()
+    setup = time.monotonic() - started
+    cog = main.bot.get_cog('ReactionCog')
+    started = time.monotonic()
+    if args.variant == 'after':
+        await cog.on_ready()
+    ready = time.monotonic() - started
+
+    history_calls = channel.history_calls
+    message = FakeMessage(channel, user, 'Hej, co tam?')
+    channel.messages.append(message)
+    started = time.monotonic()
+    await get_response_from_openai(True, message, cog.open_ai_service)
+    first_reply = channel.sent[0][0] - started
+    await main.bot.close()
+    return {'setup': setup, 'ready': ready, 'first_reply': first_reply,
+            'history_fetches': channel.history_calls - history_calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history-latency', type=float, default=0.3, help="seconds per channel history fetch")
+    parser.add_argument('--latency', type=float, default=0.5, help="fake model latency in seconds")
+    parser.add_argument('--variant', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(asyncio.run(run_variant(args))))
+        return
+
+    server = FakeOpenAIServer(latency=args.latency)
+    server.start()
+    print(f"{'variant':<8} {'setup':>7} {'on_ready':>8} {'first reply':>11} {'history fetches':>15}")
+    try:
+        for variant in ('before', 'after'):
+            with tempfile.TemporaryDirectory() as directory:
+                environment = dict(
+                    os.environ, open_ai_base_url=server.base_url, open_ai_api_token='fake', enabled_ai='true',
+                    open_ai_model='gpt-3.5-turbo-0125', message_history_enabled='true', message_history_limit='10',
+                    channel_id_for_talking=str(CHANNEL_ID), open_ai_number_of_msg_per_sec_user='0',
+                    response_sentence_delay='0', metrics_enabled='false', log_level='WARNING',
+                    guild_quota_db_path=os.path.join(directory, 'guild_quota.db'),
+                    shared_state_path=os.path.join(directory, 'shared_state.db'),
+                    memory_path=os.path.join(directory, 'channel_memory.json'))
+                command = [sys.executable, '-m', 'benchmarks.startup', '--variant', variant,
+                           '--history-latency', str(args.history_latency)]
+                output = subprocess.run(command, check=True, capture_output=True, text=True, env=environment).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{variant:<8} {result['setup']:>6.3f}s {result['ready']:>7.3f}s {result['first_reply']:>10.3f}s "
+                  f"{result['history_fetches']:>15}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
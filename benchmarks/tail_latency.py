@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Reply latency and outcomes of model calls when the API misbehaves.
+
+Calls create_chat_completion like the chat path does (fallback=True) against
+the fake OpenAI server with injected faults, one scenario per process:
+
+    slow_tail        3% of the requests take 3s; no deadline, deadline, hedging
+    stalled_model    the main model takes 10s; deadline alone, then with a fallback model
+    failing_model    the main model answers 500; without and with the circuit breaker
+
+"busy" is a request that ends in ModelUnavailable, the bot answers it with a
+canned busy response. Every variant but the baselines checks the property it
+stands for (deadline bounds p99, the fallback answers, the breaker sheds, no
+request outlives its attempt) and the script exits with 1 when one fails.
+
+Usage: python -m benchmarks.tail_latency [--requests 1000] [--rate 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.harness import percentile
+
+MAIN_MODEL = 'gpt-3.5-turbo-0125'
+SMALL_MODEL = 'gpt-4o-mini'
+POOL_SIZE = 64
+BASE = {'open_ai_deadline': '0', 'open_ai_attempt_timeout': '0', 'open_ai_fallback_models': '',
+        'open_ai_hedge_enabled': 'false', 'circuit_breaker_min_requests': '1000000', 'open_ai_max_retries': '0',
+        'open_ai_max_concurrent_requests': str(POOL_SIZE), 'open_ai_pool_max_connections': str(POOL_SIZE)}
+
+
+def bounded_by(seconds):
+    def check(result, requests):
+        return None if result['p99'] <= seconds else f"p99 {result['p99']:.2f}s above {seconds}s"
+    return check
+
+
+def all_answered(seconds):
+    def check(result, requests):
+        if result['ok'] != requests:
+            return f"{result['busy']} busy replies"
+        return bounded_by(seconds)(result, requests)
+    return check
+
+
+def all_busy_within(seconds):
+    def check(result, requests):
+        if result['ok']:
+            return f"{result['ok']} answers from a stalled model"
+        return bounded_by(seconds)(result, requests)
+    return check
+
+
+def sheds(result, requests):
+    # Without the breaker every request makes 1 + open_ai_max_retries calls to the failing model
+    sent = result['requests_by_model'].get(MAIN_MODEL, 0)
+    if sent > requests:
+        return f"{sent} calls to the failing model"
+    return None if result['p50'] < 0.1 else f"p50 {result['p50']:.2f}s, calls not shed at once"
+
+
+# (scenario, variant, server faults, settings, check or None for a baseline)
+RUNS = [
+    ('slow_tail', 'no deadline', {'slow_fraction': 0.03}, {}, None),
+    ('slow_tail', 'deadline 1s', {'slow_fraction': 0.03}, {'open_ai_deadline': '1'}, bounded_by(1.2)),
+    ('slow_tail', 'hedged', {'slow_fraction': 0.03},
+     {'open_ai_deadline': '5', 'open_ai_hedge_enabled': 'true', 'open_ai_hedge_min_delay': '0.2'}, all_answered(1.0)),
+    # The attempt timeout fires before the hedge delay, the slow request must be cancelled with it
+    ('slow_tail', 'hedged, fallback', {'slow_fraction': 0.03},
+     {'open_ai_deadline': '5', 'open_ai_attempt_timeout': '1', 'open_ai_hedge_enabled': 'true',
+      'open_ai_hedge_min_delay': '2', 'open_ai_fallback_models': SMALL_MODEL}, bounded_by(1.5)),
+    ('stalled_model', 'deadline 3s', {'model_latency': {MAIN_MODEL: 10}}, {'open_ai_deadline': '3'},
+     all_busy_within(3.3)),
+    ('stalled_model', 'fallback', {'model_latency': {MAIN_MODEL: 10}},
+     {'open_ai_deadline': '3', 'open_ai_attempt_timeout': '1', 'open_ai_fallback_models': SMALL_MODEL},
+     all_answered(1.5)),
+    ('failing_model', 'retries', {'model_errors': {MAIN_MODEL: 1.0}, 'model_latency': {MAIN_MODEL: 0.5}},
+     {'open_ai_deadline': '20', 'open_ai_max_retries': '2'}, None),
+    ('failing_model', 'circuit breaker', {'model_errors': {MAIN_MODEL: 1.0}, 'model_latency': {MAIN_MODEL: 0.5}},
+     {'open_ai_deadline': '20', 'open_ai_max_retries': '2', 'circuit_breaker_min_requests': '10'}, sheds),
+]
+
+
+async def run_requests(args, server):
+    os.environ['open_ai_base_url'] = server.base_url
+    os.environ['open_ai_api_token'] = 'fake'
+    os.environ['metrics_enabled'] = 'false'
+    from services.open_ai_client import create_chat_completion, registry
+    from services.resilience import ModelUnavailable
+    registry.start()
+    latencies, outcomes = [], {'ok': 0, 'busy': 0}
+
+    async def request(index):
+        started = time.monotonic()
+        try:
+            await create_chat_completion(model=MAIN_MODEL, messages=[{"role": "user", "content": f"hej {index}"}],
+                                         fallback=True)
+            outcomes['ok'] += 1
+        except ModelUnavailable:
+            outcomes['busy'] += 1
+        latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    tasks = []
+    for index in range(args.requests):
+        tasks.append(asyncio.create_task(request(index)))
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    # Give cancelled requests a moment to release their slot; one still running holds it for seconds
+    await asyncio.sleep(0.1)
+    busy_slots = POOL_SIZE - registry.semaphore._value
+    await registry.close()
+    return {'p50': percentile(latencies, 0.50), 'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99), 'max': max(latencies), 'elapsed': elapsed,
+            'requests_by_model': server.requests_by_model, 'busy_slots': busy_slots, **outcomes}
+
+
+def run_child(args):
+    server = FakeOpenAIServer(latency=0.1, completion_tokens=20)
+    server.slow_latency = 3.0
+    for key, value in json.loads(args.faults).items():
+        setattr(server, key, value)
+    server.start()
+    try:
+        result = asyncio.run(run_requests(args, server))
+    finally:
+        server.stop()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=50, help="requests per second")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--faults', default='{}', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    print(f"{'scenario':<15} {'variant':<16} {'ok':>4} {'busy':>4} {'p50':>6} {'p95':>6} {'p99':>6} {'max':>6}  requests")
+    failures = []
+    for scenario, variant, faults, settings, check in RUNS:
+        command = [sys.executable, '-m', 'benchmarks.tail_latency', '--child', '--faults', json.dumps(faults),
+                   '--requests', str(args.requests), '--rate', str(args.rate)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True,
+                                env=dict(os.environ, **dict(BASE, **settings))).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        sent = ', '.join(f"{model} {count}" for model, count in result['requests_by_model'].items())
+        print(f"{scenario:<15} {variant:<16} {result['ok']:>4} {result['busy']:>4} {result['p50']:>6.2f} "
+              f"{result['p95']:>6.2f} {result['p99']:>6.2f} {result['max']:>6.2f}  {sent}")
+        if check is None:
+            continue
+        failure = check(result, args.requests)
+        if failure is None and result['busy_slots']:
+            failure = f"{result['busy_slots']} requests still running after their calls returned"
+        if failure is not None:
+            failures.append(f"{scenario} / {variant}: {failure}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Time from an incoming message to the first sentence posted, with and without streaming.
+
+Usage: python -m benchmarks.time_to_first_message [first_token_latency] [token_latency]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_discord import FakeChannel, FakeGuild, FakeMessage, FakeUser
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+REPLY = ("No i znowu ty. Myślałem że już sobie poszedłeś na dobre. "
+         "Ale skoro jesteś to mów szybko o co chodzi. Mam dziś pełne ręce roboty!")
+
+
+def configure_environment(base_url, directory):
+    os.environ.update({
+        'open_ai_base_url': base_url,
+        'open_ai_api_token': 'fake',
+        'open_ai_model': 'gpt-3.5-turbo-0125',
+        'ai_behavior': 'Jesteś sarkastycznym botem.',
+        'open_ai_top_p': '1',
+        'open_ai_max_tokens': '200',
+        'open_ai_temperature': '0',
+        'open_ai_max_number_of_messages_per_guild_per_day': '1000000',
+        'open_ai_number_of_msg_per_sec_user': '0',
+        'message_history_enabled': 'false',
+        'response_sentence_delay': '2',
+        'guild_quota_db_path': os.path.join(directory, 'guild_quota.db'),
+    })
+
+
+async def measure(name, streaming, legacy_pacing=False):
+    from modules.reactionCog import get_response_from_openai
+    from services.message_sender import SentenceSender
+    from services.open_ai_service import OpenAIService
+
+    service = OpenAIService('gpt-3.5-turbo-0125')
+    service.streaming = streaming
+    channel = FakeChannel(FakeGuild())
+    message = FakeMessage(channel, FakeUser('Zbyszek'), 'Hej, co tam?')
+    started = time.monotonic()
+    if legacy_pacing:
+        # Previous behaviour: full completion, then a fixed delay before every sentence
+        response = await service.chat_with_gpt(message)
+        sender = SentenceSender(channel)
+        sender.first_delay = sender.delay
+        await sender.send_all(response)
+    else:
+        await get_response_from_openai(True, message, service)
+    first = channel.sent[0][0] - started
+    last = channel.sent[-1][0] - started
+    print(f"{name:<32} first message={first:6.2f}s  last message={last:6.2f}s  messages={len(channel.sent)}")
+
+
+async def run():
+    from services.open_ai_client import create_chat_completion, registry
+    # Client start-up and lazy imports are one-off costs, keep them out of the measurement
+    await create_chat_completion(model='gpt-3.5-turbo-0125', messages=[{"role": "user", "content": "hej"}])
+    await measure("before (wait + fixed 2s pacing)", False, legacy_pacing=True)
+    await measure("buffered, elapsed-aware pacing", False)
+    await measure("streaming", True)
+    await registry.close()
+
+
+def main():
+    first_token_latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.8
+    token_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    server = FakeOpenAIServer(latency=first_token_latency, token_latency=token_latency, reply=REPLY)
+    server.start()
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(server.base_url, directory)
+        try:
+            asyncio.run(run())
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
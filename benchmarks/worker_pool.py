@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Reply throughput of the AI worker mode against the number of worker processes.
+
+The gateway side is simulated by enqueue_reply on synthetic talking-channel
+messages, the workers are real processes running run_worker against one fake
+OpenAI server, posting to a stand-in for Discord's REST channel that logs the
+nonce of every post. Throughput counts from the common start of the workers to
+the last finished job.
+
+With --kill, worker 0 is killed once halfway through and started again, like
+the pool does; its leased jobs are retried and posts already made are skipped.
+Duplicate posts are counted by nonce.
+
+Usage: python -m benchmarks.worker_pool [--jobs 600] [--workers 1,2,4] [--kill]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.harness import SCENARIOS, World, configure_environment
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeRestChannel:
+    def __init__(self, channel_id, posts_path):
+        self.id = channel_id
+        self.posts_path = posts_path
+
+    def typing(self):
+        return FakeTyping()
+
+    async def send(self, content=None, nonce=None, **kwargs):
+        # One write per post, appends from several processes do not interleave
+        descriptor = os.open(self.posts_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(descriptor, f"{nonce}\n".encode())
+        finally:
+            os.close(descriptor)
+
+
+async def enqueue_jobs(args, world):
+    from services.job_queue import CHAT, job_queue
+    from services.request_scheduler import DIRECT
+    from services.settings import reload_settings
+    from services.worker_pool import enqueue_reply
+    # Every run has its own queue file
+    reload_settings()
+    started = time.perf_counter()
+    messages = list(SCENARIOS['talking_flood'](world, args.jobs))
+    for message in messages:
+        await enqueue_reply(message, CHAT, DIRECT)
+    elapsed = time.perf_counter() - started
+    job_queue.close()
+    return elapsed
+
+
+def run_child(args):
+    from services.ai_worker import run_worker
+    posts_path = os.environ['benchmark_posts_path']
+    time.sleep(max(0.0, args.start_at - time.time()))
+    started = time.time()
+    processed = asyncio.run(run_worker(
+        args.index, args.count, lambda channel_id, guild_id: FakeRestChannel(channel_id, posts_path),
+        stop_when_idle=True))
+    print(json.dumps({'started': started, 'finished': time.time(), 'processed': processed}))
+
+
+def spawn(args, index, count, start_at, environment):
+    command = [sys.executable, '-m', 'benchmarks.worker_pool', '--child', '--index', str(index),
+               '--count', str(count), '--start-at', str(start_at)]
+    return subprocess.Popen(command, stdout=subprocess.PIPE, text=True, env=environment)
+
+
+def run_pool(args, server, workers, directory):
+    environment = dict(os.environ, job_queue_path=os.path.join(directory, 'jobs.db'),
+                       guild_quota_db_path=os.path.join(directory, 'guild_quota.db'),
+                       shared_state_path=os.path.join(directory, 'shared_state.db'),
+                       benchmark_posts_path=os.path.join(directory, 'posts.log'),
+                       ai_workers=str(workers), memory_path='')
+    os.environ.update(environment)
+    world = World(random.Random(1), args.guilds, 1, 200, 10, None)
+    # Spread the guilds evenly over the worker partitions
+    for index, channel in enumerate(world.talking_channels):
+        channel.guild.id = index + 1
+    configure_environment(world, server, directory, 0.0)
+    environment = dict(os.environ)
+    enqueue_seconds = asyncio.run(enqueue_jobs(args, world))
+
+    start_at = time.time() + 2
+    children = {index: spawn(args, index, workers, start_at, environment) for index in range(workers)}
+    results = []
+    if args.kill:
+        time.sleep(max(0.0, start_at - time.time()) + args.jobs / (workers * 8 / server.latency) / 2)
+        children[0].send_signal(signal.SIGKILL)
+        children[0].wait()
+        children[0] = spawn(args, 0, workers, 0, environment)
+    for child in children.values():
+        output, _ = child.communicate()
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    with open(os.path.join(directory, 'posts.log'), encoding='utf-8') as file:
+        nonces = file.read().split()
+    db = sqlite3.connect(os.path.join(directory, 'jobs.db'))
+    done, retried = db.execute("SELECT count(*) FILTER (WHERE state = 'done'), "
+                               "count(*) FILTER (WHERE attempts > 1) FROM jobs").fetchone()
+    db.close()
+    elapsed = max(result['finished'] for result in results) - min(result['started'] for result in results)
+    return {'workers': workers, 'jobs_per_sec': done / elapsed, 'elapsed': elapsed, 'done': done,
+            'retried': retried, 'posts': len(nonces), 'duplicates': len(nonces) - len(set(nonces)),
+            'enqueue_us': enqueue_seconds / args.jobs * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=600)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--guilds', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.5, help="fake model latency in seconds")
+    parser.add_argument('--kill', action='store_true', help="kill and restart worker 0 halfway through")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--index', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--count', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, default=0.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    server = FakeOpenAIServer(latency=args.latency)
+    server.start()
+    print(f"{args.jobs} jobs over {args.guilds} guilds, model latency {args.latency}s, {os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'jobs/s':>7} {'seconds':>7} {'done':>5} {'retried':>7} {'posts':>6} {'duplicates':>10} "
+          f"{'enqueue':>9}")
+    try:
+        for workers in (int(count) for count in args.workers.split(',')):
+            with tempfile.TemporaryDirectory() as directory:
+                result = run_pool(args, server, workers, directory)
+            print(f"{result['workers']:>7} {result['jobs_per_sec']:>7.1f} {result['elapsed']:>7.2f} "
+                  f"{result['done']:>5} {result['retried']:>7} {result['posts']:>6} {result['duplicates']:>10} "
+                  f"{result['enqueue_us']:>7.0f}us")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
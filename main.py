@@ -1,43 +1,107 @@
 import logging
 import asyncio
 import os
-import random
-import json
-import discord
+import signal
 
 from dotenv import load_dotenv
-from discord.ext import commands, tasks
+from discord.ext import commands
+
+from services.conversation_memory import conversation_memory
+from services.guild_quota import guild_quota
+from services.log_setup import setup_logging
+from services.metrics import metrics
+from services.open_ai_client import registry
+from services.prompt_builder import get_encoding
+from services.request_scheduler import request_scheduler
+from services.resource_store import resource_store
+from services.response_cache import response_cache
+from services.settings import get_settings, install_reload_signal, watch_settings_file
+from services.shared_state import shared_counters
+from services.sharding import get_intents, parse_shard_ids, run_shard_processes
+from services.startup import load_cogs, log_settings, startup_report
+from services.worker_pool import worker_pool
 
 # Logging configuration
 load_dotenv(".env")
-logging.basicConfig(level=os.getenv('log_level'), format='%(asctime)s - %(levelname)s - %(funcName)s - %(message)s')
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents)
+setup_logging()
+intents = get_intents(get_settings())
+
+
+class WarchlakBotMixin:
+    settings_watcher = None
+    resources_watcher = None
+
+    async def setup_hook(self):
+        # Runs once per process, before the gateway connects; on_ready fires again after every reconnect
+        settings = get_settings()
+        # Long-lived model clients, shared by every cog for the whole session; without a key every model call
+        # fails on its own and gets a busy reply, the bot still starts
+        if registry.has_api_key(settings):
+            registry.start()
+        else:
+            logging.warning("No OpenAI API key configured, model calls will fail.")
+        request_scheduler.start()
+        # Stores, canned responses and the tokenizer load in threads while the cogs are imported
+        await asyncio.gather(
+            startup_report.timed('guild_quota', guild_quota.start()),
+            startup_report.timed('response_cache', asyncio.to_thread(response_cache.load_from_disk)),
+            startup_report.timed('memory', asyncio.to_thread(conversation_memory.load_from_disk)),
+            startup_report.timed('resources', asyncio.to_thread(resource_store.load)),
+            startup_report.timed('tokenizer', asyncio.to_thread(get_encoding, settings.open_ai_model)),
+            startup_report.timed('cogs', load_cogs(self)))
+        await startup_report.timed('workers', worker_pool.start())
+        await startup_report.timed('metrics', metrics.start())
+        # Settings reload on SIGHUP or when .env changes, the gateway connection stays up
+        install_reload_signal(asyncio.get_running_loop())
+        self.settings_watcher = asyncio.create_task(watch_settings_file())
+        self.resources_watcher = asyncio.create_task(resource_store.watch())
+        logging.info(f'Startup: {startup_report.summary()}')
+
+    async def close(self):
+        for watcher in (self.settings_watcher, self.resources_watcher):
+            if watcher is not None:
+                watcher.cancel()
+        await super().close()
+        await worker_pool.close()
+        await conversation_memory.close()
+        await request_scheduler.close()
+        await registry.close()
+        await guild_quota.close()
+        response_cache.save_to_disk()
+        await metrics.close()
+        shared_counters.close()
+
+
+class WarchlakBot(WarchlakBotMixin, commands.Bot):
+    pass
+
+
+class ShardedWarchlakBot(WarchlakBotMixin, commands.AutoShardedBot):
+    pass
+
+
+def create_bot(settings):
+    if settings.shard_count:
+        # shard_ids=None runs every shard in this process
+        return ShardedWarchlakBot(command_prefix="!", intents=intents, shard_count=settings.shard_count,
+                                  shard_ids=parse_shard_ids(settings.shard_ids))
+    return WarchlakBot(command_prefix="!", intents=intents)
+
+
+bot = create_bot(get_settings())
 
 
 @bot.event
 async def on_ready():
+    if startup_report.ready_after is not None:
+        logging.info(f'New gateway session as {bot.user.name}, {len(bot.guilds)} guilds.')
+        return
+    startup_report.mark_ready()
     logging.info('---------------------------------------------------------------')
     logging.info(f'Logged in as {bot.user.name} ({bot.user.id})')
-    logging.info(f'Log level: ' + os.getenv('log_level'))
-    logging.info(f'Enable AI (OpenAI): ' + os.getenv('enabled_ai'))
-    logging.info(f'Message history enabled: ' + os.getenv('message_history_enabled'))
-    logging.info(f'Message history limit: ' + os.getenv('message_history_limit'))
-    logging.info(f'OpenAI model: ' + os.getenv('open_ai_model'))
-    logging.info(f'OpenAI max tokens: ' + os.getenv('open_ai_max_tokens'))
-    logging.info(f'OpenAI temperature: ' + os.getenv('open_ai_temperature'))
-    logging.info(f'OpenAI top p: ' + os.getenv('open_ai_top_p'))
-    logging.info(f'OpenAI enabled  images creation: ' + os.getenv('enabled_image_ai_analyze'))
-    logging.info(f'Max messages per day: ' + os.getenv('open_ai_max_number_of_messages_per_guild_per_day'))
+    log_settings(get_settings())
     logging.info(f'Bot is in {len(bot.guilds)} guilds.')
-    do_not_load_those_cogs = ['__init__']
-    for filename in os.listdir('modules'):
-        if filename.endswith('.py') and filename[:-3] not in do_not_load_those_cogs:
-            try:
-                await bot.load_extension(f'modules.{filename[:-3]}')
-                logging.info(f'Loaded cog: {filename[:-3]}')
-            except commands.ExtensionError as e:
-                logging.error(f'Error loading cog {filename[:-3]}: {e.with_traceback(e.__traceback__)}')
+    logging.info(f'Ready {startup_report.ready_after:.2f}s after start.')
     logging.info('---------------------------------------------------------------')
 
 
@@ -47,21 +111,21 @@ async def say_as_bot(ctx, *, message: str):
         if not message:
             logging.info("Message for command say is empty.")
             return
-        channel_id = int(os.getenv('channel_id_for_talking'))
-        channel = bot.get_channel(channel_id)
-        if channel:
-            await channel.send(message)
-            logging.info(f"Message sent to channel with id {channel_id}: {message}")
-        else:
-            logging.error(f"Channel with id {channel_id} not found.")
+        for channel_id in get_settings().talking_channel_ids:
+            # Channels of guilds on other shard processes are not in this process's cache
+            channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+            if channel:
+                await channel.send(message)
+                logging.info(f"Message sent to channel with id {channel_id}: {message}")
+            else:
+                logging.error(f"Channel with id {channel_id} not found.")
     except Exception as e:
         logging.error(f"Error sending message: {e}")
 
 
 @bot.command(name='exit', help='Wyłącza bota')
 async def exit_bot(ctx):
-    allowed_user_id = os.getenv('target_user_id')
-    if ctx.author.id == int(allowed_user_id):
+    if ctx.author.id == get_settings().target_user_id:
         logging.info("Bot was closed by creator.")
         await ctx.send('Bot zostanie teraz wyłączony.')
         await bot.close()
@@ -71,6 +135,13 @@ async def exit_bot(ctx):
 
 
 async def main():
+    # The shard launcher stops its processes (started with shard_ids) with SIGTERM, close cleanly so counters
+    # get flushed; Windows loops have no signal handlers
+    if get_settings().shard_ids:
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+        except NotImplementedError:
+            pass
     try:
         await bot.start(os.getenv("BOT_TOKEN"))
     except Exception as e:
@@ -80,4 +151,8 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    settings = get_settings()
+    if settings.shard_processes > 1 and not settings.shard_ids:
+        run_shard_processes(settings)
+    else:
+        asyncio.run(main())
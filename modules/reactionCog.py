@@ -1,92 +1,139 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import json
 import logging
-import os
 import random
-import re
+import time
 
 from discord.ext import commands
 
 from services.common import get_busy_response
+from services.activity_index import activity_index
+from services.conversation_memory import conversation_memory
+from services.image_pipeline import image_attachments
+from services.job_queue import CHAT, SMALL_TALK_REPLY
+from services.message_cache import message_cache
+from services.message_sender import SentenceSender, send_response_in_parts
+from services.metrics import STAGE_SECONDS, metrics
 from services.open_ai_service import OpenAIService, analyze_image, small_talk_with_gpt
-
-
-async def send_response_in_parts(channel, response):
-    try:
-        if not response.strip():
-            logging.warning("Response is empty, nothing to send.")
-            return
-        # sentences = re.split(r'(?<=[.!?])\s+', response)
-        sentences = re.split(r'(?<=[a-zA-Z][.!?])\s+', response)
-        sentences = [s for s in sentences if s.strip()]
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if sentence:
-                async with channel.typing():
-                    await asyncio.sleep(2)
-                await channel.send(sentence)
-    except Exception as e:
-        logging.error(f"Error sending response in parts: {e}")
-
-
-async def get_response_from_openai(enable_ai, message, open_ai_model):
-    if enable_ai:
-        open_ai_service = OpenAIService(open_ai_model)
-        response_from_ai = await open_ai_service.chat_with_gpt(message)
+from services.request_scheduler import DIRECT, MENTION, SMALL_TALK, Overloaded
+from services.resilience import ModelUnavailable
+from services.resource_store import resource_store
+from services.settings import get_settings, on_reload
+from services.small_talk_filter import small_talk_filter
+from services.worker_pool import enqueue_reply
+
+
+async def get_response_from_openai(enable_ai, message, open_ai_service, priority=DIRECT):
+    if enable_ai and get_settings().ai_workers:
+        # Worker mode: the reply is made and posted by an AI worker process
+        await enqueue_reply(message, CHAT, priority)
+    elif enable_ai:
+        started = time.monotonic()
+        sender = SentenceSender(message.channel, started)
+        response_from_ai = await open_ai_service.chat_with_gpt(message, sender, priority)
         if response_from_ai is not None:
-            await send_response_in_parts(message.channel, response_from_ai)
+            with metrics.timer(STAGE_SECONDS, stage='send'):
+                if sender.streamed:
+                    await sender.wait()
+                else:
+                    await send_response_in_parts(message.channel, response_from_ai, started)
             # await message.reply(response_from_ai)
-            logging.info(f"Response from OpenAi with msg: {message.content.strip()}:{response_from_ai}")
+            logging.info("Response from OpenAi with msg: %s:%s", message.content.strip(), response_from_ai)
         else:
-            await message.reply(get_busy_response())
-            logging.info(f"Message was too long. Skipping API call.")
+            # Too long, circuit open or no model answered, chat_with_gpt logged which
+            await message.reply(get_busy_response(message.guild))
+            logging.info("No response from OpenAi. Sending busy message.")
     else:
-        await message.reply(get_busy_response())
+        await message.reply(get_busy_response(message.guild))
         logging.info(f"OpenAi API is turned off. Sending default message.")
 
 
-async def return_response_for_attachment():
-    try:
-        with open('resources/responses_to_image.json', 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        random_reaction = random.choice(data['reactions'])
-        return random_reaction
-    except FileNotFoundError:
-        logging.error("Error: File 'responses_to_image.json' not found.")
-        return None
+async def return_response_for_attachment(guild=None):
+    # Loaded at startup, no disk access here
+    random_reaction = resource_store.choice('responses_to_image', guild)
+    if random_reaction is None:
+        logging.error("Error: no responses_to_image resource loaded.", extra={'throttle': True})
+    return random_reaction
 
 
 async def get_reaction_for_random_message(self, message):
-    magic_random = random.random()
-    if magic_random < 0.085 and str(message.author.id) != "725426177790967818":
-        response = await small_talk_with_gpt(message)
-        logging.info(f"Response from OpenAi with chance:{magic_random}, with msg: {message.content.strip()}:{response}")
-        await message.channel.send(content=response)
+    if str(message.author.id) == "725426177790967818":
+        return
+    # Small talk cooldowns, scheduling and worker partitions are per guild, DMs get no random replies
+    if message.guild is None:
+        return
+    # Cooldown, random roll and local score, all before any history fetch or model call
+    reply, reason = small_talk_filter.should_reply(message)
+    if reply and get_settings().ai_workers:
+        await enqueue_reply(message, SMALL_TALK_REPLY, SMALL_TALK)
+    elif reply:
+        try:
+            response = await small_talk_with_gpt(message)
+        except (Overloaded, ModelUnavailable) as e:
+            logging.info("Random response (%s) dropped: %r", reason, e, extra={'throttle': True})
+            return
+        logging.info("Response from OpenAi (%s), with msg: %s:%s", reason, message.content.strip(), response)
+        with metrics.timer(STAGE_SECONDS, stage='send'):
+            await message.channel.send(content=response)
     else:
-        logging.info(f"No response - random.random():{magic_random} decided :)")
+        logging.info("No response - %s decided :)", reason, extra={'throttle': True})
 
 
 class ReactionCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.open_ai_service = OpenAIService(get_settings().open_ai_model)
+        on_reload(self.reload_open_ai_service)
+
+    def reload_open_ai_service(self, settings):
+        self.open_ai_service = OpenAIService(settings.open_ai_model, settings)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Fired after a new gateway session, events from the gap are lost
+        message_cache.mark_all_cold()
+        settings = get_settings()
+        if settings.message_history_enabled:
+            # Refetched now rather than on the first message of each talking channel
+            channels = (self.bot.get_channel(channel_id) for channel_id in settings.talking_channel_ids)
+            await message_cache.warm([channel for channel in channels if channel is not None])
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        if 'content' in payload.data:
+            message_cache.edit(payload.channel_id, payload.message_id, payload.data['content'])
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        message_cache.delete(payload.channel_id, {payload.message_id})
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        message_cache.delete(payload.channel_id, payload.message_ids)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        message_cache.drop_channel(channel.id)
+        conversation_memory.drop_channel(channel.id)
 
     @commands.Cog.listener()
     async def on_message(self, message):
         """Event handler called when a message is received."""
-        enable_ai = os.getenv("enabled_ai", 'False').lower() in ('true', '1', 't')
-        open_ai_model = os.getenv('open_ai_model')
-        enabled_image_ai_analyze = os.getenv("enabled_image_ai_analyze", 'False').lower() in ('true', '1', 't')
-        channel_for_bot = os.getenv('channel_id_for_talking')
-        int_channel_for_bot = [int(channel.strip()) for channel in channel_for_bot]
+        # Every message, including the bot's own replies, feeds the chat history buffer
+        message_cache.add(message)
+
+        with metrics.timer(STAGE_SECONDS, stage='settings'):
+            settings = get_settings()
+        enable_ai = settings.enabled_ai
 
         # Ignore messages from bot
         if message.author.bot:
             return
+        activity_index.record(message)
 
         # If the message has content and its on bot channel - send it to Open API gateway
-        if message.channel.id in int_channel_for_bot and not message.author.bot:
-            await get_response_from_openai(enable_ai, message, open_ai_model)
+        if message.channel.id in settings.talking_channel_ids and not message.author.bot:
+            await get_response_from_openai(enable_ai, message, self.open_ai_service)
             return
 
         # If the message has content and the bot is mentioned - send it to Open API gateway
@@ -97,20 +144,29 @@ class ReactionCog(commands.Cog):
                 random_emoji = random.choice(list_of_emojis)
                 await message.add_reaction(random_emoji)
 
-                if enabled_image_ai_analyze is True:
+                # Non-image files and oversized images never reach the model
+                images = image_attachments(message) if settings.enabled_image_ai_analyze is True else []
+                if images:
                     async with message.channel.typing():
-                        await asyncio.sleep(4)
-                    response = analyze_image(message)
-                    await send_response_in_parts(message.channel, response)
-                    return
-                else:
-                    response = await return_response_for_attachment()
-                    async with message.channel.typing():
-                        await asyncio.sleep(3)
-                    await message.reply(response)
+                        try:
+                            response = await analyze_image(message, images)
+                        except (Overloaded, ModelUnavailable) as e:
+                            # Falls back to a canned reaction below
+                            logging.warning("Image analysis failed: %s", e, extra={'throttle': True})
+                            response = None
+                    if response is not None:
+                        with metrics.timer(STAGE_SECONDS, stage='send'):
+                            await send_response_in_parts(message.channel, response)
+                        return
+                response = await return_response_for_attachment(message.guild)
+                if response is None:
                     return
+                async with message.channel.typing():
+                    await asyncio.sleep(3)
+                await message.reply(response)
+                return
             else:
-                await get_response_from_openai(enable_ai, message, open_ai_model)
+                await get_response_from_openai(enable_ai, message, self.open_ai_service, MENTION)
                 return
 
         # Add random reaction to message with low chance
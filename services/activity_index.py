@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from services.settings import get_settings, on_reload
+
+USER_ID_PATTERN = re.compile(r'\d{15,20}')
+DAY = 86400
+
+
+def count_channel(channels, channel_id, amount, limit):
+    channels[channel_id] = channels.get(channel_id, 0) + amount
+    if len(channels) > limit:
+        # The least used channel of the bucket makes room
+        del channels[min(channels, key=channels.get)]
+
+
+class UserActivity:
+    __slots__ = ('total', 'first_seen', 'last_seen', 'buckets')
+
+    def __init__(self, now, bucket_count):
+        self.total = 0
+        self.first_seen = now
+        self.last_seen = now
+        # [bucket number, messages, {channel id: messages}] for the most recent buckets with any activity,
+        # oldest first; at most activity_channels_per_user channels per bucket
+        self.buckets = deque(maxlen=bucket_count)
+
+
+class ActivityIndex:
+    """Per guild and user message counters, updated from on_message.
+
+    Counts are kept in time buckets (an hour by default) for the last
+    activity_buckets buckets, so memory per user is bounded and a lookup never
+    touches the channel history. Idle users beyond activity_max_users are
+    dropped, least recently seen first.
+    """
+
+    def __init__(self):
+        self.users = OrderedDict()
+        self.enabled = None
+        self.bucket_seconds = 3600
+        self.bucket_count = 168
+        self.channels_per_user = 5
+        self.max_users = 100000
+        self.started = time.time()
+
+    def load(self, settings=None):
+        settings = settings or get_settings()
+        self.enabled = settings.activity_enabled
+        self.channels_per_user = settings.activity_channels_per_user
+        if (settings.activity_bucket_seconds, settings.activity_buckets) != (self.bucket_seconds, self.bucket_count):
+            self.rebucket(settings.activity_bucket_seconds, settings.activity_buckets)
+        self.max_users = settings.activity_max_users
+
+    def rebucket(self, bucket_seconds, bucket_count):
+        """Maps the buckets of every user onto a new bucket size by their start time."""
+        for activity in self.users.values():
+            buckets = deque(maxlen=bucket_count)
+            for bucket, count, channels in activity.buckets:
+                number = bucket * self.bucket_seconds // bucket_seconds
+                if buckets and buckets[-1][0] == number:
+                    buckets[-1][1] += count
+                    for channel_id, messages in channels.items():
+                        count_channel(buckets[-1][2], channel_id, messages, self.channels_per_user)
+                else:
+                    buckets.append([number, count, dict(channels)])
+            activity.buckets = buckets
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = bucket_count
+
+    def record(self, message, now=None):
+        if self.enabled is None:
+            self.load()
+        if not self.enabled or message.guild is None:
+            return
+        now = time.time() if now is None else now
+        key = (message.guild.id, message.author.id)
+        activity = self.users.get(key)
+        if activity is None:
+            activity = UserActivity(now, self.bucket_count)
+            self.users[key] = activity
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(key)
+        activity.total += 1
+        activity.last_seen = now
+
+        bucket = int(now // self.bucket_seconds)
+        if activity.buckets and activity.buckets[-1][0] == bucket:
+            activity.buckets[-1][1] += 1
+        else:
+            activity.buckets.append([bucket, 1, {}])
+        count_channel(activity.buckets[-1][2], message.channel.id, 1, self.channels_per_user)
+
+    def messages_since(self, activity, seconds, now):
+        first_bucket = int((now - seconds) // self.bucket_seconds)
+        return sum(count for bucket, count, _ in activity.buckets if bucket > first_bucket)
+
+    def channels_since(self, activity, seconds, now):
+        """The most used channels of the buckets in the last seconds, most messages first."""
+        first_bucket = int((now - seconds) // self.bucket_seconds)
+        totals = {}
+        for bucket, _, channels in activity.buckets:
+            if bucket > first_bucket:
+                for channel_id, messages in channels.items():
+                    totals[channel_id] = totals.get(channel_id, 0) + messages
+        return sorted(totals, key=totals.get, reverse=True)[:self.channels_per_user]
+
+    def summary(self, guild_id, user_id, now=None):
+        now = time.time() if now is None else now
+        activity = self.users.get((guild_id, user_id))
+        tracked_since = max(self.started, now - self.bucket_count * self.bucket_seconds)
+        if activity is None:
+            return {"user_id": str(user_id), "messages_total": 0,
+                    "tracked_since": format_time(tracked_since)}
+        return {
+            "user_id": str(user_id),
+            "messages_total": activity.total,
+            "messages_last_24h": self.messages_since(activity, DAY, now),
+            "messages_last_7d": self.messages_since(activity, 7 * DAY, now),
+            "first_seen": format_time(activity.first_seen),
+            "last_seen": format_time(activity.last_seen),
+            "active_channels_last_7d": [f"<#{channel_id}>"
+                                        for channel_id in self.channels_since(activity, 7 * DAY, now)],
+            "tracked_since": format_time(tracked_since),
+        }
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='minutes')
+
+
+activity_index = ActivityIndex()
+on_reload(activity_index.load)
+
+
+def get_user_activity(user_id, guild_context):
+    """Model tool: activity of a guild member, as JSON for the tool message."""
+    match = USER_ID_PATTERN.search(str(user_id))
+    if match is None:
+        return json.dumps({"error": f"Unknown user id {user_id}"})
+    return json.dumps(activity_index.summary(guild_context.id, int(match.group())), ensure_ascii=False)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+import discord
+
+from services.common import get_busy_response
+from services.conversation_memory import conversation_memory
+from services.guild_quota import guild_quota
+from services.job_queue import SMALL_TALK_REPLY, job_queue
+from services.message_cache import CachedMessage, message_cache
+from services.message_sender import send_response_in_parts
+from services.open_ai_client import registry
+from services.open_ai_service import OpenAIService, small_talk_with_gpt
+from services.request_scheduler import Overloaded, request_scheduler
+from services.resilience import ModelUnavailable
+from services.response_cache import response_cache
+from services.settings import get_settings, on_reload
+from services.shared_state import shared_counters
+
+
+class JobAuthor:
+    __slots__ = ('id', 'display_name', 'bot', 'mention')
+
+    def __init__(self, author_id, display_name):
+        self.id = author_id
+        self.display_name = display_name
+        self.bot = False
+        self.mention = f"<@{author_id}>"
+
+
+class JobGuild:
+    __slots__ = ('id', 'preferred_locale')
+
+    def __init__(self, guild_id, preferred_locale):
+        self.id = guild_id
+        self.preferred_locale = preferred_locale
+
+
+class JobMessage:
+    """The parts of a discord.Message the reply path reads, rebuilt from a job payload."""
+
+    def __init__(self, payload, channel):
+        self.id = payload['message_id']
+        self.content = payload['content']
+        self.author = JobAuthor(*payload['author'])
+        self.guild = JobGuild(payload['guild_id'], payload['locale'])
+        self.channel = channel
+        self.attachments = []
+        self.mentions = []
+
+    async def reply(self, content):
+        reference = discord.MessageReference(message_id=self.id, channel_id=self.channel.id, guild_id=self.guild.id,
+                                             fail_if_not_exists=False)
+        return await self.channel.send(content, reference=reference)
+
+
+class IdempotentChannel:
+    """Channel of one job: parts posted by an earlier attempt are skipped, every new one is recorded.
+
+    A worker that dies between a send and its record leaves that one part
+    posted but unrecorded. discord.py sends every nonce with enforce_nonce, so
+    Discord answers a resend of it with the message already created instead
+    of posting it again. That holds only within Discord's nonce window of a
+    few minutes: the pool restarts a dead worker at once and its jobs are
+    retried right away, but a job retried only after its lease ran out can
+    post that part twice.
+    """
+
+    def __init__(self, channel, job):
+        self.channel = channel
+        self.id = channel.id
+        self.job = job
+        self.part = 0
+
+    def typing(self):
+        return self.channel.typing()
+
+    def history(self, **kwargs):
+        return self.channel.history(**kwargs)
+
+    async def send(self, content=None, **kwargs):
+        self.part += 1
+        if self.part <= self.job.sent:
+            return None
+        message = await self.channel.send(content, nonce=f"j{self.job.id}p{self.part}", **kwargs)
+        job_queue.mark_sent(self.job.id, self.part)
+        self.job.sent = self.part
+        return message
+
+
+class AIWorker:
+    """Runs the jobs of one partition, up to ai_worker_concurrency at a time."""
+
+    def __init__(self, index, workers, get_channel):
+        self.index = index
+        self.workers = workers
+        # (channel_id, guild_id) -> channel to post to
+        self.get_channel = get_channel
+        self.open_ai_service = OpenAIService(get_settings().open_ai_model)
+        self.running = set()
+        self.processed = 0
+        on_reload(self.reload_open_ai_service)
+
+    def reload_open_ai_service(self, settings):
+        self.open_ai_service = OpenAIService(settings.open_ai_model, settings)
+
+    async def respond(self, message, payload):
+        """Returns (response, as_reply); a None response drops the job."""
+        if payload['kind'] == SMALL_TALK_REPLY:
+            try:
+                return await small_talk_with_gpt(message), False
+            except (Overloaded, ModelUnavailable) as e:
+                logging.info("Random response dropped: %r", e, extra={'throttle': True})
+                return None, False
+        if not get_settings().enabled_ai:
+            return get_busy_response(message.guild), True
+        response = await self.open_ai_service.chat_with_gpt(message, None, payload['priority'])
+        if response is None:
+            return get_busy_response(message.guild), True
+        return response, False
+
+    async def handle(self, job):
+        payload = job.payload
+        channel = IdempotentChannel(self.get_channel(payload['channel_id'], payload['guild_id']), job)
+        message = JobMessage(payload, channel)
+        message_cache.replace(payload['channel_id'], [CachedMessage(*entry) for entry in payload['history']])
+        if job.response is None:
+            response, as_reply = await self.respond(message, payload)
+            if response is None:
+                job_queue.complete(job.id)
+                return
+            job_queue.save_response(job.id, response, as_reply)
+            job.response, job.reply = response, as_reply
+        else:
+            logging.info("Job %s retried, %s parts already sent.", job.id, job.sent)
+        if job.reply:
+            await message.reply(job.response)
+        elif payload['kind'] == SMALL_TALK_REPLY:
+            await channel.send(content=job.response)
+        else:
+            await send_response_in_parts(channel, job.response)
+        job_queue.complete(job.id)
+        self.processed += 1
+
+    async def _run_job(self, job, slots):
+        try:
+            await self.handle(job)
+        except Exception as e:
+            job_queue.fail(job, e)
+        finally:
+            slots.release()
+
+    async def run(self, stop_when_idle=False):
+        settings = get_settings()
+        job_queue.release(self.index)
+        slots = asyncio.Semaphore(settings.ai_worker_concurrency)
+        logging.info(f"AI worker {self.index + 1}/{self.workers} started.")
+        while True:
+            await slots.acquire()
+            job = await asyncio.to_thread(job_queue.claim, self.index, self.workers)
+            if job is None:
+                slots.release()
+                if stop_when_idle and not self.running:
+                    return
+                await asyncio.sleep(get_settings().job_queue_poll_interval)
+                continue
+            task = asyncio.create_task(self._run_job(job, slots))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+
+async def run_worker(index, workers, get_channel, stop_when_idle=False):
+    """Worker process side: the model clients and stores of the bot, then the job loop."""
+    if registry.has_api_key():
+        registry.start()
+    request_scheduler.start()
+    await guild_quota.start()
+    response_cache.load_from_disk()
+    conversation_memory.load_from_disk()
+    worker = AIWorker(index, workers, get_channel)
+    try:
+        await worker.run(stop_when_idle)
+        await asyncio.gather(*worker.running)
+    finally:
+        await conversation_memory.close()
+        await request_scheduler.close()
+        await registry.close()
+        await guild_quota.close()
+        response_cache.save_to_disk()
+        shared_counters.close()
+        job_queue.close()
+    return worker.processed
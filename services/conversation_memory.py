@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from services.metrics import metrics
+from services.open_ai_client import create_chat_completion
+from services.prompt_builder import count_tokens
+from services.request_scheduler import SMALL_TALK, Overloaded, request_scheduler
+from services.settings import get_settings, on_reload
+
+SUMMARY_BEHAVIOUR = ("Streszczasz rozmowę z kanału Discord dla bota, który w niej uczestniczy. "
+                     "Połącz dotychczasowe streszczenie z nowymi wiadomościami. Zachowaj imiona, fakty, "
+                     "ustalenia, otwarte pytania i nastrój rozmowy, pomiń powitania i wiadomości bez treści. "
+                     "Pisz zwięźle, w trzeciej osobie, maksymalnie {max_chars} znaków.")
+SUMMARY_PREFIX = "Streszczenie wcześniejszej rozmowy na tym kanale: "
+
+
+class ChannelSummary:
+    __slots__ = ('text', 'last_id', 'updated')
+
+    def __init__(self, text, last_id, updated):
+        self.text = text
+        # Id of the newest message folded into the summary, newer ones still go to the prompt as they are
+        self.last_id = last_id
+        self.updated = updated
+
+
+class ConversationMemory:
+    """Rolling per-channel summary of the conversation that scrolled out of the prompt.
+
+    The prompt gets the summary plus the messages it does not cover yet. Once
+    memory_summary_batch of them are older than the last memory_recent_turns,
+    they are folded into the summary by a background model call.
+    """
+
+    def __init__(self):
+        self.channels = OrderedDict()
+        self.pending = {}
+        self.enabled = None
+        self.recent_turns = 4
+        self.batch = 4
+        self.max_chars = 800
+        self.max_tokens = 250
+        self.max_channels = 1000
+        self.model = None
+        self.path = None
+
+    def load(self, settings=None):
+        settings = settings or get_settings()
+        self.enabled = settings.memory_enabled
+        self.recent_turns = settings.memory_recent_turns
+        self.batch = max(1, settings.memory_summary_batch)
+        self.max_chars = settings.memory_summary_max_chars
+        self.max_tokens = settings.memory_summary_max_tokens
+        self.max_channels = settings.memory_max_channels
+        self.model = settings.memory_model or settings.open_ai_model
+        self.path = settings.memory_path or None
+
+    @property
+    def window(self):
+        # History limit in memory mode: the recent turns, one batch to fold and the message itself
+        return self.recent_turns + self.batch + 1
+
+    def is_enabled(self):
+        if self.enabled is None:
+            self.load()
+        return self.enabled
+
+    def recall(self, message, history):
+        """Returns the summary message (or None) and the history records it does not cover.
+
+        Schedules a summary update when enough messages rolled out of the recent turns.
+        """
+        channel_id = message.channel.id
+        summary = self.channels.get(channel_id)
+        last_id = summary.last_id if summary is not None else 0
+        unsummarized = [cached for cached in history if cached.id > last_id]
+        older = unsummarized[:max(0, len(unsummarized) - self.recent_turns)]
+        if len(older) >= self.batch and channel_id not in self.pending:
+            task = asyncio.create_task(self._update(channel_id, message.guild.id, older))
+            self.pending[channel_id] = task
+        if summary is None or not summary.text:
+            return None, unsummarized
+        self.channels.move_to_end(channel_id)
+        return {"role": "system", "content": SUMMARY_PREFIX + summary.text}, unsummarized
+
+    def _summary_prompt(self, previous, messages):
+        lines = '\n'.join(f"{cached.author_name}: {cached.content}" for cached in messages)
+        content = f"Dotychczasowe streszczenie: {previous or 'brak'}\n\nNowe wiadomości:\n{lines}"
+        return [
+            {"role": "system", "content": SUMMARY_BEHAVIOUR.format(max_chars=self.max_chars)},
+            {"role": "user", "content": content},
+        ]
+
+    async def _update(self, channel_id, guild_id, messages):
+        previous = self.channels.get(channel_id)
+        prompt = self._summary_prompt(previous.text if previous is not None else '', messages)
+        tokens = sum(count_tokens(entry["content"], self.model) for entry in prompt) + self.max_tokens
+        try:
+            # Lowest priority: replies go first and a deep queue sheds the update, the next turn retries it
+            response = await request_scheduler.submit(SMALL_TALK, guild_id, lambda: create_chat_completion(
+                guild_id=guild_id,
+                model=self.model,
+                messages=prompt,
+                max_tokens=self.max_tokens,
+            ), tokens)
+            text = (response.choices[0].message.content or '').strip()[:self.max_chars]
+            self.channels[channel_id] = ChannelSummary(text, messages[-1].id, time.time())
+            self.channels.move_to_end(channel_id)
+            while len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+            metrics.inc('warchlak_memory_updates_total', result='ok')
+        except Overloaded:
+            metrics.inc('warchlak_memory_updates_total', result='shed')
+            logging.debug("Summary update for channel %s shed, model queue is full.", channel_id)
+        except Exception as e:
+            metrics.inc('warchlak_memory_updates_total', result='error')
+            logging.error(f"Error while updating the summary of channel {channel_id}: {e}")
+        finally:
+            self.pending.pop(channel_id, None)
+
+    def drop_channel(self, channel_id):
+        self.channels.pop(channel_id, None)
+
+    async def close(self):
+        tasks = list(self.pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.save_to_disk()
+
+    def load_from_disk(self):
+        self.load()
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Error while loading conversation memory {self.path}: {e}")
+            return
+        for channel_id, (text, last_id, updated) in sorted(stored.items(), key=lambda item: item[1][2]):
+            self.channels[int(channel_id)] = ChannelSummary(text[:self.max_chars], last_id, updated)
+        while len(self.channels) > self.max_channels:
+            self.channels.popitem(last=False)
+        logging.info(f"Conversation memory loaded {len(self.channels)} channel summaries from {self.path}.")
+
+    def save_to_disk(self):
+        if not self.path or not self.channels:
+            return
+        temporary_path = f"{self.path}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump({channel_id: (summary.text, summary.last_id, summary.updated)
+                           for channel_id, summary in self.channels.items()}, file, ensure_ascii=False)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            logging.error(f"Error while saving conversation memory {self.path}: {e}")
+
+
+conversation_memory = ConversationMemory()
+on_reload(conversation_memory.load)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import logging
+import sqlite3
+import threading
+
+from services.settings import get_settings
+
+
+def today():
+    return datetime.date.today().strftime("%Y-%m-%d")
+
+
+class GuildQuotaStore:
+    """Daily per-guild message counters.
+
+    Counters live in memory and are flushed in batches to SQLite (WAL mode) on a
+    timer and at shutdown. try_consume never awaits, so a check-and-increment is
+    atomic with respect to other coroutines on the loop. Flushes add increments
+    rather than overwrite totals, so shard processes sharing the file never lose
+    each other's counts.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.pending = {}
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.flush_task = None
+        self.flush_interval = 10.0
+        self.retention_days = 7
+
+    def open(self):
+        if self.db is not None:
+            return
+        settings = get_settings()
+        self.flush_interval = settings.guild_quota_flush_interval
+        self.retention_days = settings.guild_quota_retention_days
+        self.db = sqlite3.connect(settings.guild_quota_db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS guild_quota ("
+            "guild_id INTEGER NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL, "
+            "PRIMARY KEY (guild_id, day)) WITHOUT ROWID")
+        self.prune()
+        day = today()
+        for guild_id, count in self.db.execute("SELECT guild_id, count FROM guild_quota WHERE day = ?", (day,)):
+            self.counts[(guild_id, day)] = count
+        logging.info(f"Guild quota store opened with {len(self.counts)} counters for {day}.")
+
+    def try_consume(self, guild_id, limit):
+        """Returns (allowed, used_before) and counts the message when allowed."""
+        if self.db is None:
+            self.open()
+        key = (guild_id, today())
+        used = self.counts.get(key, 0)
+        if used >= limit:
+            return False, used
+        self.counts[key] = used + 1
+        self.pending[key] = self.pending.get(key, 0) + 1
+        return True, used
+
+    def _write(self, rows):
+        with self.db_lock:
+            self.db.executemany(
+                "INSERT INTO guild_quota (guild_id, day, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, day) DO UPDATE SET count = count + excluded.count", rows)
+            self.db.commit()
+
+    def prune(self):
+        oldest = (datetime.date.today() - datetime.timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+        with self.db_lock:
+            self.db.execute("DELETE FROM guild_quota WHERE day < ?", (oldest,))
+            self.db.commit()
+
+    def _take_dirty_rows(self):
+        rows = [(guild_id, day, increment) for (guild_id, day), increment in self.pending.items()]
+        self.pending = {}
+        # Counters of previous days are final once written, no need to keep them in memory
+        day = today()
+        for key in [key for key in self.counts if key[1] != day]:
+            del self.counts[key]
+        return rows
+
+    async def flush(self):
+        if self.db is None:
+            return
+        rows = self._take_dirty_rows()
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+
+    async def _flush_loop(self):
+        last_day = today()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if today() != last_day:
+                    last_day = today()
+                    await asyncio.to_thread(self.prune)
+            except Exception as e:
+                logging.error(f"Error while flushing guild quota: {e}")
+
+    async def start(self):
+        self.open()
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.db is not None:
+            rows = self._take_dirty_rows()
+            if rows:
+                self._write(rows)
+            self.db.close()
+            self.db = None
+            logging.info("Guild quota store closed.")
+
+
+guild_quota = GuildQuotaStore()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import math
+
+from services.settings import get_settings
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Formats gpt-4o-mini accepts, see the OpenAI vision guide
+IMAGE_TYPES = frozenset(('image/png', 'image/jpeg', 'image/webp', 'image/gif'))
+IMAGE_EXTENSIONS = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'gif': 'image/gif',
+}
+# Low detail: the model sees a 512px version for a flat 85 tokens.
+# High detail: fit in 2048x2048, shortest side scaled to 768, then 170 tokens per 512px tile.
+LOW_DETAIL_SIDE = 512
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIDE = 512
+
+
+class PreparedImage:
+    __slots__ = ('url', 'detail', 'width', 'height', 'size')
+
+    def __init__(self, url, detail, width, height, size):
+        self.url = url
+        self.detail = detail
+        self.width = width
+        self.height = height
+        self.size = size
+
+    def to_content_part(self):
+        return {"type": "image_url", "image_url": {"url": self.url, "detail": self.detail}}
+
+    @property
+    def tokens(self):
+        return estimate_image_tokens(self.width, self.height, self.detail)
+
+
+def image_content_type(attachment):
+    content_type = (attachment.content_type or '').split(';')[0].strip().lower()
+    if not content_type:
+        content_type = IMAGE_EXTENSIONS.get(attachment.filename.rsplit('.', 1)[-1].lower(), '')
+    return content_type if content_type in IMAGE_TYPES else None
+
+
+def image_attachments(message):
+    """Attachments the model can look at, anything else is skipped before downloading."""
+    settings = get_settings()
+    images = [attachment for attachment in message.attachments
+              if image_content_type(attachment) is not None and attachment.size <= settings.image_max_bytes]
+    return images[:settings.image_max_attachments]
+
+
+def scaled_size(width, height, max_side, short_side=None):
+    scale = min(1.0, max_side / max(width, height))
+    if short_side is not None:
+        scale = min(scale, short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def choose_detail(width, height, settings):
+    if settings.image_detail in ('low', 'high'):
+        return settings.image_detail
+    # Small pictures lose nothing at low detail, big ones would cost several tiles
+    if max(width, height) <= settings.image_low_detail_max_side:
+        return 'low'
+    return 'high'
+
+
+def estimate_image_tokens(width, height, detail):
+    if not width or not height:
+        return BASE_TOKENS + 4 * TILE_TOKENS
+    if detail == 'low':
+        return BASE_TOKENS
+    width, height = scaled_size(width, height, HIGH_DETAIL_MAX_SIDE)
+    width, height = scaled_size(width, height, HIGH_DETAIL_MAX_SIDE, HIGH_DETAIL_SHORT_SIDE)
+    return BASE_TOKENS + TILE_TOKENS * math.ceil(width / TILE_SIDE) * math.ceil(height / TILE_SIDE)
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def target_size(width, height, detail, settings):
+    if detail == 'low':
+        return scaled_size(width, height, LOW_DETAIL_SIDE)
+    return scaled_size(width, height, settings.image_max_side, settings.image_short_side)
+
+
+def prepare_image(download, settings):
+    """Downsamples and recompresses one image, runs in a worker thread."""
+    with Image.open(io.BytesIO(download.data)) as image:
+        original_size = image.size
+        detail = choose_detail(image.width, image.height, settings)
+        size = target_size(image.width, image.height, detail, settings)
+        # JPEGs are decoded straight at a fraction of the full resolution
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+        if (image.width > image.height) != (size[0] > size[1]):
+            size = size[::-1]
+        resized = size != original_size
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+        output = io.BytesIO()
+        if has_alpha(image):
+            image.save(output, 'PNG', optimize=True)
+            encoded_type = 'image/png'
+        else:
+            image.convert('RGB').save(output, 'JPEG', quality=settings.image_jpeg_quality, optimize=True)
+            encoded_type = 'image/jpeg'
+    encoded = output.getvalue()
+    if not resized and len(encoded) >= len(download.data) and download.content_type != 'image/gif':
+        # Already small, recompressing would only make it bigger
+        encoded, encoded_type = download.data, download.content_type
+    url = f"data:{encoded_type};base64,{base64.b64encode(encoded).decode('ascii')}"
+    return PreparedImage(url, detail, size[0], size[1], len(encoded))
+
+
+class Download:
+    __slots__ = ('attachment', 'content_type', 'data', 'content_hash')
+
+    def __init__(self, attachment, content_type, data, content_hash):
+        self.attachment = attachment
+        self.content_type = content_type
+        self.data = data
+        self.content_hash = content_hash
+
+
+async def download_image(attachment, settings):
+    try:
+        data = await attachment.read()
+    except Exception as e:
+        logging.warning(f"Could not download attachment {attachment.filename}, sending its URL: {e}")
+        return Download(attachment, image_content_type(attachment), None, attachment.url)
+    if len(data) > settings.image_max_bytes:
+        logging.info(f"Attachment {attachment.filename} is over {settings.image_max_bytes} bytes, skipped.")
+        return None
+    return Download(attachment, image_content_type(attachment), data, hashlib.sha256(data).hexdigest())
+
+
+async def download_images(attachments):
+    """Downloads the attachments concurrently, the content hashes key the response cache."""
+    settings = get_settings()
+    downloads = await asyncio.gather(*(download_image(attachment, settings) for attachment in attachments))
+    return [download for download in downloads if download is not None]
+
+
+async def prepare(download, settings):
+    attachment = download.attachment
+    if download.data is None or Image is None or not settings.image_downsample_enabled:
+        # Without Pillow the model fetches the original, only the detail level is picked here
+        width, height = getattr(attachment, 'width', None), getattr(attachment, 'height', None)
+        detail = choose_detail(width, height, settings) if width and height else 'auto'
+        return PreparedImage(attachment.url, detail, width, height, 0)
+    try:
+        return await asyncio.to_thread(prepare_image, download, settings)
+    except Exception as e:
+        logging.warning(f"Could not decode attachment {attachment.filename}, skipped: {e}")
+        return None
+
+
+async def prepare_images(downloads):
+    """Downsamples the downloaded images in worker threads, undecodable ones are dropped."""
+    settings = get_settings()
+    images = await asyncio.gather(*(prepare(download, settings) for download in downloads))
+    return [image for image in images if image is not None]
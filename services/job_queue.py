@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from services.settings import get_settings
+
+# Job kinds: a reply to a talking channel message or mention, or a random small talk reply
+CHAT = 'chat'
+SMALL_TALK_REPLY = 'small_talk'
+
+
+class QueuedJob:
+    __slots__ = ('id', 'payload', 'response', 'reply', 'sent', 'attempts')
+
+    def __init__(self, job_id, payload, response, reply, sent, attempts):
+        self.id = job_id
+        self.payload = json.loads(payload)
+        # Saved once the model answered, a retried job sends the same text again
+        self.response = response
+        self.reply = bool(reply)
+        # Parts of the response already posted, a retried job continues after them
+        self.sent = sent
+        self.attempts = attempts
+
+
+class JobQueue:
+    """Reply jobs in a SQLite file, written by the gateway process and run by the AI workers.
+
+    A job is keyed by its Discord message, so a message delivered twice is
+    queued once. Jobs are partitioned by guild (guild_id % workers) so all
+    replies of a guild are made by one worker, which keeps its quota, rate
+    limits and caches in one process. A claimed job is leased; a job whose
+    worker died is claimed again once the lease runs out or the worker is
+    restarted.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.last_prune = 0.0
+
+    def open(self):
+        if self.db is not None:
+            return
+        settings = get_settings()
+        self.db = sqlite3.connect(settings.job_queue_path, check_same_thread=False, isolation_level=None,
+                                  timeout=settings.job_queue_busy_timeout)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, partition INTEGER NOT NULL, "
+            "priority INTEGER NOT NULL, payload TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'queued', "
+            "attempts INTEGER NOT NULL DEFAULT 0, worker INTEGER, lease_until REAL, "
+            "response TEXT, reply INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0, "
+            "created REAL NOT NULL, updated REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, priority, id)")
+        logging.info(f"Job queue opened at {settings.job_queue_path}.")
+
+    def _execute(self, sql, parameters=()):
+        if self.db is None:
+            self.open()
+        with self.db_lock:
+            return self.db.execute(sql, parameters)
+
+    def enqueue(self, key, partition, priority, payload, now=None):
+        """Queues a job unless one with the same key exists; returns whether it was added."""
+        now = time.time() if now is None else now
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO jobs (key, partition, priority, payload, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, partition, priority, json.dumps(payload, ensure_ascii=False, separators=(',', ':')), now, now))
+        self._prune(now)
+        return cursor.rowcount == 1
+
+    def claim(self, index, workers, now=None):
+        """Leases the next job of this worker's partition, highest priority first."""
+        now = time.time() if now is None else now
+        # fetchall: the statement holds the write lock until all its rows are read
+        rows = self._execute(
+            "UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE partition % ? = ? "
+            "AND (state = 'queued' OR (state = 'running' AND lease_until < ?)) ORDER BY priority, id LIMIT 1) "
+            "RETURNING id, payload, response, reply, sent, attempts",
+            (index, now + get_settings().job_queue_lease, now, workers, index, now)).fetchall()
+        return QueuedJob(*rows[0]) if rows else None
+
+    def release(self, index):
+        """Puts the running jobs of a worker back in the queue, called when that worker (re)starts."""
+        cursor = self._execute("UPDATE jobs SET state = 'queued' WHERE state = 'running' AND worker = ?", (index,))
+        if cursor.rowcount:
+            logging.warning(f"Requeued {cursor.rowcount} jobs of a previous run of worker {index}.")
+
+    def save_response(self, job_id, response, reply):
+        self._execute("UPDATE jobs SET response = ?, reply = ?, updated = ? WHERE id = ?",
+                      (response, int(reply), time.time(), job_id))
+
+    def mark_sent(self, job_id, sent):
+        # Progress also renews the lease, paced replies can take longer than one
+        now = time.time()
+        self._execute("UPDATE jobs SET sent = ?, lease_until = ?, updated = ? WHERE id = ?",
+                      (sent, now + get_settings().job_queue_lease, now, job_id))
+
+    def complete(self, job_id):
+        self._execute("UPDATE jobs SET state = 'done', updated = ? WHERE id = ?", (time.time(), job_id))
+
+    def fail(self, job, error):
+        state = 'queued' if job.attempts < get_settings().job_queue_max_attempts else 'failed'
+        self._execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ?", (state, time.time(), job.id))
+        logging.error(f"Job {job.id} failed (attempt {job.attempts}), {state}: {error}")
+
+    def depth(self):
+        return self._execute("SELECT count(*) FROM jobs WHERE state IN ('queued', 'running')").fetchone()[0]
+
+    def _prune(self, now):
+        # Finished jobs are kept for a while so a redelivered message is still recognised
+        if now - self.last_prune < 60:
+            return
+        self.last_prune = now
+        self._execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated < ?",
+                      (now - get_settings().job_queue_retention,))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+job_queue = JobQueue()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+
+from services.rate_limiter import parse_rate
+from services.settings import get_settings, on_reload
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(funcName)s - %(message)s'
+# Everything else on a record came in through `extra=` and ends up as a field of the JSON line
+STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'throttle'}
+
+
+class ThrottleFilter(logging.Filter):
+    """Lets through `limit` records per `seconds` for each call site logged with extra={'throttle': True}.
+
+    The first record after a full window carries the number of dropped ones in `suppressed`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rate = None
+        self.windows = {}
+
+    def load(self, settings):
+        self.rate = parse_rate(settings.log_throttle)
+        self.windows.clear()
+
+    def filter(self, record):
+        if self.rate is None or not getattr(record, 'throttle', False):
+            return True
+        limit, seconds = self.rate
+        key = (record.pathname, record.lineno)
+        window = self.windows.get(key)
+        # [window start, records let through, records dropped]
+        if window is None or record.created - window[0] >= seconds:
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            window = self.windows[key] = [record.created, 0, 0]
+        if window[1] < limit:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue as they are, message formatting happens on the listener thread.
+
+    Arguments are formatted later, so pass values (ids, strings, numbers), not objects that keep changing.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, 'suppressed', None):
+            line += f" ({record.suppressed} similar lines suppressed)"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'function': record.funcName,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in STANDARD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+throttle_filter = ThrottleFilter()
+listener = None
+
+
+def setup_logging(settings=None):
+    """Routes the root logger through a queue, handlers write from a background thread."""
+    global listener
+    settings = settings or get_settings()
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if settings.log_format == 'json' else TextFormatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(throttle_filter)
+    throttle_filter.load(settings)
+
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(settings.log_level.upper())
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Writes out what is still queued and stops the listener thread."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def reload_logging(settings):
+    logging.getLogger().setLevel(settings.log_level.upper())
+    throttle_filter.load(settings)
+
+
+on_reload(reload_logging)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from services.settings import get_settings, on_reload
+
+
+class CachedMessage:
+    __slots__ = ('id', 'author_id', 'author_name', 'is_bot', 'content', 'token_count')
+
+    def __init__(self, message_id, author_id, author_name, is_bot, content):
+        self.id = message_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.is_bot = is_bot
+        self.content = content
+        self.token_count = None
+
+    @classmethod
+    def from_discord(cls, message):
+        return cls(message.id, message.author.id, message.author.display_name, message.author.bot,
+                   message.content.strip())
+
+
+class ChannelBuffer:
+    __slots__ = ('messages', 'warm')
+
+    def __init__(self, maxlen):
+        self.messages = deque(maxlen=maxlen)
+        # Warm once the recent history was fetched over REST; from then on gateway events keep it complete
+        self.warm = False
+
+
+class MessageCache:
+    """Bounded ring buffer of recent messages per channel, fed from gateway events.
+
+    Channels are kept in least-recently-used order and whole idle channels are
+    dropped once the total number of cached messages exceeds the global cap.
+    """
+
+    def __init__(self):
+        self.channels = OrderedDict()
+        self.total = 0
+        self.per_channel = None
+        self.max_messages = None
+
+    def load(self, settings=None):
+        settings = settings or get_settings()
+        # Applies to buffers created from now on, existing ones keep their size
+        self.per_channel = max(settings.message_cache_per_channel, settings.message_history_limit,
+                               settings.memory_recent_turns + settings.memory_summary_batch + 1)
+        self.max_messages = settings.message_cache_max_messages
+
+    def _buffer(self, channel_id):
+        if self.per_channel is None:
+            self.load()
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            buffer = ChannelBuffer(self.per_channel)
+            self.channels[channel_id] = buffer
+        else:
+            self.channels.move_to_end(channel_id)
+        return buffer
+
+    def _evict(self):
+        while self.total > self.max_messages and len(self.channels) > 1:
+            channel_id, buffer = self.channels.popitem(last=False)
+            self.total -= len(buffer.messages)
+            logging.debug(f"Message cache evicted channel {channel_id}")
+
+    def add(self, message):
+        buffer = self._buffer(message.channel.id)
+        if len(buffer.messages) == buffer.messages.maxlen:
+            self.total -= 1
+        buffer.messages.append(CachedMessage.from_discord(message))
+        self.total += 1
+        self._evict()
+
+    def edit(self, channel_id, message_id, content):
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            return
+        for cached in reversed(buffer.messages):
+            if cached.id == message_id:
+                cached.content = content.strip()
+                cached.token_count = None
+                return
+
+    def delete(self, channel_id, message_ids):
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            return
+        kept = [cached for cached in buffer.messages if cached.id not in message_ids]
+        self.total -= len(buffer.messages) - len(kept)
+        buffer.messages.clear()
+        buffer.messages.extend(kept)
+
+    def replace(self, channel_id, messages):
+        """Sets the buffer of a channel to messages, e.g. the history shipped with an AI worker job."""
+        buffer = self._buffer(channel_id)
+        self.total -= len(buffer.messages)
+        buffer.messages.clear()
+        buffer.messages.extend(messages)
+        buffer.warm = True
+        self.total += len(buffer.messages)
+        self._evict()
+
+    def drop_channel(self, channel_id):
+        buffer = self.channels.pop(channel_id, None)
+        if buffer is not None:
+            self.total -= len(buffer.messages)
+
+    def mark_all_cold(self):
+        # Events may have been missed (e.g. a new gateway session), refetch before trusting the buffers
+        for buffer in self.channels.values():
+            buffer.warm = False
+
+    async def _warm_up(self, channel, buffer):
+        fetched = [CachedMessage.from_discord(msg) async for msg in channel.history(limit=buffer.messages.maxlen)]
+        merged = {cached.id: cached for cached in fetched}
+        merged.update((cached.id, cached) for cached in buffer.messages)
+        self.total -= len(buffer.messages)
+        buffer.messages.clear()
+        buffer.messages.extend(merged[message_id] for message_id in sorted(merged))
+        self.total += len(buffer.messages)
+        buffer.warm = True
+        self._evict()
+
+    async def warm(self, channels):
+        """Fetches the history of the cold channels up front, so their next reply reads it from memory."""
+        cold = [(channel, self._buffer(channel.id)) for channel in channels]
+        results = await asyncio.gather(*(self._warm_up(channel, buffer) for channel, buffer in cold if not buffer.warm),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.warning(f"Message cache warm-up failed: {result}")
+
+    async def history(self, message, limit):
+        """Returns up to limit - 1 messages before message (oldest first), like channel.history(limit=limit)."""
+        buffer = self._buffer(message.channel.id)
+        if not buffer.warm:
+            logging.info("Message cache cold for channel %s, fetching history.", message.channel.id)
+            await self._warm_up(message.channel, buffer)
+        recent = list(buffer.messages)[-limit:]
+        return [cached for cached in recent if cached.id != message.id]
+
+
+message_cache = MessageCache()
+on_reload(message_cache.load)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import re
+import time
+
+from services.settings import get_settings
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[a-zA-Z][.!?])\s+')
+
+
+class SentenceSender:
+    """Sends a response to the channel sentence by sentence.
+
+    Text can be fed in chunks as it streams from the model; every sentence is queued
+    as soon as its boundary is seen and sent by a background task, so pacing never
+    holds up the model stream. Sentences are paced response_sentence_delay seconds
+    apart, counting the time already spent since the previous send; the first one
+    waits response_first_sentence_delay counted from started.
+    """
+
+    def __init__(self, channel, started=None):
+        settings = get_settings()
+        self.channel = channel
+        self.last_sent = started if started is not None else time.monotonic()
+        self.delay = settings.response_sentence_delay
+        self.first_delay = settings.response_first_sentence_delay
+        self.buffer = ''
+        self.sent = 0
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    @property
+    def streamed(self):
+        return self.task is not None
+
+    async def _send(self, sentence):
+        wait = (self.delay if self.sent else self.first_delay) - (time.monotonic() - self.last_sent)
+        if wait > 0:
+            async with self.channel.typing():
+                await asyncio.sleep(wait)
+        await self.channel.send(sentence)
+        self.last_sent = time.monotonic()
+        self.sent += 1
+
+    async def _send_loop(self):
+        while True:
+            sentence = await self.queue.get()
+            if sentence is None:
+                return
+            try:
+                await self._send(sentence)
+            except Exception as e:
+                logging.error(f"Error sending response in parts: {e}")
+
+    def _enqueue(self, sentence):
+        if self.task is None:
+            self.task = asyncio.create_task(self._send_loop())
+        sentence = sentence.strip()
+        if sentence:
+            self.queue.put_nowait(sentence)
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = SENTENCE_BOUNDARY.split(self.buffer)
+        self.buffer = sentences.pop()
+        for sentence in sentences:
+            self._enqueue(sentence)
+
+    def finish(self):
+        """Queues the rest of the buffer; no more text is fed after this."""
+        buffer, self.buffer = self.buffer, ''
+        self._enqueue(buffer)
+        self.queue.put_nowait(None)
+
+    async def wait(self):
+        if self.task is not None:
+            await self.task
+
+    async def send_all(self, response):
+        if not response.strip():
+            logging.warning("Response is empty, nothing to send.")
+            return
+        self.feed(response)
+        self.finish()
+        await self.wait()
+
+
+async def send_response_in_parts(channel, response, started=None):
+    try:
+        await SentenceSender(channel, started).send_all(response)
+    except Exception as e:
+        logging.error(f"Error sending response in parts: {e}")
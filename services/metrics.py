@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+
+from services.settings import get_settings, on_reload
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_SECONDS = 'warchlak_on_message_stage_seconds'
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'started')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_TIMER = NoopTimer()
+
+
+def format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class Metrics:
+    """Latency histograms, counters and gauges for the message hot path.
+
+    While disabled every call returns right away, so instrumentation can stay in
+    place. Exposed as Prometheus text on 127.0.0.1:metrics_port and/or as a JSON
+    snapshot written to metrics_snapshot_path.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.tasks = []
+        self.runner = None
+
+    def configure(self, settings=None):
+        self.enabled = (settings or get_settings()).metrics_enabled
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return NOOP_TIMER
+        return Timer(self, name, labels)
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name, callback):
+        """Registers callback() read whenever the metrics are exported."""
+        self.gauges[name] = callback
+
+    def render_prometheus(self):
+        lines = []
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, callback in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {callback()}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'histograms': {
+                name: [{'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                        'buckets': dict(zip([*map(str, LATENCY_BUCKETS), '+Inf'], histogram.counts))}
+                       for labels, histogram in series.items()]
+                for name, series in self.histograms.items()
+            },
+            'counters': {name: [{'labels': dict(labels), 'value': value} for labels, value in series.items()]
+                         for name, series in self.counters.items()},
+            'gauges': {name: callback() for name, callback in self.gauges.items()},
+        }
+
+    async def _monitor_loop_lag(self, interval):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe('warchlak_event_loop_lag_seconds', time.perf_counter() - started - interval)
+
+    @staticmethod
+    def _write_snapshot(path, snapshot):
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary_path, path)
+
+    async def _write_snapshots(self, path, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self._write_snapshot, path, self.snapshot())
+            except OSError as e:
+                logging.error(f"Error while writing metrics snapshot {path}: {e}")
+
+    async def _serve(self, port):
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.render_prometheus(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', port).start()
+        logging.info(f"Metrics available on http://127.0.0.1:{port}/metrics")
+
+    async def start(self):
+        settings = get_settings()
+        self.configure(settings)
+        if not self.enabled:
+            return
+        self.tasks.append(asyncio.create_task(self._monitor_loop_lag(settings.metrics_loop_lag_interval)))
+        if settings.metrics_snapshot_path:
+            self.tasks.append(asyncio.create_task(
+                self._write_snapshots(settings.metrics_snapshot_path, settings.metrics_snapshot_interval)))
+        if settings.metrics_port:
+            await self._serve(settings.metrics_port)
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+metrics = Metrics()
+on_reload(metrics.configure)
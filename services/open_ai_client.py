@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from services.metrics import STAGE_SECONDS, metrics
+from services.resilience import ModelUnavailable, is_model_failure, model_guard
+from services.settings import get_settings
+
+
+class ClientRegistry:
+    """Process-wide model clients, created once at startup and closed with the bot."""
+
+    def __init__(self):
+        self.open_ai = None
+        self.semaphore = None
+
+    def has_api_key(self, settings=None):
+        # AsyncOpenAI cannot be created without a key; a bot with AI turned off may have none
+        settings = settings or get_settings()
+        return bool(settings.open_ai_api_token or os.getenv('OPENAI_API_KEY'))
+
+    def start(self):
+        if self.open_ai is not None:
+            return self.open_ai
+        settings = get_settings()
+        limits = httpx.Limits(
+            max_connections=settings.open_ai_pool_max_connections,
+            max_keepalive_connections=settings.open_ai_pool_max_keepalive_connections,
+            keepalive_expiry=settings.open_ai_pool_keepalive_expiry,
+        )
+        timeout = httpx.Timeout(settings.open_ai_timeout, connect=settings.open_ai_connect_timeout)
+        self.open_ai = AsyncOpenAI(
+            api_key=settings.open_ai_api_token or None,
+            base_url=settings.open_ai_base_url or None,
+            timeout=timeout,
+            max_retries=settings.open_ai_max_retries,
+            http_client=DefaultAsyncHttpxClient(limits=limits, timeout=timeout),
+        )
+        # Global limit of model requests in flight at the same time
+        self.semaphore = asyncio.Semaphore(settings.open_ai_max_concurrent_requests)
+        logging.info(f"OpenAI client pool started: {limits}, {timeout}")
+        return self.open_ai
+
+    async def close(self):
+        if self.open_ai is not None:
+            await self.open_ai.close()
+            self.open_ai = None
+            self.semaphore = None
+            logging.info("OpenAI client pool closed.")
+
+
+registry = ClientRegistry()
+
+
+def get_client():
+    return registry.start()
+
+
+def record_usage(usage, model, guild_id):
+    if usage is not None:
+        metrics.inc('warchlak_tokens_total', usage.prompt_tokens, kind='prompt', model=model, guild=guild_id)
+        metrics.inc('warchlak_tokens_total', usage.completion_tokens, kind='completion', model=model, guild=guild_id)
+        logging.info("Costs (%s): %s+%s=%s", model, usage.prompt_tokens, usage.completion_tokens, usage.total_tokens,
+                     extra={'model': model, 'guild_id': guild_id, 'prompt_tokens': usage.prompt_tokens,
+                            'completion_tokens': usage.completion_tokens})
+
+
+async def create_chat_completion(guild_id=None, fallback=False, **kwargs):
+    """Chat completion within open_ai_deadline; fallback=True tries open_ai_fallback_models after the model."""
+    client = get_client()
+
+    async def call(model):
+        async with registry.semaphore:
+            with metrics.timer(STAGE_SECONDS, stage='model'):
+                response = await client.chat.completions.create(**dict(kwargs, model=model))
+        record_usage(response.usage, model, guild_id)
+        return response
+
+    models = model_guard.chain(kwargs['model']) if fallback else (kwargs['model'],)
+    return await model_guard.call(models, call)
+
+
+async def create_completion(guild_id=None, **kwargs):
+    client = get_client()
+
+    async def call(model):
+        async with registry.semaphore:
+            with metrics.timer(STAGE_SECONDS, stage='model'):
+                response = await client.completions.create(**dict(kwargs, model=model))
+        record_usage(response.usage, model, guild_id)
+        return response
+
+    return await model_guard.call((kwargs['model'],), call)
+
+
+async def stream_chat_completion(guild_id=None, **kwargs):
+    """Yields the content deltas of a streamed chat completion.
+
+    The deadline and the circuit breaker cover the start of the stream only,
+    there is no fallback once sentences may have been sent.
+    """
+    client = get_client()
+    breaker = model_guard.breaker(kwargs['model'])
+    if not breaker.allow():
+        raise ModelUnavailable(f"Circuit of {kwargs['model']} is open")
+    deadline = get_settings().open_ai_deadline or None
+    async with registry.semaphore:
+        with metrics.timer(STAGE_SECONDS, stage='model'):
+            try:
+                stream = await asyncio.wait_for(client.chat.completions.create(
+                    stream=True, stream_options={"include_usage": True}, **kwargs), deadline)
+            except Exception as e:
+                breaker.record(is_model_failure(e))
+                raise
+            except asyncio.CancelledError:
+                breaker.probing = False
+                raise
+        breaker.record(False)
+        async for chunk in stream:
+            if chunk.usage is not None:
+                record_usage(chunk.usage, kwargs.get('model'), guild_id)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
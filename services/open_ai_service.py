@@ -1,18 +1,30 @@
 # -*- coding: utf-8 -*-
-import datetime
 import json
 import logging
-import os
 import re
-import time
 
-import openai
 from discord.ext import commands
-from openai import OpenAI
+
+from services.guild_quota import guild_quota
+from services.activity_index import get_user_activity
+from services.conversation_memory import conversation_memory
+from services.image_pipeline import download_images, image_attachments, prepare_images
+from services.message_cache import message_cache
+from services.metrics import STAGE_SECONDS, metrics
+from services.open_ai_client import create_chat_completion, create_completion, stream_chat_completion
+from services.prompt_builder import build_prompt, get_token_budget, sanitize_name
+from services.request_scheduler import DIRECT, IMAGE, SMALL_TALK, Overloaded, request_scheduler
+from services.rate_limiter import rate_limits
+from services.resilience import ModelUnavailable, model_guard
+from services.response_cache import make_key, normalize_prompt, response_cache
+from services.settings import get_settings
 
 GPT_35_TURBO_ = 'gpt-3.5-turbo-0125'
 GPT_35_TURBO_INSTRUCT = 'gpt-3.5-turbo-instruct'
-last_user_message_times = {}
+GPT_4O_MINI = 'gpt-4o-mini'
+SMALL_TALK_MAX_TOKENS = 70
+BOT_MENTION_PATTERN = re.compile(r'<@!?1318180349473325137>')  # Remove bot ID
+SMALL_TALK_BEHAVIOUR = "Jesteś botem, który losowo reaguje na wiadomości, udzielając sarkastycznych odpowiedzi. Twoje odpowiedzi mają być krótkie, cięte i pełne humoru Pamiętaj, aby były to odpowiedzi, które mogą rozbawić, ale również delikatnie złośliwe."
 
 
 def get_tools():
@@ -21,7 +33,7 @@ def get_tools():
             "type": "function",
             "function": {
                 "name": "get_user_activity",
-                "description": "Get user's activity",
+                "description": "Get user's activity: messages (total, last 24h, last 7 days), first and last seen, most active channels",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -38,174 +50,152 @@ def get_tools():
     return tools
 
 
-async def get_messages_with_chat_history_for_small_talk(message_to_ai):
-    user_id_pattern = re.compile(r'<@!?1318180349473325137>')  # Remove bot ID
-    cleaned_content = user_id_pattern.sub('', message_to_ai.content.strip())
-    message_history_enabled = os.getenv('message_history_enabled', 'false').lower() == 'true'
-    ai_behaviour = "Jesteś botem, który losowo reaguje na wiadomości, udzielając sarkastycznych odpowiedzi. Twoje odpowiedzi mają być krótkie, cięte i pełne humoru Pamiętaj, aby były to odpowiedzi, które mogą rozbawić, ale również delikatnie złośliwe."
-    limit = int(os.getenv('message_history_limit', 3))
-
-    messages = [{"role": "system", "content": ai_behaviour}]
+def remove_bot_mention(text):
+    return BOT_MENTION_PATTERN.sub('', text.strip())
 
-    if message_history_enabled:
-        messages.extend(await get_history_messages(message_to_ai, limit))
-
-    # Add current prompt
-    messages.append({"role": "user", "content": cleaned_content})
-    return messages
 
-
-async def get_messages_with_chat_history(message_to_ai):
-    user_id_pattern = re.compile(r'<@!?1318180349473325137>')
-    cleaned_content = user_id_pattern.sub('', message_to_ai.content.strip())
-    message_history_enabled = os.getenv('message_history_enabled', 'false').lower() == 'true'
-
-    ai_behaviour = os.getenv('ai_behavior')
+def get_ai_behaviour(message_to_ai):
     if str(message_to_ai.author.id) == "725426177790967818":
-        ai_behaviour = "Udzielaj odpowiedzi maksymalnie jednym krótkim zdaniem. Badź podniecony. Nie uzywaj znaku :"
-
-    limit = int(os.getenv('message_history_limit', 5))
-    messages = [{"role": "system", "content": ai_behaviour}]
-
-    if message_history_enabled:
-        messages.extend(await get_history_messages(message_to_ai, limit))
-
+        return "Udzielaj odpowiedzi maksymalnie jednym krótkim zdaniem. Badź podniecony. Nie uzywaj znaku :"
+    return get_settings().ai_behavior
+
+
+async def get_messages_with_chat_history_for_small_talk(message_to_ai, model=None):
+    settings = get_settings()
+    cleaned_content = remove_bot_mention(message_to_ai.content)
+    ai_behaviour = SMALL_TALK_BEHAVIOUR
+    model = model or settings.open_ai_model
+
+    history = []
+    if settings.message_history_enabled:
+        history = await get_history_messages(message_to_ai, settings.message_history_limit)
+    with metrics.timer(STAGE_SECONDS, stage='prompt'):
+        return build_prompt(ai_behaviour, history, {"role": "user", "content": cleaned_content}, model)
+
+
+async def get_messages_with_chat_history(message_to_ai, model=None):
+    settings = get_settings()
+    cleaned_content = remove_bot_mention(message_to_ai.content)
+    ai_behaviour = get_ai_behaviour(message_to_ai)
+    model = model or settings.open_ai_model
+
+    history = []
+    summary = None
+    if settings.message_history_enabled and conversation_memory.is_enabled():
+        # Summary of the older conversation plus only the turns it does not cover yet
+        history = await get_history_messages(message_to_ai, conversation_memory.window)
+        summary, history = conversation_memory.recall(message_to_ai, history)
+    elif settings.message_history_enabled:
+        history = await get_history_messages(message_to_ai, settings.message_history_limit)
     # Add current prompt
-    messages.append({"role": "user", "content": cleaned_content, "name": sanitize_name(message_to_ai.author.display_name)})
-    return messages
-
-
-def sanitize_name(name):
-    sanitized_name = re.sub(r'[^a-zA-Z0-9_-]', '_', name)
-    return sanitized_name
+    user_turn = {"role": "user", "content": cleaned_content, "name": sanitize_name(message_to_ai.author.display_name)}
+    with metrics.timer(STAGE_SECONDS, stage='prompt'):
+        return build_prompt(ai_behaviour, history, user_turn, model, summary)
 
 
 async def get_history_messages(message_to_ai, limit):
     history_messages = []
     try:
-        async for msg in message_to_ai.channel.history(limit=limit):
-            if msg.id == message_to_ai.id or not msg.content.strip():
+        with metrics.timer(STAGE_SECONDS, stage='history'):
+            cached_history = await message_cache.history(message_to_ai, limit)
+        for msg in cached_history:
+            if not msg.content:
                 continue
-
-            role = "assistant" if msg.author.bot else "user"
-            history_messages.append({
-                "role": role,
-                "content": msg.content.strip(),
-                "name": sanitize_name(msg.author.display_name)
-            })
-            logging.info(f"History append: {msg.author.display_name}: {msg.content.strip()}")
+            history_messages.append(msg)
+            logging.debug("History append: %s: %s", msg.author_name, msg.content)
     except Exception as e:
         logging.error(f"Error while fetching history: {e}")
-    history_messages.reverse()
     return history_messages
 
 
-def can_user_send_message(user_id):
-    if user_id not in last_user_message_times:
-        last_user_message_times[user_id] = []
-
-    delay_new_message_per_user = int(os.getenv('open_ai_number_of_msg_per_sec_user'))
-    if last_user_message_times[user_id]:
-        last_user_message_time = last_user_message_times[user_id][-1]
-    else:
-        last_user_message_time = 0
-
-    elapsed_time = time.time() - last_user_message_time
-    if elapsed_time >= delay_new_message_per_user:
-        last_user_message_times[user_id].append(time.time())
-        return True
-    else:
-        return False
-
-
 def can_guild_send_message(guild_id):
-    today = datetime.date.today().strftime("%Y-%m-%d")
-    file_path = f"guild_data_{guild_id}.json"
-    max_number_msg = int(os.getenv('open_ai_max_number_of_messages_per_guild_per_day'))
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            try:
-                guild_data = json.load(file)
-            except json.JSONDecodeError:
-                guild_data = {}
-    else:
-        guild_data = {}
-
-    if today not in guild_data:
-        guild_data[today] = 0
-    remain_requests = int(max_number_msg) - int(guild_data[today])
-    logging.info(f'Remaining requests for guild {guild_id}: {max_number_msg}-{guild_data[today]}={remain_requests} ')
-    if guild_data[today] < max_number_msg:
-        guild_data[today] += 1
-        with open(file_path, 'w', encoding='utf-8') as file:
-            json.dump(guild_data, file)
-        return True
-    else:
-        return False
-
-
-def analyze_image(message_to_ai):
-    attachment = message_to_ai.attachments[0]
-    image_url = attachment.url
-    logging.info(f"Image URL: {image_url}")
-    client = OpenAI(
-        api_key=os.getenv('open_ai_api_token'),
-    )
-    prompt = message_to_ai.content.strip()
-    logging.info(f"Prompt before: {prompt}")
-    user_id_pattern = re.compile(r'<@!?1318180349473325137>')  # Remove bot ID
-    prompt = user_id_pattern.sub('', message_to_ai.content.strip())
+    max_number_msg = get_settings().max_messages_per_guild_per_day
+    allowed, used = guild_quota.try_consume(guild_id, max_number_msg)
+    if not allowed:
+        metrics.inc('warchlak_rejections_total', reason='guild_quota', guild=guild_id)
+    logging.info("Remaining requests for guild %s: %s-%s=%s", guild_id, max_number_msg, used, max_number_msg - used,
+                 extra={'guild_id': guild_id, 'quota_used': used})
+    return allowed
+
+
+async def analyze_image(message_to_ai, attachments=None):
+    """Describes the image attachments of a message in one model call, None when none of them is usable."""
+    attachments = attachments if attachments is not None else image_attachments(message_to_ai)
+    prompt = remove_bot_mention(message_to_ai.content)
     if not prompt:
         prompt = (
             f"Zabawnie interpretuj zdjecie. Badz sarkastyczny, złośliwy. Maks 2 zdania.")
-    logging.info(f"Prompt after: {prompt}")
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    logging.debug("Image prompt: %s", prompt)
+    with metrics.timer(STAGE_SECONDS, stage='image'):
+        downloads = await download_images(attachments)
+    if not downloads:
+        return None
+    cache_key = make_key('image', GPT_4O_MINI, normalize_prompt(prompt), *(download.content_hash for download in downloads))
+    cached_response = response_cache.get(cache_key)
+    if cached_response is not None:
+        logging.info("Image analysis served from cache: %s", cache_key)
+        return cached_response
+    with metrics.timer(STAGE_SECONDS, stage='image'):
+        images = await prepare_images(downloads)
+    if not images:
+        return None
+    logging.info("Images: %s", ', '.join(f"{image.width}x{image.height} {image.detail} {image.size}B" for image in images))
+    response = await request_scheduler.submit(IMAGE, message_to_ai.guild.id, lambda: create_chat_completion(
+        guild_id=message_to_ai.guild.id,
+        model=GPT_4O_MINI,
         messages=[
             {
                 "role": "user",
                 "content": [
                     {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"{image_url}"},
-                    },
+                    *(image.to_content_part() for image in images),
                 ],
             }
         ],
-    )
-    logging.info(f"Response from API OpenAI: {response}")
+    ), sum(image.tokens for image in images))
+    logging.debug("Response from API OpenAI: %s", response)
+    response_cache.put(cache_key, response.choices[0].message.content)
     return response.choices[0].message.content
 
 
 async def small_talk_with_gpt(message):
-    openai.api_key = os.getenv('open_ai_api_token')
-    openai_model = os.getenv('open_ai_model')
-    prompt = await get_messages_with_chat_history_for_small_talk(message)
-    response = openai.chat.completions.create(
-        messages=prompt,
-        model=openai_model,
-        max_tokens=70,
-    )
-    logging.info(f"Response from API OpenAI: {response}")
-    logging.info(
-        f"Costs (second call): {response.usage.prompt_tokens}+{response.usage.completion_tokens}={response.usage.total_tokens}")
+    openai_model = get_settings().open_ai_model
+    cache_key = make_key('small_talk', openai_model, SMALL_TALK_BEHAVIOUR, normalize_prompt(remove_bot_mention(message.content)))
+    cached_response = response_cache.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    async def call_model():
+        prompt = await get_messages_with_chat_history_for_small_talk(message, openai_model)
+        return await create_chat_completion(
+            guild_id=message.guild.id,
+            messages=prompt,
+            model=openai_model,
+            max_tokens=SMALL_TALK_MAX_TOKENS,
+            fallback=True,
+        )
+
+    # Raises Overloaded when the queue is deep, small talk is the first to go
+    response = await request_scheduler.submit(SMALL_TALK, message.guild.id, call_model,
+                                              get_token_budget(openai_model) + SMALL_TALK_MAX_TOKENS)
+    logging.debug("Response from API OpenAI: %s", response)
+    response_cache.put(cache_key, response.choices[0].message.content)
     return response.choices[0].message.content
 
 
 class OpenAIService(commands.Cog):
-    def __init__(self, model_ai):
+    def __init__(self, model_ai, settings=None):
+        settings = settings or get_settings()
         self.model_ai = model_ai
-
-    open_ai_token = os.getenv('open_ai_api_token')
-    ai_behaviour = os.getenv('ai_behavior')
-    top_p = float(os.getenv('open_ai_top_p'))
-    max_tokens = int(os.getenv('open_ai_max_tokens'))
-    temperature = float(os.getenv('open_ai_temperature'))
-
-    def gpt_35_turbo_instruct(self, message_to_ai):
-        client = OpenAI(self.open_ai_token)
-        response = client.completions.create(
+        self.top_p = settings.open_ai_top_p
+        self.max_tokens = settings.open_ai_max_tokens
+        self.temperature = settings.open_ai_temperature
+        self.streaming = settings.open_ai_streaming_enabled
+        self.tools_enabled = settings.open_ai_tools_enabled
+
+    async def gpt_35_turbo_instruct(self, message_to_ai):
+        response = await create_completion(
+            guild_id=message_to_ai.guild.id,
             # Not supporting chat history, yet!
             prompt=message_to_ai,
             model=self.model_ai,
@@ -213,39 +203,40 @@ class OpenAIService(commands.Cog):
             max_tokens=self.max_tokens,
             temperature=self.temperature
         )
-        logging.info(f"Response from API OpenAI: {response}")
-        logging.info(
-            f"Costs: {response.usage.prompt_tokens}+{response.usage.completion_tokens}={response.usage.total_tokens}")
+        logging.debug("Response from API OpenAI: %s", response)
         return response.choices[0].text
 
     async def gpt_35_turbo_0125(self, message, is_tools_enabled):
-        openai.api_key = self.open_ai_token
         if is_tools_enabled is True:
-            prompt = await get_messages_with_chat_history(message)
-            response = openai.chat.completions.create(
+            prompt = await get_messages_with_chat_history(message, self.model_ai)
+            response = await create_chat_completion(
+                guild_id=message.guild.id,
                 messages=prompt,
                 model=self.model_ai,
                 max_tokens=self.max_tokens,
                 tools=get_tools(),
                 tool_choice="auto",
+                fallback=True,
             )
-            logging.info(f"First response from API OpenAI: {response}")
-            logging.info(
-                f"Costs (first call): {response.usage.prompt_tokens}+{response.usage.completion_tokens}={response.usage.total_tokens}")
+            logging.debug("First response from API OpenAI: %s", response)
             available_tools = {
-                'get_user_activity': ""
+                'get_user_activity': get_user_activity
             }
             message_response = response.choices[0].message
             if message_response.tool_calls:
-                prompt = await get_messages_with_chat_history(message)
+                # Second call: the same prompt plus the tool calls and their results
                 messages = prompt
                 messages.append(message_response)
                 for tool_call in message_response.tool_calls:
                     function_name = tool_call.function.name
-                    function_to_call = available_tools[function_name]
-                    function_args = json.loads(tool_call.function.arguments)
-                    function_args["guild_context"] = message.guild
-                    function_response = function_to_call(**function_args)
+                    function_to_call = available_tools.get(function_name)
+                    try:
+                        function_args = json.loads(tool_call.function.arguments)
+                        function_args["guild_context"] = message.guild
+                        function_response = function_to_call(**function_args)
+                    except Exception as e:
+                        logging.warning(f"Tool call {function_name} failed: {e}")
+                        function_response = json.dumps({"error": f"{function_name} is not available"})
                     messages.append(
                         {
                             "tool_call_id": tool_call.id,
@@ -254,50 +245,96 @@ class OpenAIService(commands.Cog):
                             "content": function_response,
                         }
                     )
-                response = openai.chat.completions.create(
+                response = await create_chat_completion(
+                    guild_id=message.guild.id,
                     model=self.model_ai,
                     messages=messages,
+                    fallback=True,
                 )
-                logging.info(f"Second response from API OpenAI: {response}")
-                logging.info(
-                    f"Costs (second call): {response.usage.prompt_tokens}+{response.usage.completion_tokens}={response.usage.total_tokens}")
+                logging.debug("Second response from API OpenAI: %s", response)
                 return response.choices[0].message.content
+            return message_response.content
         else:
-            prompt = await get_messages_with_chat_history(message)
-            response = openai.chat.completions.create(
+            prompt = await get_messages_with_chat_history(message, self.model_ai)
+            response = await create_chat_completion(
+                guild_id=message.guild.id,
                 messages=prompt,
                 model=self.model_ai,
                 max_tokens=self.max_tokens,
+                fallback=True,
             )
-            logging.info(f"Response from API OpenAI: {response}")
-            logging.info(
-                f"Costs (second call): {response.usage.prompt_tokens}+{response.usage.completion_tokens}={response.usage.total_tokens}")
+            logging.debug("Response from API OpenAI: %s", response)
             return response.choices[0].message.content
 
-    async def chat_with_gpt(self, message):
+    async def stream_gpt_35_turbo_0125(self, message, sender):
+        prompt = await get_messages_with_chat_history(message, self.model_ai)
+        parts = []
+        try:
+            async with sender.channel.typing():
+                async for text in stream_chat_completion(
+                        guild_id=message.guild.id, messages=prompt, model=self.model_ai, max_tokens=self.max_tokens):
+                    parts.append(text)
+                    sender.feed(text)
+        finally:
+            # The sender keeps pacing the queued sentences after the model call returns
+            sender.finish()
+        return ''.join(parts)
+
+    async def chat_with_gpt(self, message, sender=None, priority=DIRECT):
         # Send a message to the openAPI model and get a response back
-        user_id_to_check = message.author.id
         guild_id = message.guild.id
         try:
             max_openai_length = 250
             if len(message.content.strip()) > max_openai_length:
+                logging.info("Message was too long. Skipping API call.")
                 return None
-            elif not can_user_send_message(user_id_to_check):
-                logging.warning("Too many messages per second. Slow mode on.")
+            limited_scope = rate_limits.check(message.author.id, message.channel.id, guild_id)
+            if limited_scope is not None:
+                metrics.inc('warchlak_rejections_total', reason=f'rate_limit_{limited_scope}', guild=guild_id)
+                logging.warning("Too many messages per %s. Slow mode on.", limited_scope,
+                                extra={'guild_id': guild_id, 'user_id': message.author.id})
                 return "Dobra dobra, wolniej pisz bo nie łapie. "
-            elif not can_guild_send_message(guild_id):
+
+            cache_key = make_key('chat', self.model_ai, get_ai_behaviour(message),
+                                 normalize_prompt(remove_bot_mention(message.content)))
+            cached_response = response_cache.get(cache_key)
+            if cached_response is not None and response_cache.skip_quota:
+                return cached_response
+            # Every model of the chain is failing: answer busy right away, without using the quota
+            if cached_response is None and not model_guard.is_available(model_guard.chain(self.model_ai)):
+                metrics.inc('warchlak_rejections_total', reason='circuit_open', guild=guild_id)
+                logging.warning("Circuit open for every model of %s, skipping API call.", self.model_ai,
+                                extra={'throttle': True})
+                return None
+            if not can_guild_send_message(guild_id):
                 logging.warning("Maximum number of messages per guild was reached.")
                 return "<Ziewa> Aaaa, hmm... Czas na małą drzemke aby akumulatory podładować. Będę niebawem."
+            if cached_response is not None:
+                return cached_response
 
-            response_from_ai = None
             message_to_ai = message
-            logging.info(f"Message to AI: {message_to_ai}")
-            # Call one of OpenAI API engines
-            if GPT_35_TURBO_INSTRUCT in self.model_ai:
-                response_from_ai = self.gpt_35_turbo_instruct(message_to_ai)
-            elif GPT_35_TURBO_ in self.model_ai:
-                response_from_ai = await self.gpt_35_turbo_0125(message_to_ai, False)
+            logging.info("Message to AI from %s in channel %s: %s", message.author.id, message.channel.id, message.content,
+                         extra={'guild_id': guild_id, 'channel_id': message.channel.id, 'user_id': message.author.id})
+
+            async def call_model():
+                # Call one of OpenAI API engines
+                if GPT_35_TURBO_INSTRUCT in self.model_ai:
+                    return await self.gpt_35_turbo_instruct(message_to_ai)
+                elif GPT_35_TURBO_ in self.model_ai and self.streaming and sender is not None and not self.tools_enabled:
+                    # Sentences go out through the sender while the model is still generating
+                    return await self.stream_gpt_35_turbo_0125(message_to_ai, sender)
+                elif GPT_35_TURBO_ in self.model_ai:
+                    return await self.gpt_35_turbo_0125(message_to_ai, self.tools_enabled)
+                return None
+
+            response_from_ai = await request_scheduler.submit(
+                priority, guild_id, call_model, get_token_budget(self.model_ai) + self.max_tokens)
 
+            response_cache.put(cache_key, response_from_ai)
             return response_from_ai
+        except ModelUnavailable as e:
+            logging.warning("No model answered in time: %s", e, extra={'throttle': True})
+        except Overloaded as e:
+            logging.warning("Model request rejected: %s", e, extra={'throttle': True})
         except Exception as e:
-            logging.error(f"Error during calling OpenAI API. e: {e.with_traceback(e.__traceback__)}")
+            logging.error("Error during calling OpenAI API. e: %s", e, exc_info=e)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import functools
+import logging
+import re
+
+from services.settings import get_settings, on_reload
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Chat format overhead, see the OpenAI cookbook on counting tokens
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_FOR_REPLY = 3
+MIN_TRUNCATED_TOKENS = 16
+
+
+def sanitize_name(name):
+    sanitized_name = re.sub(r'[^a-zA-Z0-9_-]', '_', name)
+    return sanitized_name
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        logging.warning(f"Tokenizer for {model} not available, using estimates: {e}")
+        return None
+
+
+def count_tokens(text, model):
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Rough estimate when tiktoken is missing: ~3 characters per token for Polish text
+        return len(text) // 3 + 1
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text, max_tokens, model):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 3] + '…'
+    return encoding.decode(encoding.encode(text)[:max_tokens]) + '…'
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_budget(model):
+    # open_ai_prompt_token_budgets="gpt-3.5-turbo-0125:3000,gpt-4o-mini:4000"
+    settings = get_settings()
+    for entry in settings.open_ai_prompt_token_budgets.split(','):
+        name, _, budget = entry.strip().partition(':')
+        if name == model and budget:
+            return int(budget)
+    return settings.open_ai_prompt_token_budget
+
+
+on_reload(lambda settings: get_token_budget.cache_clear())
+
+
+def cached_message_tokens(cached, model):
+    # Memoized on the history record itself, edits reset it
+    if cached.token_count is None:
+        cached.token_count = TOKENS_PER_MESSAGE + TOKENS_PER_NAME + count_tokens(cached.content, model)
+    return cached.token_count
+
+
+def history_entry(cached, content=None):
+    return {
+        "role": "assistant" if cached.is_bot else "user",
+        "content": cached.content if content is None else content,
+        "name": sanitize_name(cached.author_name)
+    }
+
+
+def build_prompt(system_prompt, history, user_turn, model, summary=None):
+    """Fits system prompt + summary + history + user turn into the model's token budget.
+
+    history holds CachedMessage records, oldest first. The oldest turns are dropped
+    first; the oldest turn that still partly fits is truncated.
+    """
+    budget = get_token_budget(model)
+    remaining = budget - TOKENS_FOR_REPLY
+    remaining -= TOKENS_PER_MESSAGE + count_tokens(system_prompt, model)
+    if summary is not None:
+        remaining -= TOKENS_PER_MESSAGE + count_tokens(summary["content"], model)
+    remaining -= TOKENS_PER_MESSAGE + TOKENS_PER_NAME + count_tokens(user_turn["content"], model)
+
+    kept = []
+    for cached in reversed(history):
+        tokens = cached_message_tokens(cached, model)
+        if tokens <= remaining:
+            kept.append(history_entry(cached))
+            remaining -= tokens
+            continue
+        content_tokens = remaining - TOKENS_PER_MESSAGE - TOKENS_PER_NAME
+        if content_tokens >= MIN_TRUNCATED_TOKENS:
+            kept.append(history_entry(cached, truncate_to_tokens(cached.content, content_tokens, model)))
+        break
+    if len(kept) < len(history):
+        logging.info(f"Prompt budget {budget} tokens: kept {len(kept)} of {len(history)} history messages.")
+    kept.reverse()
+    if summary is not None:
+        kept.insert(0, summary)
+    return [{"role": "system", "content": system_prompt}, *kept, user_turn]
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from collections import OrderedDict
+
+from services.settings import get_settings, on_reload
+from services.shared_state import SharedRateLimiter, uses_shared_state
+
+TOKEN_BUCKET = 'token_bucket'
+SLIDING_WINDOW = 'sliding_window'
+
+
+def parse_rate(value):
+    """Parses 'limit/seconds' (e.g. '5/60'), returns None when the limit is disabled."""
+    if not value or not value.strip():
+        return None
+    limit, _, seconds = value.partition('/')
+    limit, seconds = int(limit), float(seconds or 1)
+    if limit <= 0 or seconds <= 0:
+        return None
+    return limit, seconds
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated = now
+
+    def peek(self, limiter, now):
+        return min(limiter.burst, self.tokens + (now - self.updated) * limiter.refill_rate) >= 1
+
+    def allow(self, limiter, now):
+        self.tokens = min(limiter.burst, self.tokens + (now - self.updated) * limiter.refill_rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class SlidingWindow:
+    """Sliding window counter: the previous window is weighted by how much of it still overlaps."""
+    __slots__ = ('window_start', 'previous', 'current', 'updated')
+
+    def __init__(self, capacity, now):
+        self.window_start = now
+        self.previous = 0
+        self.current = 0
+        self.updated = now
+
+    def peek(self, limiter, now):
+        elapsed = now - self.window_start
+        previous, current = self.previous, self.current
+        if elapsed >= limiter.period:
+            previous = current if elapsed < 2 * limiter.period else 0
+            current = 0
+            elapsed %= limiter.period
+        return previous * (1 - elapsed / limiter.period) + current < limiter.limit
+
+    def allow(self, limiter, now):
+        elapsed = now - self.window_start
+        if elapsed >= limiter.period:
+            self.previous = self.current if elapsed < 2 * limiter.period else 0
+            self.current = 0
+            self.window_start = now - elapsed % limiter.period
+            elapsed = now - self.window_start
+        self.updated = now
+        estimated = self.previous * (1 - elapsed / limiter.period) + self.current
+        if estimated < limiter.limit:
+            self.current += 1
+            return True
+        return False
+
+
+class RateLimiter:
+    """Per-key limiter with constant memory per key.
+
+    Keys are kept in least-recently-used order; the least recently used keys are
+    dropped when max_keys is exceeded or when they have been idle for idle_ttl.
+    """
+
+    def __init__(self, limit, period, algorithm=TOKEN_BUCKET, burst=None, max_keys=100000, idle_ttl=3600):
+        self.limit = limit
+        self.period = period
+        self.burst = burst or limit
+        self.refill_rate = limit / period
+        self.max_keys = max_keys
+        self.idle_ttl = max(idle_ttl, period)
+        self.entry_class = SlidingWindow if algorithm == SLIDING_WINDOW else TokenBucket
+        self.entries = OrderedDict()
+
+    def allow(self, key, now=None):
+        if now is None:
+            now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entry_class(self.burst, now)
+            self.entries[key] = entry
+            self._evict(now)
+        else:
+            self.entries.move_to_end(key)
+        return entry.allow(self, now)
+
+    def peek(self, key, now=None):
+        """Whether allow(key) would pass, without counting the message."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return True
+        return entry.peek(self, time.monotonic() if now is None else now)
+
+    def _evict(self, now):
+        entries = self.entries
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+        expired_before = now - self.idle_ttl
+        # Oldest entries first, so only the idle head of the dict is ever visited
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry.updated >= expired_before:
+                break
+            del entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ScopedRateLimits:
+    """Per user, per channel and per guild limiters configured from the settings."""
+
+    def __init__(self):
+        self.scopes = None
+        self.config = None
+
+    def load(self, settings=None):
+        settings = settings or get_settings()
+        # Historical setting: minimum number of seconds between two messages of one user
+        user_rate = settings.rate_limit_user or f"1/{settings.user_message_delay}"
+        rates = {
+            'user': parse_rate(user_rate),
+            'channel': parse_rate(settings.rate_limit_channel),
+            'guild': parse_rate(settings.rate_limit_guild),
+        }
+        config = (rates, settings.rate_limit_algorithm, settings.rate_limit_max_keys, settings.rate_limit_idle_ttl,
+                  uses_shared_state(settings))
+        if config == self.config:
+            # Unchanged configuration keeps the current limiter state
+            return
+        self.config = config
+        self.scopes = {
+            scope: RateLimiter(rate[0], rate[1], settings.rate_limit_algorithm,
+                               max_keys=settings.rate_limit_max_keys, idle_ttl=settings.rate_limit_idle_ttl)
+            for scope, rate in rates.items() if rate is not None
+        }
+        if uses_shared_state(settings) and rates['user'] is not None:
+            # A user can write in guilds of other shard or worker processes, channels and guilds stay in one
+            self.scopes['user'] = SharedRateLimiter('user', *rates['user'])
+        logging.info(f"Rate limits loaded ({settings.rate_limit_algorithm}): {rates}")
+
+    def check(self, user_id, channel_id, guild_id):
+        """Returns the name of the scope that rejected the message, or None when it is allowed."""
+        if self.scopes is None:
+            self.load()
+        keys = {'user': user_id, 'channel': channel_id, 'guild': guild_id}
+        # A message rejected by one scope is not counted by the others
+        for scope, limiter in self.scopes.items():
+            if not limiter.peek(keys[scope]):
+                return scope
+        for scope, limiter in self.scopes.items():
+            if not limiter.allow(keys[scope]):
+                return scope
+        return None
+
+
+rate_limits = ScopedRateLimits()
+on_reload(rate_limits.load)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from services.metrics import metrics
+from services.settings import get_settings
+from services.shared_state import SharedBudget, uses_shared_state
+
+# Priority classes, lower value is served first
+DIRECT = 0
+MENTION = 1
+IMAGE = 2
+SMALL_TALK = 3
+PRIORITY_NAMES = {DIRECT: 'direct', MENTION: 'mention', IMAGE: 'image', SMALL_TALK: 'small_talk'}
+
+
+class Overloaded(Exception):
+    """Raised for requests shed because the queue is too deep."""
+
+
+class Budget:
+    """Per-minute budget refilled continuously; a limit of 0 disables it."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def delay(self, amount):
+        if not self.capacity:
+            return 0.0
+        self._refill(time.monotonic())
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing * 60 / self.capacity)
+
+    def consume(self, amount):
+        if self.capacity:
+            self._refill(time.monotonic())
+            self.available -= min(amount, self.capacity)
+
+
+class Job:
+    __slots__ = ('priority', 'guild_id', 'call', 'tokens', 'enqueued_at', 'future')
+
+    def __init__(self, priority, guild_id, call, tokens):
+        self.priority = priority
+        self.guild_id = guild_id
+        self.call = call
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class WaitStats:
+    __slots__ = ('count', 'total', 'max', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=100)
+
+    def add(self, wait):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+        self.recent.append(wait)
+
+
+class ModelRequestScheduler:
+    """Orders model requests by priority class, round-robin across guilds within a class.
+
+    Requests are dispatched within the requests-per-minute and tokens-per-minute
+    budgets. Random small talk is shed first when the queue gets deep; past
+    scheduler_max_depth every new request is rejected with Overloaded.
+    """
+
+    def __init__(self):
+        self.queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self.depth = 0
+        self.shed = 0
+        self.wait_stats = {priority: WaitStats() for priority in PRIORITY_NAMES}
+        self.dispatcher = None
+        self.running = set()
+        self.job_ready = None
+        self.slots = None
+        self.requests_budget = None
+        self.tokens_budget = None
+
+    def start(self):
+        if self.dispatcher is not None:
+            return
+        settings = get_settings()
+        self.job_ready = asyncio.Event()
+        self.slots = asyncio.Semaphore(settings.scheduler_max_concurrency)
+        if uses_shared_state(settings):
+            # The OpenAI account limits are shared by every shard or worker process
+            self.requests_budget = SharedBudget('requests', settings.scheduler_requests_per_minute)
+            self.tokens_budget = SharedBudget('tokens', settings.scheduler_tokens_per_minute)
+        else:
+            self.requests_budget = Budget(settings.scheduler_requests_per_minute)
+            self.tokens_budget = Budget(settings.scheduler_tokens_per_minute)
+        self.dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def close(self):
+        if self.dispatcher is None:
+            return
+        self.dispatcher.cancel()
+        self.dispatcher = None
+        for queue in self.queues.values():
+            for jobs in queue.values():
+                for job in jobs:
+                    job.future.cancel()
+            queue.clear()
+        self.depth = 0
+
+    def queue_depth(self):
+        return {PRIORITY_NAMES[priority]: sum(len(jobs) for jobs in queue.values())
+                for priority, queue in self.queues.items()}
+
+    def stats(self):
+        return {
+            'depth': self.queue_depth(),
+            'shed': self.shed,
+            'wait': {
+                PRIORITY_NAMES[priority]: {
+                    'count': stats.count,
+                    'avg': stats.total / stats.count if stats.count else 0.0,
+                    'max': stats.max,
+                    'recent_max': max(stats.recent, default=0.0),
+                }
+                for priority, stats in self.wait_stats.items()
+            },
+        }
+
+    def _drop_small_talk(self):
+        queue = self.queues[SMALL_TALK]
+        if not queue:
+            return False
+        guild_id, jobs = next(reversed(queue.items()))
+        job = jobs.pop()
+        if not jobs:
+            del queue[guild_id]
+        self.depth -= 1
+        self.shed += 1
+        metrics.inc('warchlak_rejections_total', reason='shed')
+        job.future.set_exception(Overloaded("Small talk dropped, queue too deep."))
+        return True
+
+    async def submit(self, priority, guild_id, call, tokens=0):
+        """Queues call (a coroutine function) and returns its result once it has run."""
+        self.start()
+        settings = get_settings()
+        if priority == SMALL_TALK and self.depth >= settings.scheduler_shed_depth:
+            self.shed += 1
+            metrics.inc('warchlak_rejections_total', reason='shed')
+            raise Overloaded("Small talk rejected, queue too deep.")
+        if self.depth >= settings.scheduler_max_depth and not self._drop_small_talk():
+            self.shed += 1
+            metrics.inc('warchlak_rejections_total', reason='queue_full')
+            logging.warning("Model request queue is %s deep, request rejected.", self.depth, extra={'throttle': True})
+            raise Overloaded("Queue full.")
+        job = Job(priority, guild_id, call, tokens)
+        self.queues[priority].setdefault(guild_id, deque()).append(job)
+        self.depth += 1
+        self.job_ready.set()
+        return await job.future
+
+    def _next_job(self):
+        for queue in self.queues.values():
+            if not queue:
+                continue
+            guild_id, jobs = next(iter(queue.items()))
+            job = jobs.popleft()
+            # Round robin: the guild goes to the back of its priority class
+            if jobs:
+                queue.move_to_end(guild_id)
+            else:
+                del queue[guild_id]
+            self.depth -= 1
+            return job
+        return None
+
+    async def _run(self, job):
+        try:
+            result = await job.call()
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    async def _dispatch_loop(self):
+        while True:
+            await self.slots.acquire()
+            while not self.depth:
+                self.job_ready.clear()
+                await self.job_ready.wait()
+            # Wait for the request budget before picking, so a job arriving meanwhile can still jump ahead
+            delay = self.requests_budget.delay(1)
+            if delay:
+                await asyncio.sleep(delay)
+            job = self._next_job()
+            if job is None or job.future.done():
+                self.slots.release()
+                continue
+            delay = self.tokens_budget.delay(job.tokens)
+            if delay:
+                await asyncio.sleep(delay)
+            self.requests_budget.consume(1)
+            self.tokens_budget.consume(job.tokens)
+            wait = time.monotonic() - job.enqueued_at
+            self.wait_stats[job.priority].add(wait)
+            metrics.observe('warchlak_model_queue_wait_seconds', wait, priority=PRIORITY_NAMES[job.priority])
+            task = asyncio.create_task(self._run(job))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+
+request_scheduler = ModelRequestScheduler()
+metrics.gauge('warchlak_model_queue_depth', lambda: request_scheduler.depth)
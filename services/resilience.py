@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from collections import deque
+
+import httpx
+import openai
+
+from services.metrics import metrics
+from services.settings import get_settings
+
+# Latencies needed before the p95 is trusted for hedging
+HEDGE_MIN_SAMPLES = 20
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ModelUnavailable(Exception):
+    """Raised when no model of the chain answered within the deadline or all their circuits are open."""
+
+
+def is_model_failure(error):
+    """Errors that say the model API is unhealthy; a bad request is the caller's problem."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    return isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError, httpx.HTTPError))
+
+
+class CircuitBreaker:
+    """Error rate over a sliding window of recent calls of one model.
+
+    Opens when at least circuit_breaker_min_requests calls in the window failed
+    at circuit_breaker_error_rate or more; calls are then refused without
+    waiting for the API. After circuit_breaker_open_seconds one probe call is
+    let through, its result closes the circuit or opens it again.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.state = CLOSED
+        # (time, failed) of the calls in the window
+        self.calls = deque()
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def _trim(self, now, window):
+        while self.calls and self.calls[0][0] < now - window:
+            self.failures -= self.calls.popleft()[1]
+
+    def allow(self, now=None):
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN and now - self.opened_at >= get_settings().circuit_breaker_open_seconds:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, failed, now=None):
+        settings = get_settings()
+        now = time.monotonic() if now is None else now
+        if self.state == HALF_OPEN:
+            self.probing = False
+            if failed:
+                self._open(now)
+            else:
+                self.state = CLOSED
+                self.calls.clear()
+                self.failures = 0
+                logging.info(f"Circuit of {self.model} closed again.")
+            return
+        self.calls.append((now, failed))
+        self.failures += failed
+        self._trim(now, settings.circuit_breaker_window)
+        if (self.state == CLOSED and len(self.calls) >= settings.circuit_breaker_min_requests
+                and self.failures >= settings.circuit_breaker_error_rate * len(self.calls)):
+            self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        metrics.inc('warchlak_circuit_open_total', model=self.model)
+        logging.warning(f"Circuit of {self.model} opened: {self.failures} of {len(self.calls)} recent calls failed.")
+
+
+class LatencyTracker:
+    __slots__ = ('recent',)
+
+    def __init__(self):
+        self.recent = deque(maxlen=200)
+
+    def add(self, seconds):
+        self.recent.append(seconds)
+
+    def p95(self):
+        if len(self.recent) < HEDGE_MIN_SAMPLES:
+            return None
+        return sorted(self.recent)[int(len(self.recent) * 0.95)]
+
+
+class ModelGuard:
+    """Deadline, hedging, fallback chain and circuit breakers around the model calls."""
+
+    def __init__(self):
+        self.breakers = {}
+        self.latencies = {}
+
+    def breaker(self, model):
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = CircuitBreaker(model)
+        return breaker
+
+    def chain(self, model):
+        fallback_models = [name for name in get_settings().open_ai_fallback_models.replace(',', ' ').split()
+                           if name != model]
+        return (model, *fallback_models)
+
+    def is_available(self, models):
+        # Read-only check, does not take the half-open probe; a probe in flight sheds every other call
+        now = time.monotonic()
+        open_seconds = get_settings().circuit_breaker_open_seconds
+        for breaker in map(self.breaker, models):
+            if breaker.state == CLOSED or (breaker.state == HALF_OPEN and not breaker.probing):
+                return True
+            if breaker.state == OPEN and now - breaker.opened_at >= open_seconds:
+                return True
+        return False
+
+    def hedge_delay(self, model):
+        settings = get_settings()
+        if not settings.open_ai_hedge_enabled:
+            return None
+        tracker = self.latencies.get(model)
+        p95 = tracker.p95() if tracker is not None else None
+        return None if p95 is None else max(p95, settings.open_ai_hedge_min_delay)
+
+    async def _hedged(self, call, model):
+        """Runs call(model), plus a duplicate once the first one is slower than the recent p95."""
+        delay = self.hedge_delay(model)
+        first = asyncio.ensure_future(call(model))
+        second = None
+        # Cancelled by the attempt timeout too, the requests must not keep their semaphore slots
+        try:
+            if delay is None:
+                return await first
+            done, _ = await asyncio.wait((first,), timeout=delay)
+            if done:
+                return first.result()
+            metrics.inc('warchlak_hedged_requests_total', model=model)
+            second = asyncio.ensure_future(call(model))
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Both failed, the first one's error decides
+            return first.result()
+        finally:
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def call(self, models, call):
+        """Calls call(model) for the models in order until one answers, all within open_ai_deadline."""
+        settings = get_settings()
+        deadline = time.monotonic() + settings.open_ai_deadline if settings.open_ai_deadline else None
+        last_error = None
+        for model in models:
+            breaker = self.breaker(model)
+            if not breaker.allow():
+                metrics.inc('warchlak_model_attempts_total', model=model, result='shed')
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                breaker.probing = False
+                break
+            # A stalled model must leave time for the next one in the chain
+            timeout = min((value for value in (remaining, settings.open_ai_attempt_timeout) if value), default=None)
+            started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(self._hedged(call, model), timeout)
+            except Exception as e:
+                failed = is_model_failure(e)
+                breaker.record(failed)
+                if not failed:
+                    raise
+                metrics.inc('warchlak_model_attempts_total', model=model,
+                            result='timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
+                logging.warning("Model %s failed after %.1fs: %r", model, time.monotonic() - started, e,
+                                extra={'throttle': True})
+                last_error = e
+                continue
+            except asyncio.CancelledError:
+                breaker.probing = False
+                raise
+            breaker.record(False)
+            self.latencies.setdefault(model, LatencyTracker()).add(time.monotonic() - started)
+            metrics.inc('warchlak_model_attempts_total', model=model, result='ok')
+            if model != models[0]:
+                logging.info("Answered by fallback model %s.", model, extra={'throttle': True})
+            return response
+        raise ModelUnavailable(f"No answer from {', '.join(models)}") from last_error
+
+
+model_guard = ModelGuard()
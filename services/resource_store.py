@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+import random
+
+from services.settings import get_settings, on_reload
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Keys of a response set file holding the default responses
+RESPONSE_KEYS = ('responses', 'reactions')
+BUSY_RESPONSES = (
+    "Aaaa, co tam się dzieje? Czekaj, bo mam teraz pełne ręce roboty z tymi 'Sztauwajerami'. Zaraz wracam, obiecuję!",
+    "Ho ho ho, nie ma czasu na wygłupy! 💼 Chwila, bo muszę sprawdzić, gdzie się zapodziała moja kawa. Wracam zaraz!",
+    "Co? Znowu coś chcesz? To się dobrze zastanów, bo teraz to mam pełno roboty! Będę za chwilę!",
+    "Ugh, no nie! 😤 Już mi się tu rypie! Daj mi chwilę, bo na pewno znajdę chwilę na przerwę od tego chaosu.",
+    "Jeszcze jedna prośba, a od razu wyskoczę na Spodek! 😏 Zajmę się tym, ale to za chwilę, bo mam teraz coś do ogarnięcia."
+)
+# Used when resources/ has no valid file of that name
+BUILTIN_RESPONSES = {
+    'busy_responses': BUSY_RESPONSES,
+}
+# JSON files validated as response sets, see parse_response_set
+RESPONSE_SETS = ('responses_to_image', 'busy_responses')
+
+
+def guild_language(guild):
+    # discord.Locale, e.g. 'pl' or 'en-US'; the fakes of the benchmarks have none
+    locale = getattr(guild, 'preferred_locale', None)
+    return str(locale).split('-')[0].lower() if locale else None
+
+
+def string_list(value, where):
+    if not isinstance(value, list) or not value or not all(isinstance(item, str) and item for item in value):
+        raise ValueError(f"{where}: must be a non-empty list of strings")
+    return tuple(value)
+
+
+def parse_response_set(name, data):
+    """Validates a response set file and returns its {(guild_id, language): responses} entries.
+
+    {"responses": [...], "languages": {"en": [...]}, "guilds": {"<guild id>": [...]}},
+    "reactions" is accepted instead of "responses" (responses_to_image.json).
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"{name}: must be a JSON object")
+    unknown = set(data) - {*RESPONSE_KEYS, 'languages', 'guilds'}
+    if unknown:
+        raise ValueError(f"{name}: unknown keys {sorted(unknown)}")
+    entries = {}
+    for key in RESPONSE_KEYS:
+        if key in data:
+            entries[None, None] = string_list(data[key], f"{name}.{key}")
+    for language, responses in data.get('languages', {}).items():
+        entries[None, language.lower()] = string_list(responses, f"{name}.languages.{language}")
+    for guild_id, responses in data.get('guilds', {}).items():
+        if not guild_id.isdigit():
+            raise ValueError(f"{name}.guilds: {guild_id!r} is not a guild id")
+        entries[int(guild_id), None] = string_list(responses, f"{name}.guilds.{guild_id}")
+    if not entries:
+        raise ValueError(f"{name}: no responses")
+    return entries
+
+
+class ResourceStore:
+    """Every file of resources/, read and validated once and served from memory.
+
+    The files named in RESPONSE_SETS are response sets (see parse_response_set),
+    other JSON files are served as parsed and other files as lists of lines.
+    A reload builds a complete new index and swaps it in one assignment; a
+    broken or half-written file keeps its last good version, and lookups on the
+    message path never touch the disk.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.files = {}
+        # (set name, guild id or None, language or None) -> tuple of responses
+        self.responses = {}
+        self.signature = None
+
+    def resolve_path(self, settings):
+        return os.path.join(PROJECT_DIRECTORY, settings.resources_path)
+
+    def scan(self):
+        try:
+            with os.scandir(self.path) as entries:
+                stats = [(entry.name, entry.stat()) for entry in entries if entry.is_file()]
+        except FileNotFoundError:
+            return ()
+        return tuple(sorted((name, stat.st_mtime_ns, stat.st_size) for name, stat in stats))
+
+    def read_file(self, file_name):
+        """Returns (content, response set entries) of one file; raises on an unreadable or invalid file."""
+        name, extension = os.path.splitext(file_name)
+        with open(os.path.join(self.path, file_name), 'r', encoding='utf-8') as file:
+            if extension != '.json':
+                return file.read().splitlines(), {}
+            content = json.load(file)
+        # Other JSON files are served as parsed
+        if name not in RESPONSE_SETS:
+            return content, {}
+        return content, {(name, guild_id, language): values
+                         for (guild_id, language), values in parse_response_set(name, content).items()}
+
+    def read(self, signature):
+        files, responses, errors = {}, {}, []
+        for file_name, _, _ in signature:
+            try:
+                files[file_name], entries = self.read_file(file_name)
+                responses.update(entries)
+            except (OSError, UnicodeDecodeError, ValueError) as e:
+                errors.append(f"{file_name}: {e}")
+                # A broken file keeps its last good version, the other files load
+                if file_name in self.files:
+                    files[file_name] = self.files[file_name]
+                    name = os.path.splitext(file_name)[0]
+                    responses.update((key, values) for key, values in self.responses.items() if key[0] == name)
+        return files, responses, errors
+
+    def load(self, settings=None):
+        """Reads the resources directory; returns False when a file was invalid and kept its previous version."""
+        settings = settings or get_settings()
+        self.path = self.resolve_path(settings)
+        signature = self.scan()
+        files, responses, errors = self.read(signature)
+        for name, values in BUILTIN_RESPONSES.items():
+            responses.setdefault((name, None, None), values)
+        self.signature = signature
+        self.files, self.responses = files, responses
+        if errors:
+            logging.error(f"Invalid resources in {self.path}, kept their previous versions: {'; '.join(errors)}")
+        logging.info(f"Loaded {len(files)} resource files from {self.path}.")
+        return not errors
+
+    def reload_if_moved(self, settings):
+        if self.path is not None and self.resolve_path(settings) != self.path:
+            self.load(settings)
+
+    def get(self, file_name):
+        if self.signature is None:
+            self.load()
+        return self.files.get(file_name)
+
+    def get_responses(self, name, guild_id=None, language=None):
+        """Responses of a set for a guild: its own, then its language's, then the defaults."""
+        if self.signature is None:
+            self.load()
+        responses = self.responses
+        return (responses.get((name, guild_id, None)) or responses.get((name, None, language))
+                or responses.get((name, None, None), ()))
+
+    def choice(self, name, guild=None):
+        if guild is None:
+            responses = self.get_responses(name)
+        else:
+            responses = self.get_responses(name, guild.id, guild_language(guild))
+        return random.choice(responses) if responses else None
+
+    async def watch(self):
+        """Reloads the resources whenever a file is added, removed or changed."""
+        if self.signature is None:
+            self.load()
+        while True:
+            await asyncio.sleep(get_settings().settings_watch_interval or 5.0)
+            if self.scan() != self.signature:
+                self.load()
+
+
+resource_store = ResourceStore()
+on_reload(resource_store.reload_if_moved)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+from services.metrics import metrics
+from services.settings import get_settings, on_reload
+
+
+def normalize_prompt(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def make_key(*parts):
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """TTL + size-bounded LRU cache of model responses, optionally persisted to a JSON file."""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.enabled = None
+        self.ttl = 3600.0
+        self.max_entries = 1000
+        self.path = None
+        self.skip_quota = False
+
+    def load(self, settings=None):
+        settings = settings or get_settings()
+        self.enabled = settings.response_cache_enabled
+        self.ttl = settings.response_cache_ttl
+        self.max_entries = settings.response_cache_max_entries
+        self.path = settings.response_cache_path or None
+        # Cache hits do not use the guild's daily quota when enabled
+        self.skip_quota = settings.response_cache_skip_quota
+
+    def get(self, key):
+        if self.enabled is None:
+            self.load()
+        if not self.enabled:
+            return None
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            metrics.inc('warchlak_response_cache_total', result='miss')
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        metrics.inc('warchlak_response_cache_total', result='hit')
+        return entry[1]
+
+    def put(self, key, value):
+        if self.enabled is None:
+            self.load()
+        if not self.enabled or not value:
+            return
+        self.entries[key] = (time.time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries),
+                "hit_ratio": self.hits / total if total else 0.0}
+
+    def load_from_disk(self):
+        self.load()
+        if not self.enabled or not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Error while loading response cache {self.path}: {e}")
+            return
+        now = time.time()
+        for key, (expires_at, value) in stored.items():
+            if expires_at > now:
+                self.entries[key] = (expires_at, value)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        logging.info(f"Response cache loaded {len(self.entries)} entries from {self.path}.")
+
+    def save_to_disk(self):
+        if not self.enabled or not self.path:
+            return
+        logging.info(f"Response cache stats: {self.stats()}")
+        temporary_path = f"{self.path}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump(dict(self.entries), file, ensure_ascii=False)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            logging.error(f"Error while saving response cache {self.path}: {e}")
+
+
+response_cache = ResponseCache()
+on_reload(response_cache.load)
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import re
+import signal
+
+from dotenv import load_dotenv
+
+ENV_FILE = '.env'
+TRUE_VALUES = ('true', '1', 't', 'yes')
+
+
+def env(name, default, key=None):
+    # Field whose value comes from the environment variable `key` (defaults to the field name)
+    return dataclasses.field(default=default, metadata={'env': key or name})
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """Typed bot configuration, parsed once from the environment and swapped atomically on reload."""
+
+    log_level: str = env('log_level', 'INFO')
+    # High-volume lines (e.g. the random reaction decision), 'limit/seconds' per call site
+    log_throttle: str = env('log_throttle', '5/60')
+    target_user_id: int = env('target_user_id', 0)
+    talking_channel_ids: frozenset = env('talking_channel_ids', frozenset(), 'channel_id_for_talking')
+
+    enabled_ai: bool = env('enabled_ai', False)
+    enabled_image_ai_analyze: bool = env('enabled_image_ai_analyze', False)
+    open_ai_model: str = env('open_ai_model', 'gpt-3.5-turbo-0125')
+    open_ai_top_p: float = env('open_ai_top_p', 1.0)
+    open_ai_max_tokens: int = env('open_ai_max_tokens', 1000)
+    open_ai_temperature: float = env('open_ai_temperature', 0.0)
+    open_ai_streaming_enabled: bool = env('open_ai_streaming_enabled', False)
+    # Lets the model call get_user_activity, replies are not streamed then
+    open_ai_tools_enabled: bool = env('open_ai_tools_enabled', False)
+    ai_behavior: str = env('ai_behavior', '')
+    max_messages_per_guild_per_day: int = env('max_messages_per_guild_per_day', 1000,
+                                              'open_ai_max_number_of_messages_per_guild_per_day')
+
+    message_history_enabled: bool = env('message_history_enabled', False)
+    message_history_limit: int = env('message_history_limit', 5)
+    message_cache_per_channel: int = env('message_cache_per_channel', 50)
+    message_cache_max_messages: int = env('message_cache_max_messages', 20000)
+    open_ai_prompt_token_budget: int = env('open_ai_prompt_token_budget', 1500)
+    open_ai_prompt_token_budgets: str = env('open_ai_prompt_token_budgets', '')
+
+    response_first_sentence_delay: float = env('response_first_sentence_delay', 0.0)
+    response_sentence_delay: float = env('response_sentence_delay', 2.0)
+
+    # Seconds between two messages of one user, used when rate_limit_user is empty
+    user_message_delay: float = env('user_message_delay', 2.0, 'open_ai_number_of_msg_per_sec_user')
+    rate_limit_algorithm: str = env('rate_limit_algorithm', 'token_bucket')
+    rate_limit_user: str = env('rate_limit_user', '')
+    rate_limit_channel: str = env('rate_limit_channel', '')
+    rate_limit_guild: str = env('rate_limit_guild', '')
+    rate_limit_max_keys: int = env('rate_limit_max_keys', 100000)
+    rate_limit_idle_ttl: float = env('rate_limit_idle_ttl', 3600.0)
+
+    # 0 disables the per-minute budgets
+    scheduler_requests_per_minute: int = env('scheduler_requests_per_minute', 0)
+    scheduler_tokens_per_minute: int = env('scheduler_tokens_per_minute', 0)
+    scheduler_max_concurrency: int = env('scheduler_max_concurrency', 8)
+    scheduler_shed_depth: int = env('scheduler_shed_depth', 20)
+    scheduler_max_depth: int = env('scheduler_max_depth', 100)
+
+    response_cache_enabled: bool = env('response_cache_enabled', False)
+    response_cache_ttl: float = env('response_cache_ttl', 3600.0)
+    response_cache_max_entries: int = env('response_cache_max_entries', 1000)
+    response_cache_path: str = env('response_cache_path', '')
+    response_cache_skip_quota: bool = env('response_cache_skip_quota', False)
+
+    metrics_enabled: bool = env('metrics_enabled', False)
+
+    # Random replies: chance per message, minimum local score and seconds between two replies in a channel
+    small_talk_chance: float = env('small_talk_chance', 0.085)
+    small_talk_min_score: float = env('small_talk_min_score', 0.4)
+    small_talk_cooldown: float = env('small_talk_cooldown', 300.0)
+    # Per guild overrides as JSON: {"<guild id>": {"chance": 0.2, "min_score": 0.5, "cooldown": 600}}
+    small_talk_guilds: str = env('small_talk_guilds', '')
+
+    activity_enabled: bool = env('activity_enabled', True)
+    activity_bucket_seconds: int = env('activity_bucket_seconds', 3600)
+    activity_buckets: int = env('activity_buckets', 168)
+    activity_channels_per_user: int = env('activity_channels_per_user', 5)
+    activity_max_users: int = env('activity_max_users', 100000)
+
+    # Rolling per-channel summaries instead of the raw message_history_limit messages
+    memory_enabled: bool = env('memory_enabled', False)
+    memory_recent_turns: int = env('memory_recent_turns', 4)
+    memory_summary_batch: int = env('memory_summary_batch', 4)
+    memory_summary_max_chars: int = env('memory_summary_max_chars', 800)
+    memory_summary_max_tokens: int = env('memory_summary_max_tokens', 250)
+    memory_max_channels: int = env('memory_max_channels', 1000)
+    memory_model: str = env('memory_model', '')
+    memory_path: str = env('memory_path', '')
+
+    image_max_bytes: int = env('image_max_bytes', 8 * 1024 * 1024)
+    image_max_attachments: int = env('image_max_attachments', 4)
+    # Needs Pillow, without it the model gets the attachment URL
+    image_downsample_enabled: bool = env('image_downsample_enabled', True)
+    image_detail: str = env('image_detail', 'auto')
+    image_low_detail_max_side: int = env('image_low_detail_max_side', 512)
+    # High detail images are sent at most this big, the API itself stops at 2048 and 768 (shortest side)
+    image_max_side: int = env('image_max_side', 2048)
+    image_short_side: int = env('image_short_side', 512)
+    image_jpeg_quality: int = env('image_jpeg_quality', 85)
+
+    # Read when the bot starts, changing them requires a restart
+    open_ai_api_token: str = env('open_ai_api_token', '')
+    open_ai_base_url: str = env('open_ai_base_url', '')
+    open_ai_max_concurrent_requests: int = env('open_ai_max_concurrent_requests', 8)
+    open_ai_pool_max_connections: int = env('open_ai_pool_max_connections', 20)
+    open_ai_pool_max_keepalive_connections: int = env('open_ai_pool_max_keepalive_connections', 10)
+    open_ai_pool_keepalive_expiry: float = env('open_ai_pool_keepalive_expiry', 60.0)
+    open_ai_timeout: float = env('open_ai_timeout', 60.0)
+    open_ai_connect_timeout: float = env('open_ai_connect_timeout', 5.0)
+    open_ai_max_retries: int = env('open_ai_max_retries', 2)
+    # Seconds for a model call including retries and fallbacks, 0 waits as long as open_ai_timeout allows
+    open_ai_deadline: float = env('open_ai_deadline', 20.0)
+    # Seconds for one model of the chain, so a stalled model leaves time for the fallbacks; 0 = the whole deadline
+    open_ai_attempt_timeout: float = env('open_ai_attempt_timeout', 8.0)
+    # Tried in order after open_ai_model fails or times out, e.g. "gpt-4o-mini"
+    open_ai_fallback_models: str = env('open_ai_fallback_models', '')
+    # Duplicate request once a call is slower than the recent p95 (at least open_ai_hedge_min_delay seconds)
+    open_ai_hedge_enabled: bool = env('open_ai_hedge_enabled', False)
+    open_ai_hedge_min_delay: float = env('open_ai_hedge_min_delay', 1.0)
+    circuit_breaker_error_rate: float = env('circuit_breaker_error_rate', 0.5)
+    circuit_breaker_min_requests: int = env('circuit_breaker_min_requests', 10)
+    circuit_breaker_window: float = env('circuit_breaker_window', 30.0)
+    circuit_breaker_open_seconds: float = env('circuit_breaker_open_seconds', 15.0)
+    guild_quota_db_path: str = env('guild_quota_db_path', 'guild_quota.db')
+    guild_quota_flush_interval: float = env('guild_quota_flush_interval', 10.0)
+    guild_quota_retention_days: int = env('guild_quota_retention_days', 7)
+    settings_watch_interval: float = env('settings_watch_interval', 5.0)
+    # Canned responses, relative to the project directory; watched like the env file
+    resources_path: str = env('resources_path', 'resources')
+    log_format: str = env('log_format', 'text')
+    # Gateway: only the intents ReactionCog and the commands use, unless all are requested
+    discord_all_intents: bool = env('discord_all_intents', False)
+    # Sharded mode: shard_count > 0 runs AutoShardedBot, shard_processes > 1 splits the shards over processes
+    shard_count: int = env('shard_count', 0)
+    shard_processes: int = env('shard_processes', 1)
+    # Shards of this process, e.g. "0,1,2"; set by the launcher, or by hand when shards span several hosts
+    shard_ids: str = env('shard_ids', '')
+    shared_state_path: str = env('shared_state_path', 'shared_state.db')
+    # Seconds a rate limit check on the event loop waits for a locked shared_state_path before failing open
+    shared_state_busy_timeout: float = env('shared_state_busy_timeout', 0.05)
+    # Worker mode: > 0 queues replies for that many AI worker processes instead of answering in on_message
+    ai_workers: int = env('ai_workers', 0)
+    ai_worker_concurrency: int = env('ai_worker_concurrency', 8)
+    job_queue_path: str = env('job_queue_path', 'jobs.db')
+    job_queue_poll_interval: float = env('job_queue_poll_interval', 0.2)
+    # Enqueue and claim run in a thread, so they can wait for the other processes' writes
+    job_queue_busy_timeout: float = env('job_queue_busy_timeout', 5.0)
+    # Seconds a worker holds a job before another run of that worker may take it over
+    job_queue_lease: float = env('job_queue_lease', 300.0)
+    job_queue_max_attempts: int = env('job_queue_max_attempts', 3)
+    # Seconds finished jobs are kept to recognise a message delivered twice
+    job_queue_retention: float = env('job_queue_retention', 3600.0)
+    metrics_port: int = env('metrics_port', 0)
+    metrics_snapshot_path: str = env('metrics_snapshot_path', '')
+    metrics_snapshot_interval: float = env('metrics_snapshot_interval', 60.0)
+    metrics_loop_lag_interval: float = env('metrics_loop_lag_interval', 0.5)
+
+
+def parse_value(field_type, raw):
+    if field_type is bool:
+        return raw.strip().lower() in TRUE_VALUES
+    if field_type is frozenset:
+        return frozenset(int(item) for item in re.split(r'[\s,;]+', raw.strip()) if item)
+    if field_type is str:
+        return raw.strip()
+    return field_type(raw.strip())
+
+
+def validate(settings):
+    errors = []
+    if not isinstance(logging.getLevelName(settings.log_level.upper()), int):
+        errors.append(f"log_level: unknown level {settings.log_level}")
+    if settings.log_format not in ('text', 'json'):
+        errors.append("log_format: must be text or json")
+    if not 0 <= settings.open_ai_top_p <= 1:
+        errors.append("open_ai_top_p: must be between 0 and 1")
+    if not 0 <= settings.open_ai_temperature <= 2:
+        errors.append("open_ai_temperature: must be between 0 and 2")
+    if settings.rate_limit_algorithm not in ('token_bucket', 'sliding_window'):
+        errors.append("rate_limit_algorithm: must be token_bucket or sliding_window")
+    try:
+        if settings.small_talk_guilds:
+            json.loads(settings.small_talk_guilds)
+    except ValueError as e:
+        errors.append(f"small_talk_guilds: not valid JSON ({e})")
+    if settings.shard_processes < 1 or (settings.shard_processes > 1 and settings.shard_count < settings.shard_processes):
+        errors.append("shard_processes: must be at least 1 and not more than shard_count")
+    if settings.ai_workers and settings.shard_processes > 1:
+        errors.append("ai_workers: not supported together with shard_processes")
+    if settings.ai_workers and settings.open_ai_tools_enabled:
+        # The activity index behind get_user_activity is only filled in the gateway process
+        errors.append("ai_workers: not supported together with open_ai_tools_enabled")
+    if settings.ai_worker_concurrency < 1 or settings.job_queue_max_attempts < 1:
+        errors.append("ai_worker_concurrency, job_queue_max_attempts: must be at least 1")
+    if not 0 < settings.circuit_breaker_error_rate <= 1:
+        errors.append("circuit_breaker_error_rate: must be above 0 and at most 1")
+    if settings.activity_bucket_seconds < 1 or settings.activity_buckets < 1:
+        errors.append("activity_bucket_seconds, activity_buckets: must be at least 1")
+    if settings.image_detail not in ('auto', 'low', 'high'):
+        errors.append("image_detail: must be auto, low or high")
+    if not 1 <= settings.image_jpeg_quality <= 95:
+        errors.append("image_jpeg_quality: must be between 1 and 95")
+    if settings.image_max_side < 1 or settings.image_short_side < 1:
+        errors.append("image_max_side, image_short_side: must be at least 1")
+    if settings.scheduler_max_concurrency < 1 or settings.open_ai_max_concurrent_requests < 1:
+        errors.append("scheduler_max_concurrency, open_ai_max_concurrent_requests: must be at least 1")
+    for field in dataclasses.fields(settings):
+        value = getattr(settings, field.name)
+        if field.type in (int, float) and value < 0:
+            errors.append(f"{field.metadata['env']}: must not be negative")
+    return errors
+
+
+def load_settings():
+    values = {}
+    errors = []
+    for field in dataclasses.fields(Settings):
+        raw = os.getenv(field.metadata['env'])
+        if raw is None or (not raw.strip() and field.type is not str):
+            continue
+        try:
+            values[field.name] = parse_value(field.type, raw)
+        except ValueError:
+            errors.append(f"{field.metadata['env']}: cannot parse {raw!r} as {field.type.__name__}")
+    for name in PROCESS_PATHS:
+        if values.get(name) and _process_suffix:
+            values[name] += _process_suffix
+    settings = Settings(**values)
+    errors.extend(validate(settings))
+    if errors:
+        raise ValueError("Invalid settings: " + "; ".join(errors))
+    return settings
+
+
+_settings = None
+_reload_listeners = []
+# Files each AI worker process keeps for itself, see set_process_suffix
+PROCESS_PATHS = ('memory_path', 'response_cache_path')
+_process_suffix = ''
+
+
+def get_settings():
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
+
+
+def set_process_suffix(suffix):
+    """Appends suffix to the PROCESS_PATHS of this process, e.g. '.0' for AI worker 0; kept across reloads."""
+    global _settings, _process_suffix
+    _process_suffix = suffix
+    _settings = None
+
+
+def on_reload(listener):
+    """Registers listener(settings) called after every successful reload."""
+    _reload_listeners.append(listener)
+    return listener
+
+
+def reload_settings(env_file=ENV_FILE):
+    global _settings
+    load_dotenv(env_file, override=True)
+    try:
+        settings = load_settings()
+    except ValueError as e:
+        logging.error(f"Settings not reloaded, keeping the previous ones. {e}")
+        return _settings
+    _settings = settings
+    for listener in _reload_listeners:
+        try:
+            listener(settings)
+        except Exception as e:
+            logging.error(f"Error in settings reload listener {listener}: {e}")
+    logging.info("Settings reloaded.")
+    return settings
+
+
+def install_reload_signal(loop, env_file=ENV_FILE):
+    # SIGHUP is not available on Windows
+    if hasattr(signal, 'SIGHUP'):
+        loop.add_signal_handler(signal.SIGHUP, reload_settings, env_file)
+
+
+async def watch_settings_file(env_file=ENV_FILE):
+    """Reloads the settings whenever the env file changes on disk."""
+    last_mtime = os.path.getmtime(env_file) if os.path.exists(env_file) else None
+    while True:
+        await asyncio.sleep(get_settings().settings_watch_interval or 5.0)
+        mtime = os.path.getmtime(env_file) if os.path.exists(env_file) else None
+        if mtime != last_mtime:
+            last_mtime = mtime
+            reload_settings(env_file)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import discord
+
+# Discord allows one IDENTIFY per 5 seconds for bots without large-bot sharding
+IDENTIFY_INTERVAL = 5.0
+
+
+def get_intents(settings):
+    if settings.discord_all_intents:
+        return discord.Intents.all()
+    # Guild and DM messages with their content and the guild/channel cache; no presence, member or typing events
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    # !mow and !exit are also sent to the bot by DM
+    intents.dm_messages = True
+    intents.message_content = True
+    return intents
+
+
+def shard_for_guild(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+
+def shard_ranges(shard_count, processes):
+    """Splits shards 0..shard_count-1 into contiguous ranges, one per process."""
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def parse_shard_ids(value):
+    if not value.strip():
+        return None
+    return [int(shard_id) for shard_id in value.replace(' ', '').split(',') if shard_id]
+
+
+def run_shard_processes(settings):
+    """Starts one bot process per shard range and waits for them, stopping all of them on exit."""
+    processes = []
+    try:
+        for shard_ids in shard_ranges(settings.shard_count, settings.shard_processes):
+            environment = dict(os.environ, shard_ids=','.join(str(shard_id) for shard_id in shard_ids))
+            processes.append(subprocess.Popen([sys.executable, *sys.argv], env=environment))
+            logging.info(f"Started shard process {processes[-1].pid} for shards {shard_ids}.")
+            # Processes identify one after another, each waits for the shards of the previous one
+            time.sleep(IDENTIFY_INTERVAL * len(shard_ids))
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        for process in processes:
+            if process.poll() is not None:
+                logging.error(f"Shard process {process.pid} exited with {process.returncode}, stopping the others.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in processes:
+            process.wait()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import logging
+import sqlite3
+import threading
+import time
+
+from services.settings import get_settings
+
+
+def uses_shared_state(settings=None):
+    """Several shard or AI worker processes on this host share the limits through SQLite."""
+    settings = settings or get_settings()
+    return settings.shard_processes > 1 or settings.ai_workers > 1
+
+
+class SharedCounters:
+    """Fixed-window counters in a SQLite file shared by every shard process on the host.
+
+    Each check-and-add is one UPSERT statement, so it is atomic across processes
+    without holding a lock between calls. The calls run on the event loop, so a
+    file locked by another process is waited for at most shared_state_busy_timeout
+    and then the limits fail open: the check passes and the count is skipped.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.last_prune = 0.0
+
+    def open(self):
+        if self.db is not None:
+            return
+        settings = get_settings()
+        # Autocommit, every statement is its own short write transaction
+        self.db = sqlite3.connect(settings.shared_state_path, check_same_thread=False, isolation_level=None,
+                                  timeout=settings.shared_state_busy_timeout)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "key TEXT NOT NULL, window INTEGER NOT NULL, count INTEGER NOT NULL, expires REAL NOT NULL, "
+            "PRIMARY KEY (key, window)) WITHOUT ROWID")
+        logging.info(f"Shared state opened at {settings.shared_state_path}.")
+
+    def _execute(self, sql, parameters):
+        """Returns the cursor, or None when the file stayed locked or could not be written."""
+        if self.db is None:
+            self.open()
+        try:
+            with self.db_lock:
+                return self.db.execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            logging.warning("Shared state not available, limits fail open: %s", e, extra={'throttle': True})
+            return None
+
+    def try_add(self, key, limit, seconds, amount=1, now=None):
+        """Adds amount to the current window of key unless that would go over limit."""
+        now = time.time() if now is None else now
+        window = int(now // seconds)
+        amount = min(amount, limit)
+        cursor = self._execute(
+            "INSERT INTO counters (key, window, count, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key, window) DO UPDATE SET count = count + excluded.count "
+            "WHERE count + excluded.count <= ?", (key, window, amount, (window + 1) * seconds, limit))
+        self._prune(now)
+        return cursor is None or cursor.rowcount == 1
+
+    def add(self, key, seconds, amount=1, now=None):
+        now = time.time() if now is None else now
+        window = int(now // seconds)
+        self._execute(
+            "INSERT INTO counters (key, window, count, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key, window) DO UPDATE SET count = count + excluded.count",
+            (key, window, amount, (window + 1) * seconds))
+        self._prune(now)
+
+    def used(self, key, seconds, now=None):
+        now = time.time() if now is None else now
+        cursor = self._execute("SELECT count FROM counters WHERE key = ? AND window = ?", (key, int(now // seconds)))
+        row = cursor.fetchone() if cursor is not None else None
+        return row[0] if row else 0
+
+    def _prune(self, now):
+        if now - self.last_prune < 60:
+            return
+        self.last_prune = now
+        self._execute("DELETE FROM counters WHERE expires < ?", (now,))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+shared_counters = SharedCounters()
+
+
+class SharedRateLimiter:
+    """RateLimiter counterpart for sharded mode: a fixed window per key in the shared store."""
+
+    def __init__(self, scope, limit, period):
+        self.scope = scope
+        self.limit = limit
+        self.period = period
+
+    def peek(self, key, now=None):
+        return shared_counters.used(f"{self.scope}:{key}", self.period, now=now) < self.limit
+
+    def allow(self, key, now=None):
+        return shared_counters.try_add(f"{self.scope}:{key}", self.limit, self.period, now=now)
+
+
+class SharedBudget:
+    """Budget counterpart for sharded mode: one per-minute window shared by all shard processes."""
+
+    def __init__(self, name, per_minute):
+        self.key = f"budget:{name}"
+        self.capacity = per_minute
+
+    def delay(self, amount):
+        if not self.capacity:
+            return 0.0
+        now = time.time()
+        if shared_counters.used(self.key, 60, now) + min(amount, self.capacity) <= self.capacity:
+            return 0.0
+        return 60 - now % 60
+
+    def consume(self, amount):
+        if self.capacity:
+            shared_counters.add(self.key, 60, min(amount, self.capacity))
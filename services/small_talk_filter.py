@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import json
+import random
+import re
+import time
+from collections import OrderedDict
+
+from services.message_cache import message_cache
+from services.settings import get_settings, on_reload
+
+URL_PATTERN = re.compile(r'https?://\S+')
+DISCORD_TOKEN_PATTERN = re.compile(r'<(?:a?:\w+:|@[!&]?|#)\d+>')
+CUSTOM_EMOJI_PATTERN = re.compile(r'<a?:\w+:\d+>')
+EMOJI_PATTERN = re.compile('[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]')
+WORD_PATTERN = re.compile(r'[^\W\d_]{2,}')
+POLISH_LETTERS = frozenset('ąćęłńóśźżĄĆĘŁŃÓŚŹŻ')
+POLISH_WORDS = frozenset((
+    'nie', 'to', 'jest', 'się', 'że', 'co', 'jak', 'ale', 'czy', 'tak', 'do', 'na', 'ja', 'ty', 'mi', 'już',
+    'jeszcze', 'ktoś', 'dziś', 'bo', 'no', 'tu', 'tam', 'kto', 'gdzie', 'mam', 'ma', 'jestem', 'też', 'może',
+))
+# Bot replies among the last messages of a channel that make a random reply less welcome
+RECENT_BOT_MESSAGES = 3
+WORDS_FOR_FULL_LENGTH = 8
+
+
+def score_text(text):
+    """Rates how worth a random reply a message is, from 0 (link, emoji, one word) to 1."""
+    has_link = URL_PATTERN.search(text) is not None
+    emoji = len(CUSTOM_EMOJI_PATTERN.findall(text))
+    text = DISCORD_TOKEN_PATTERN.sub(' ', URL_PATTERN.sub(' ', text))
+    emoji += len(EMOJI_PATTERN.findall(text))
+    words = WORD_PATTERN.findall(text)
+    if len(words) < 2:
+        return 0.0
+    length = min(1.0, len(words) / WORDS_FOR_FULL_LENGTH)
+    if not POLISH_LETTERS.isdisjoint(text) or not POLISH_WORDS.isdisjoint(text.lower().split()):
+        language = 1.0
+    elif text.isascii():
+        language = 0.5
+    else:
+        language = 0.2
+    emoji_ratio = emoji / (emoji + len(words))
+    score = 0.5 * length + 0.3 * language + 0.2 * (1.0 - emoji_ratio)
+    if '?' in text:
+        score += 0.1
+    if has_link:
+        score *= 0.6
+    return min(1.0, score)
+
+
+class GuildSmallTalk:
+    __slots__ = ('chance', 'min_score', 'cooldown')
+
+    def __init__(self, chance, min_score, cooldown):
+        self.chance = chance
+        self.min_score = min_score
+        self.cooldown = cooldown
+
+
+def parse_guild_overrides(value, defaults):
+    # small_talk_guilds='{"123456789": {"chance": 0.2, "cooldown": 600}, "987654321": {"chance": 0}}'
+    overrides = {}
+    for guild_id, config in (json.loads(value) if value.strip() else {}).items():
+        overrides[int(guild_id)] = GuildSmallTalk(
+            float(config.get('chance', defaults.chance)),
+            float(config.get('min_score', defaults.min_score)),
+            float(config.get('cooldown', defaults.cooldown)),
+        )
+    return overrides
+
+
+class SmallTalkFilter:
+    """Decides whether a message gets a random reply before anything expensive happens.
+
+    Cheapest checks first: the channel cooldown, then the random roll, then the
+    local score of the message text and the bot's recent activity in the channel.
+    """
+
+    def __init__(self):
+        self.defaults = None
+        self.guilds = {}
+        self.last_reply = OrderedDict()
+        self.max_channels = 10000
+
+    def load(self, settings=None):
+        settings = settings or get_settings()
+        self.defaults = GuildSmallTalk(settings.small_talk_chance, settings.small_talk_min_score,
+                                       settings.small_talk_cooldown)
+        self.guilds = parse_guild_overrides(settings.small_talk_guilds, self.defaults)
+
+    def config(self, guild_id):
+        if self.defaults is None:
+            self.load()
+        return self.guilds.get(guild_id, self.defaults)
+
+    def score(self, message):
+        score = score_text(message.content)
+        buffer = message_cache.channels.get(message.channel.id)
+        if buffer is not None and score:
+            recent = list(buffer.messages)[-RECENT_BOT_MESSAGES - 1:]
+            if any(cached.is_bot for cached in recent):
+                score *= 0.5
+        return score
+
+    def should_reply(self, message, now=None):
+        """Returns (decision, reason); a positive decision starts the channel cooldown."""
+        config = self.config(message.guild.id)
+        now = time.monotonic() if now is None else now
+        channel_id = message.channel.id
+        last_reply = self.last_reply.get(channel_id)
+        if last_reply is not None and now - last_reply < config.cooldown:
+            return False, 'cooldown'
+        if random.random() >= config.chance:
+            return False, 'chance'
+        score = self.score(message)
+        if score < config.min_score:
+            return False, f'score {score:.2f}'
+        self.last_reply[channel_id] = now
+        self.last_reply.move_to_end(channel_id)
+        while len(self.last_reply) > self.max_channels:
+            self.last_reply.popitem(last=False)
+        return True, f'score {score:.2f}'
+
+
+small_talk_filter = SmallTalkFilter()
+on_reload(small_talk_filter.load)
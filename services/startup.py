@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import time
+
+from discord.ext import commands
+
+from services.metrics import metrics
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COGS_PACKAGE = 'modules'
+SKIPPED_COGS = ('__init__',)
+
+
+class StartupReport:
+    """Durations of the startup phases in setup_hook, logged once the bot is ready."""
+
+    def __init__(self):
+        # Taken when the entry script imports this module
+        self.started = time.monotonic()
+        self.phases = {}
+        self.ready_after = None
+
+    async def timed(self, name, awaitable):
+        started = time.monotonic()
+        try:
+            return await awaitable
+        finally:
+            self.phases[name] = time.monotonic() - started
+
+    def mark_ready(self):
+        self.ready_after = time.monotonic() - self.started
+        metrics.gauge('warchlak_startup_seconds', lambda: self.ready_after)
+
+    def summary(self):
+        return ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+
+
+def discover_cogs(package=COGS_PACKAGE):
+    directory = os.path.join(PROJECT_DIRECTORY, package)
+    return sorted(f"{package}.{filename[:-3]}" for filename in os.listdir(directory)
+                  if filename.endswith('.py') and filename[:-3] not in SKIPPED_COGS)
+
+
+async def load_cogs(bot, package=COGS_PACKAGE):
+    """Loads the cogs of package concurrently; one that fails is logged and the others still load."""
+
+    async def load(name):
+        if name in bot.extensions:
+            return
+        try:
+            await bot.load_extension(name)
+            logging.info(f'Loaded cog: {name}')
+        except commands.ExtensionError as e:
+            logging.error(f'Error loading cog {name}: {e}', exc_info=e)
+
+    await asyncio.gather(*(load(name) for name in discover_cogs(package)))
+
+
+def log_settings(settings):
+    logging.info(f'Log level: {settings.log_level}')
+    logging.info(f'Enable AI (OpenAI): {settings.enabled_ai}')
+    logging.info(f'Message history enabled: {settings.message_history_enabled}')
+    logging.info(f'Message history limit: {settings.message_history_limit}')
+    logging.info(f'OpenAI model: {settings.open_ai_model}')
+    logging.info(f'OpenAI max tokens: {settings.open_ai_max_tokens}')
+    logging.info(f'OpenAI temperature: {settings.open_ai_temperature}')
+    logging.info(f'OpenAI top p: {settings.open_ai_top_p}')
+    logging.info(f'OpenAI enabled images analysis: {settings.enabled_image_ai_analyze}')
+    logging.info(f'Max messages per day: {settings.max_messages_per_guild_per_day}')
+
+
+startup_report = StartupReport()
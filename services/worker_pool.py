@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import sys
+
+from services.conversation_memory import conversation_memory
+from services.job_queue import job_queue
+from services.message_cache import message_cache
+from services.settings import get_settings
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worker.py')
+
+
+async def enqueue_reply(message, kind, priority):
+    """Gateway side: queues a compact record of the message and the history its reply needs."""
+    settings = get_settings()
+    history = []
+    if settings.message_history_enabled:
+        limit = settings.message_history_limit
+        if conversation_memory.is_enabled():
+            limit = max(limit, conversation_memory.window)
+        history = await message_cache.history(message, limit)
+    locale = getattr(message.guild, 'preferred_locale', None)
+    payload = {
+        'kind': kind,
+        'priority': priority,
+        'guild_id': message.guild.id,
+        'channel_id': message.channel.id,
+        'message_id': message.id,
+        'author': [message.author.id, message.author.display_name],
+        'content': message.content,
+        'locale': str(locale) if locale else None,
+        'history': [[cached.id, cached.author_id, cached.author_name, cached.is_bot, cached.content]
+                    for cached in history],
+    }
+    # In a thread, the queue file is shared with the workers and may be locked for a moment
+    if not await asyncio.to_thread(job_queue.enqueue, f"{kind}:{message.id}", message.guild.id, priority, payload):
+        logging.info("Message %s is already queued.", message.id)
+
+
+class WorkerPool:
+    """Gateway side: starts ai_workers worker processes and restarts the ones that exit."""
+
+    def __init__(self):
+        self.processes = {}
+        self.task = None
+
+    async def _spawn(self, index, workers):
+        self.processes[index] = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT, str(index), str(workers))
+        logging.info(f"Started AI worker {index} as process {self.processes[index].pid}.")
+
+    async def _supervise(self, workers):
+        while True:
+            await asyncio.sleep(1)
+            for index, process in list(self.processes.items()):
+                if process.returncode is not None:
+                    logging.error(f"AI worker {index} exited with {process.returncode}, restarting it.")
+                    await self._spawn(index, workers)
+
+    async def start(self):
+        workers = get_settings().ai_workers
+        if not workers:
+            return
+        job_queue.open()
+        for index in range(workers):
+            await self._spawn(index, workers)
+        self.task = asyncio.create_task(self._supervise(workers))
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
+        for process in self.processes.values():
+            try:
+                await asyncio.wait_for(process.wait(), 10)
+            except asyncio.TimeoutError:
+                process.kill()
+        self.processes.clear()
+        job_queue.close()
+
+
+worker_pool = WorkerPool()
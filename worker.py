@@ -0,0 +1,50 @@
+"""AI worker process, started by main.py when ai_workers > 0: python worker.py <index> <workers>"""
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+import discord
+from dotenv import load_dotenv
+
+from services.ai_worker import run_worker
+from services.log_setup import setup_logging
+from services.settings import install_reload_signal, set_process_suffix, watch_settings_file
+
+index, workers = int(sys.argv[1]), int(sys.argv[2])
+load_dotenv(".env")
+# Every worker keeps its own conversation memory and response cache file
+set_process_suffix(f".{index}")
+setup_logging()
+
+# REST only, the worker posts replies but never connects to the gateway
+bot = discord.Client(intents=discord.Intents.none())
+
+
+def get_channel(channel_id, guild_id):
+    return bot.get_partial_messageable(channel_id, guild_id=guild_id)
+
+
+async def main():
+    task = asyncio.current_task()
+    # The pool stops its workers with SIGTERM; on Windows terminate() kills them and the loop has no signal handlers
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    except NotImplementedError:
+        pass
+    # .env changes reach the workers like the bot, the paths keep their suffix
+    install_reload_signal(asyncio.get_running_loop())
+    settings_watcher = asyncio.create_task(watch_settings_file())
+    try:
+        await bot.login(os.getenv("BOT_TOKEN"))
+        await run_worker(index, workers, get_channel)
+    except asyncio.CancelledError:
+        logging.info(f"AI worker {index} stopped.")
+    finally:
+        settings_watcher.cancel()
+        await bot.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())